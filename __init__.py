@@ -16,11 +16,20 @@ __license__ = "MIT"
 import os
 import json
 import sys
-from aiohttp import web
-import server
+import time
+import asyncio
+# 在ComfyUI之外（如命令行工具）导入时，server 和 aiohttp 可能不可用，此时不注册API路由
+try:
+    from aiohttp import web
+    import server
+except ImportError:
+    web = None
+    server = None
+
+from .nodes.logger import configure_from_settings, get_logger, recent_logs
 
-print("--- [云岚AI] ---")
-print("开始加载云岚AI自定义节点...")
+logger = get_logger()
+logger.info("开始加载云岚AI自定义节点...")
 
 # --- 依赖检查 ---
 def check_dependencies():
@@ -29,19 +38,19 @@ def check_dependencies():
 
     try:
         import openai
-        print(f"[云岚AI] OpenAI 库版本: {openai.__version__}")
+        logger.debug("OpenAI 库版本: %s", openai.__version__)
     except ImportError:
         missing_deps.append("openai>=1.0.0")
 
     try:
         import requests
-        print(f"[云岚AI] Requests 库版本: {requests.__version__}")
+        logger.debug("Requests 库版本: %s", requests.__version__)
     except ImportError:
         missing_deps.append("requests>=2.25.0")
 
     try:
         import PIL
-        print(f"[云岚AI] Pillow 库版本: {PIL.__version__}")
+        logger.debug("Pillow 库版本: %s", PIL.__version__)
     except ImportError:
         missing_deps.append("Pillow>=8.0.0")
 
@@ -49,24 +58,22 @@ def check_dependencies():
     try:
         import torch
         import numpy as np
-        print(f"[云岚AI] PyTorch 和 NumPy 已可用")
+        logger.debug("PyTorch 和 NumPy 已可用")
     except ImportError as e:
-        print(f"[云岚AI] 警告: {e}")
+        logger.warning("警告: %s", e)
 
     if missing_deps:
-        print(f"[云岚AI] 错误: 缺少以下依赖包:")
-        for dep in missing_deps:
-            print(f"  - {dep}")
-        print(f"[云岚AI] 请运行: pip install {' '.join(missing_deps)}")
+        logger.error("错误: 缺少以下依赖包:\n%s", "\n".join(f"  - {dep}" for dep in missing_deps))
+        logger.info("请运行: pip install %s", ' '.join(missing_deps))
         return False
 
-    print("[云岚AI] 所有依赖检查通过")
+    logger.info("所有依赖检查通过")
     return True
 
 # 执行依赖检查
 if not check_dependencies():
-    print("[云岚AI] 由于依赖缺失，部分功能可能无法正常工作")
-    print("[云岚AI] 请安装缺失的依赖包后重启ComfyUI")
+    logger.warning("由于依赖缺失，部分功能可能无法正常工作")
+    logger.warning("请安装缺失的依赖包后重启ComfyUI")
     
 # --- Helper Functions ---
 def get_api_settings():
@@ -74,21 +81,21 @@ def get_api_settings():
     settings_path = os.path.join(os.path.dirname(__file__), "settings.json")
     try:
         if not os.path.exists(settings_path):
-            print("[云岚AI] 警告: settings.json 文件不存在，返回空设置")
+            logger.warning("警告: settings.json 文件不存在，返回空设置")
             return {}
 
         with open(settings_path, 'r', encoding='utf-8') as f:
             settings = json.load(f)
-            print("[云岚AI] 成功加载API设置")
+            logger.debug("成功加载API设置")
             return settings
     except json.JSONDecodeError as e:
-        print(f"[云岚AI] 错误: settings.json 格式错误 - {e}")
+        logger.error("错误: settings.json 格式错误 - %s", e)
         return {}
     except PermissionError:
-        print(f"[云岚AI] 错误: 无权限读取 {settings_path}")
+        logger.error("错误: 无权限读取 %s", settings_path)
         return {}
     except Exception as e:
-        print(f"[云岚AI] 错误: 加载API设置时发生未知错误 - {e}")
+        logger.error("错误: 加载API设置时发生未知错误 - %s", e)
         return {}
 
 def get_prompts():
@@ -98,30 +105,63 @@ def get_prompts():
 
     try:
         if not os.path.exists(prompts_path):
-            print("[云岚AI] prompts.json 文件不存在，创建默认提示词文件")
+            logger.info("prompts.json 文件不存在，创建默认提示词文件")
             # 创建默认提示词文件
             try:
                 with open(prompts_path, 'w', encoding='utf-8') as f:
                     json.dump(default_prompts, f, ensure_ascii=False, indent=4)
-                print("[云岚AI] 成功创建默认提示词文件")
+                logger.info("成功创建默认提示词文件")
             except Exception as e:
-                print(f"[云岚AI] 错误: 无法创建默认提示词文件 - {e}")
+                logger.error("错误: 无法创建默认提示词文件 - %s", e)
             return default_prompts
 
         with open(prompts_path, 'r', encoding='utf-8') as f:
             prompts = json.load(f)
-            print("[云岚AI] 成功加载提示词")
+            logger.debug("成功加载提示词")
             return prompts
     except json.JSONDecodeError as e:
-        print(f"[云岚AI] 错误: prompts.json 格式错误 - {e}，使用默认提示词")
+        logger.error("错误: prompts.json 格式错误 - %s，使用默认提示词", e)
         return default_prompts
     except PermissionError:
-        print(f"[云岚AI] 错误: 无权限读取 {prompts_path}，使用默认提示词")
+        logger.error("错误: 无权限读取 %s，使用默认提示词", prompts_path)
         return default_prompts
     except Exception as e:
-        print(f"[云岚AI] 错误: 加载提示词时发生未知错误 - {e}，使用默认提示词")
+        logger.error("错误: 加载提示词时发生未知错误 - %s，使用默认提示词", e)
         return default_prompts
     
+# 按设置调整日志级别
+configure_from_settings(get_api_settings())
+
+# --- 变更通知 ---
+# 提示词/设置每次保存后递增修订号，并通过ComfyUI的websocket广播，
+# 前端共享的数据仓库按修订号只拉取一次，再统一更新所有节点的控件。
+# 初始值取启动时间，避免重启后前端误以为数据未变化。
+_revisions = {"prompts": int(time.time()), "settings": int(time.time()), "models": int(time.time())}
+
+def broadcast_change(kind):
+    """递增修订号并向前端广播变更事件"""
+    _revisions[kind] += 1
+    revision = _revisions[kind]
+    if server is None:
+        return revision
+    try:
+        server.PromptServer.instance.send_sync(f"yunlan.{kind}.changed", {"revision": revision})
+    except Exception as e:
+        logger.warning("警告: 广播%s变更事件失败 - %s", kind, e)
+    return revision
+
+def prepare_connections(settings):
+    """在后台预热API连接（如已开启），随后按需刷新模型列表；不会阻塞调用方"""
+    from .nodes.model_catalog import get_model_catalog
+    from .nodes.warmup import start_warmup
+
+    catalog = get_model_catalog()
+    # 预热请求的 /models 结果直接写入模型列表缓存，预热结束后缓存仍有效时不会再请求一次；
+    # 预热失败（或网关不支持 /models）时才由模型列表自行获取
+    if not start_warmup(settings, on_done=lambda: catalog.cached_models(settings),
+                        on_models=lambda models: catalog.update(settings, models)):
+        catalog.cached_models(settings)
+
 # --- API Endpoints ---
 async def save_settings(request):
     """安全地保存API设置"""
@@ -133,17 +173,26 @@ async def save_settings(request):
         if not isinstance(data, dict):
             return web.json_response({'status': 'error', 'message': '无效的数据格式'}, status=400)
 
+        # 与现有设置合并，保留前端界面不管理的配置项（如 modelLimits）
+        settings = get_api_settings()
+        settings.update(data)
+
         with open(settings_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+            json.dump(settings, f, ensure_ascii=False, indent=4)
+
+        logger.info("成功保存API设置")
+        configure_from_settings(settings)
+        revision = broadcast_change("settings")
 
-        print("[云岚AI] 成功保存API设置")
-        return web.json_response({'status': 'ok'})
+        # 重新预热连接，API地址或Key变化后在后台重新获取模型列表
+        prepare_connections(settings)
+        return web.json_response({'status': 'ok', 'revision': revision})
     except json.JSONDecodeError:
         return web.json_response({'status': 'error', 'message': '无效的JSON数据'}, status=400)
     except PermissionError:
         return web.json_response({'status': 'error', 'message': '无权限写入设置文件'}, status=500)
     except Exception as e:
-        print(f"[云岚AI] 错误: 保存设置时发生错误 - {e}")
+        logger.error("错误: 保存设置时发生错误 - %s", e)
         return web.json_response({'status': 'error', 'message': f'保存失败: {str(e)}'}, status=500)
 
 async def load_settings(request):
@@ -152,7 +201,7 @@ async def load_settings(request):
         settings = get_api_settings()
         return web.json_response(settings)
     except Exception as e:
-        print(f"[云岚AI] 错误: 加载设置时发生错误 - {e}")
+        logger.error("错误: 加载设置时发生错误 - %s", e)
         return web.json_response({'status': 'error', 'message': f'加载失败: {str(e)}'}, status=500)
 
 async def save_prompts(request):
@@ -168,14 +217,15 @@ async def save_prompts(request):
         with open(prompts_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=4)
 
-        print("[云岚AI] 成功保存提示词")
-        return web.json_response({'status': 'ok'})
+        logger.info("成功保存提示词")
+        revision = broadcast_change("prompts")
+        return web.json_response({'status': 'ok', 'revision': revision})
     except json.JSONDecodeError:
         return web.json_response({'status': 'error', 'message': '无效的JSON数据'}, status=400)
     except PermissionError:
         return web.json_response({'status': 'error', 'message': '无权限写入提示词文件'}, status=500)
     except Exception as e:
-        print(f"[云岚AI] 错误: 保存提示词时发生错误 - {e}")
+        logger.error("错误: 保存提示词时发生错误 - %s", e)
         return web.json_response({'status': 'error', 'message': f'保存失败: {str(e)}'}, status=500)
 
 async def load_prompts(request):
@@ -184,7 +234,7 @@ async def load_prompts(request):
         prompts = get_prompts()
         return web.json_response(prompts)
     except Exception as e:
-        print(f"[云岚AI] 错误: 加载提示词时发生错误 - {e}")
+        logger.error("错误: 加载提示词时发生错误 - %s", e)
         return web.json_response({'status': 'error', 'message': f'加载失败: {str(e)}'}, status=500)
 
 async def get_prompt_names(request):
@@ -193,9 +243,98 @@ async def get_prompt_names(request):
         prompts = get_prompts()
         return web.json_response(list(prompts.keys()))
     except Exception as e:
-        print(f"[云岚AI] 错误: 获取提示词名称时发生错误 - {e}")
+        logger.error("错误: 获取提示词名称时发生错误 - %s", e)
         return web.json_response({'status': 'error', 'message': f'获取失败: {str(e)}'}, status=500)
 
+async def get_revisions(request):
+    """获取提示词和设置的当前修订号"""
+    return web.json_response(dict(_revisions))
+
+async def get_batch_status(request):
+    """获取批处理队列和任务状态"""
+    try:
+        from .nodes.batch_jobs import get_batch_manager
+        return web.json_response(get_batch_manager().summary())
+    except Exception as e:
+        logger.error("错误: 获取批处理状态时发生错误 - %s", e)
+        return web.json_response({'status': 'error', 'message': f'获取失败: {str(e)}'}, status=500)
+
+async def submit_batch(request):
+    """立即提交待处理的批处理请求，并启动后台轮询"""
+    try:
+        from .nodes.api_client import use_openai_client
+        from .nodes.api_nodes import start_batch_polling
+        from .nodes.batch_jobs import get_batch_manager
+
+        manager = get_batch_manager()
+        settings = get_api_settings()
+
+        def submit():
+            with use_openai_client(settings) as client:
+                return manager.submit(client)
+
+        loop = asyncio.get_running_loop()
+        batch_id = await loop.run_in_executor(None, submit)
+        if manager.has_active_jobs():
+            start_batch_polling()
+        return web.json_response({'status': 'ok', 'batch_id': batch_id, 'summary': manager.summary()})
+    except Exception as e:
+        logger.error("错误: 提交批处理任务时发生错误 - %s", e)
+        return web.json_response({'status': 'error', 'message': f'提交失败: {str(e)}'}, status=500)
+
+async def get_usage(request):
+    """汇总最近几天的Token用量和费用（?days=7）"""
+    try:
+        from .nodes.usage_store import get_usage_store
+        try:
+            days = int(request.query.get("days", 7))
+        except ValueError:
+            days = 7
+        loop = asyncio.get_running_loop()
+        summary = await loop.run_in_executor(None, get_usage_store().summary, days, get_api_settings())
+        return web.json_response(summary)
+    except Exception as e:
+        logger.error("错误: 获取用量统计时发生错误 - %s", e)
+        return web.json_response({'status': 'error', 'message': f'获取失败: {str(e)}'}, status=500)
+
+async def get_models(request):
+    """获取模型列表（?refresh=1 时等待重新获取网关的 /v1/models）"""
+    try:
+        from .nodes.model_catalog import get_model_catalog
+        catalog = get_model_catalog()
+        settings = get_api_settings()
+        if request.query.get("refresh") in ("1", "true"):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, catalog.refresh, settings)
+        return web.json_response(catalog.status(settings))
+    except Exception as e:
+        logger.error("错误: 获取模型列表时发生错误 - %s", e)
+        return web.json_response({'status': 'error', 'message': f'获取失败: {str(e)}'}, status=500)
+
+async def get_warmup_status(request):
+    """获取最近一次连接预热的耗时"""
+    from .nodes.warmup import warmup_status
+    return web.json_response(warmup_status())
+
+async def get_coordination_status(request):
+    """获取跨进程协调的并发、排队和速率计数"""
+    try:
+        from .nodes.coordination import get_coordinator
+        loop = asyncio.get_running_loop()
+        status = await loop.run_in_executor(None, get_coordinator().status, get_api_settings())
+        return web.json_response(status)
+    except Exception as e:
+        logger.error("错误: 获取协调状态时发生错误 - %s", e)
+        return web.json_response({'status': 'error', 'message': f'获取失败: {str(e)}'}, status=500)
+
+async def get_logs(request):
+    """获取最近的插件日志（?limit=200&level=WARNING）"""
+    try:
+        limit = int(request.query.get("limit", 200))
+    except ValueError:
+        limit = 200
+    return web.json_response(recent_logs(max(1, limit), request.query.get("level")))
+
 # --- Node and Route Registration ---
 try:
     from .nodes import api_nodes
@@ -203,35 +342,61 @@ try:
     # 确保节点映射正确导出
     NODE_CLASS_MAPPINGS = {**api_nodes.NODE_CLASS_MAPPINGS}
     NODE_DISPLAY_NAME_MAPPINGS = {**api_nodes.NODE_DISPLAY_NAME_MAPPINGS}
-    print(f"[云岚AI] 成功注册 {len(NODE_CLASS_MAPPINGS)} 个节点")
-    print(f"[云岚AI] 节点列表: {list(NODE_CLASS_MAPPINGS.keys())}")
+    logger.info("成功注册 %d 个节点", len(NODE_CLASS_MAPPINGS))
+    logger.debug("节点列表: %s", list(NODE_CLASS_MAPPINGS.keys()))
+
+    # 重启后继续跟踪未完成的批处理任务（仅在ComfyUI中运行时）
+    from .nodes.batch_jobs import get_batch_manager
+    if server is not None and get_batch_manager().has_active_jobs():
+        api_nodes.start_batch_polling()
+
+    # 在后台预热连接并预取网关的模型列表，获取到新列表后通知前端刷新下拉框
+    if server is not None:
+        from .nodes.model_catalog import get_model_catalog
+        get_model_catalog().on_update = lambda: broadcast_change("models")
+        prepare_connections(get_api_settings())
 
 except ImportError as e:
-    print(f"[云岚AI] 错误: 无法导入节点模块 - {e}")
-    print("[云岚AI] 提供空的节点映射以防止ComfyUI崩溃")
+    logger.error("错误: 无法导入节点模块 - %s", e)
+    logger.warning("提供空的节点映射以防止ComfyUI崩溃")
     NODE_CLASS_MAPPINGS = {}
     NODE_DISPLAY_NAME_MAPPINGS = {}
 except Exception as e:
-    print(f"[云岚AI] 错误: 注册节点时发生未知错误 - {e}")
-    import traceback
-    traceback.print_exc()
+    logger.error("错误: 注册节点时发生未知错误 - %s", e, exc_info=True)
     NODE_CLASS_MAPPINGS = {}
     NODE_DISPLAY_NAME_MAPPINGS = {}
 
 WEB_DIRECTORY = "js"
 
-@server.PromptServer.instance.routes.post("/yunlan/settings/save")
-async def _save_settings_route(request): return await save_settings(request)
-@server.PromptServer.instance.routes.get("/yunlan/settings/load")
-async def _load_settings_route(request): return await load_settings(request)
-@server.PromptServer.instance.routes.post("/yunlan/prompts/save")
-async def _save_prompts_route(request): return await save_prompts(request)
-@server.PromptServer.instance.routes.get("/yunlan/prompts/load")
-async def _load_prompts_route(request): return await load_prompts(request)
-@server.PromptServer.instance.routes.get("/yunlan/prompts/names")
-async def _get_prompt_names_route(request): return await get_prompt_names(request)
-print("[云岚AI] 成功注册API路由")
+if server is not None:
+    @server.PromptServer.instance.routes.post("/yunlan/settings/save")
+    async def _save_settings_route(request): return await save_settings(request)
+    @server.PromptServer.instance.routes.get("/yunlan/settings/load")
+    async def _load_settings_route(request): return await load_settings(request)
+    @server.PromptServer.instance.routes.post("/yunlan/prompts/save")
+    async def _save_prompts_route(request): return await save_prompts(request)
+    @server.PromptServer.instance.routes.get("/yunlan/prompts/load")
+    async def _load_prompts_route(request): return await load_prompts(request)
+    @server.PromptServer.instance.routes.get("/yunlan/prompts/names")
+    async def _get_prompt_names_route(request): return await get_prompt_names(request)
+    @server.PromptServer.instance.routes.get("/yunlan/revisions")
+    async def _get_revisions_route(request): return await get_revisions(request)
+    @server.PromptServer.instance.routes.get("/yunlan/batch/status")
+    async def _get_batch_status_route(request): return await get_batch_status(request)
+    @server.PromptServer.instance.routes.post("/yunlan/batch/submit")
+    async def _submit_batch_route(request): return await submit_batch(request)
+    @server.PromptServer.instance.routes.get("/yunlan/usage")
+    async def _get_usage_route(request): return await get_usage(request)
+    @server.PromptServer.instance.routes.get("/yunlan/models")
+    async def _get_models_route(request): return await get_models(request)
+    @server.PromptServer.instance.routes.get("/yunlan/warmup")
+    async def _get_warmup_status_route(request): return await get_warmup_status(request)
+    @server.PromptServer.instance.routes.get("/yunlan/coordination")
+    async def _get_coordination_status_route(request): return await get_coordination_status(request)
+    @server.PromptServer.instance.routes.get("/yunlan/logs")
+    async def _get_logs_route(request): return await get_logs(request)
+    logger.info("成功注册API路由")
 
 __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS', 'WEB_DIRECTORY', 'get_api_settings', 'get_prompts']
 
-print("--- [云岚AI] 加载完成 ---") 
\ No newline at end of file
+logger.info("加载完成") 
\ No newline at end of file
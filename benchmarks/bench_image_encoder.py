@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+图像编码的基准测试
+对比 nodes/image_encoder.py 中直接在调用线程编码与线程池并行编码多帧PNG的耗时，
+并测量PNG编码期间GIL的释放程度：编码线程运行时主线程计数的速度占单独计数时的比例。
+编码期间一直持有GIL时该比例接近0；释放GIL时主线程只与编码线程分享CPU时间，
+单核上约为50%，多核上接近100%，此时多帧在线程池中可以真正并行。
+
+用法:
+    python benchmarks/bench_image_encoder.py [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nodes.image_encoder import ImageEncodeService, encode_png_data_url  # noqa: E402
+
+
+def make_frames(count, side):
+    """构造带噪声的渐变图，压缩率接近真实照片"""
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 1, side, dtype=np.float32)
+    base = np.stack([gradient[None, :].repeat(side, 0), gradient[:, None].repeat(side, 1),
+                     np.full((side, side), 0.5, np.float32)], axis=-1)
+    return [np.clip(base + rng.normal(0, 0.05, base.shape).astype(np.float32), 0, 1) for _ in range(count)]
+
+
+def bench(service, frames, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        service.encode_frames(frames)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def count_while(func=None, duration=0.0):
+    """在后台线程运行 func（为None时空等 duration 秒）期间统计主线程的计数次数，返回每秒次数"""
+    done = threading.Event()
+    if func is not None:
+        worker = threading.Thread(target=lambda: (func(), done.set()))
+    else:
+        worker = threading.Timer(duration, done.set)
+    count = 0
+    started = time.perf_counter()
+    worker.start()
+    while not done.is_set():
+        count += 1
+    elapsed = time.perf_counter() - started
+    worker.join()
+    return count / elapsed, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="图像编码的基准测试")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数（取最快的一次）")
+    args = parser.parse_args(argv)
+
+    print(f"CPU数: {os.cpu_count()}")
+    inline = ImageEncodeService(thread_pixel_threshold=float("inf"))
+    threaded = ImageEncodeService(thread_pixel_threshold=1)
+    print(f"{'帧数x边长':>12} {'直接编码(s)':>12} {'线程池(s)':>12} {'加速比':>8}")
+    for count, side in ((2, 256), (2, 512), (4, 512), (4, 1024), (8, 1024), (4, 2048)):
+        frames = make_frames(count, side)
+        old = bench(inline, frames, args.repeat)
+        new = bench(threaded, frames, args.repeat)
+        print(f"{f'{count}x{side}':>12} {old:>12.3f} {new:>12.3f} {old / new:>7.2f}x")
+    threaded.shutdown()
+
+    array = (make_frames(1, 2048)[0] * 255).astype(np.uint8)
+    busy, busy_time = count_while(lambda: encode_png_data_url(array))
+    idle, _ = count_while(duration=busy_time)
+    print(f"PNG编码期间主线程计数速度为单独计数时的 {busy / idle:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+文本清理的微基准测试
+对比三种清理方式在不同文本长度下的耗时：
+- 旧版实现：先完整 html.escape 和移除控制字符，再截断，最后两次 replace 规范化换行
+- 新版 clean_text_for_ui（nodes/text_sanitizer.py）：先截取需要的部分再转义，只在含回车符时规范化换行
+- StreamingSanitizer：按64个字符一块逐块 feed，模拟流式返回（1,000,000 字符一档不测）
+
+用法:
+    python benchmarks/bench_sanitizer.py [--repeat 5]
+"""
+
+import argparse
+import html
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nodes.text_sanitizer import StreamingSanitizer, clean_text_for_ui  # noqa: E402
+
+_LEGACY_CONTROL_CHARS = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+
+
+def legacy_clean_text_for_ui(text):
+    """旧版实现，仅用于对比"""
+    if not text:
+        return ""
+    text = html.escape(str(text))
+    text = _LEGACY_CONTROL_CHARS.sub('', text)
+    if len(text) > 50000:
+        text = text[:50000] + "\n\n[文本过长，已截断...]"
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def make_text(length):
+    """构造接近真实响应的文本：中英文混排、Markdown、少量HTML和控制字符"""
+    block = ("## 结果\r\n模型返回的描述：一位<b>少女</b>站在\"樱花\"树下，背景是夕阳 & 远山。\r\n"
+             "- item: 'value'\t\x1b[0m\n"
+             "The quick brown fox jumps over the lazy dog. 1234567890\n")
+    return (block * (length // len(block) + 1))[:length]
+
+
+def stream(text, chunk_size=64):
+    sanitizer = StreamingSanitizer()
+    parts = [sanitizer.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    parts.append(sanitizer.finish())
+    return "".join(parts)
+
+
+def bench(func, text, repeat):
+    number = max(1, 2_000_000 // max(1, len(text)))
+    best = min(timeit.repeat(lambda: func(text), number=number, repeat=repeat))
+    return best / number * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="文本清理的微基准测试")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数（取最快的一次）")
+    args = parser.parse_args(argv)
+
+    print(f"{'长度':>10} {'旧版(us)':>12} {'新版(us)':>12} {'加速比':>8} {'流式64字(us)':>14}")
+    for length in (1_000, 20_000, 50_000, 200_000, 1_000_000):
+        text = make_text(length)
+        old = bench(legacy_clean_text_for_ui, text, args.repeat)
+        new = bench(clean_text_for_ui, text, args.repeat)
+        streamed = bench(stream, text, args.repeat) if length <= 200_000 else float("nan")
+        print(f"{length:>10} {old:>12.1f} {new:>12.1f} {old / new:>7.1f}x {streamed:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
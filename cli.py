@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+云岚AI 命令行批量处理工具
+在不启动ComfyUI的情况下，使用与「云岚_AI对话」节点相同的提示词解析、图片编码和响应清理逻辑，
+批量处理一个目录或清单中的图片，结果逐行追加到JSONL文件，中断后可从断点继续。
+
+用法:
+    python cli.py --input ./images --output results.jsonl --model gpt-4o-mini --prompt 示例提示词
+    python cli.py --input manifest.jsonl --output results.jsonl --concurrency 16 --max-side 1536
+
+清单文件可以是每行一个图片路径的文本文件，也可以是JSONL文件，每行形如：
+    {"id": "可选的唯一ID", "image": "图片路径", "extra": "可选的附加文本", "prompt": "可选的提示词名称"}
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+if __package__ in (None, ""):
+    # 直接以脚本方式运行时，只导入nodes目录下的模块，不加载依赖ComfyUI的插件入口
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from nodes.dialog_engine import DEFAULT_PROMPTS_PATH, DEFAULT_SETTINGS_PATH, DialogEngine, load_json_file
+else:
+    from .nodes.dialog_engine import DEFAULT_PROMPTS_PATH, DEFAULT_SETTINGS_PATH, DialogEngine, load_json_file
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+
+
+def iter_items(input_path, default_prompt, default_extra):
+    """遍历目录或清单文件，生成待处理的条目"""
+    if os.path.isdir(input_path):
+        for root, dirs, files in os.walk(input_path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield {"id": os.path.relpath(path, input_path), "image": path,
+                           "prompt": default_prompt, "extra": default_extra}
+        return
+
+    base_dir = os.path.dirname(os.path.abspath(input_path))
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+            else:
+                entry = {"image": line}
+            image = entry.get("image")
+            if image and not os.path.isabs(image):
+                image = os.path.join(base_dir, image)
+            yield {
+                "id": str(entry.get("id") or entry.get("image")),
+                "image": image,
+                "prompt": entry.get("prompt") or default_prompt,
+                "extra": entry.get("extra", default_extra),
+            }
+
+
+def load_checkpoint(output_path):
+    """读取已有的结果文件，返回已成功处理的ID集合"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not record.get("error"):
+                done.add(record.get("id"))
+    return done
+
+
+def decode_image(path, max_side=0):
+    """解码图片为uint8的RGB数组，max_side大于0时等比例缩小"""
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+        if max_side and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), getattr(Image, "LANCZOS", Image.BICUBIC))
+        return np.asarray(image)
+
+
+def process_item(engine, item, model, max_side):
+    """处理单个条目：解码 → 编码 → 请求 → 清理"""
+    started = time.time()
+    record = {"id": item["id"], "image": item["image"]}
+    try:
+        frame = decode_image(item["image"], max_side)
+        result = engine.run(model, item["prompt"], item["extra"], frames=[frame])
+        record.update({
+            "text": result["text"],
+            "output_images": len(result["image_sources"]),
+            "usage": result["usage"],
+            "error": result["error"],
+        })
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed"] = round(time.time() - started, 3)
+    return record
+
+
+def run_pipeline(engine, items, output_path, model, concurrency=8, max_side=0, log=print):
+    """
+    以有界并发处理所有条目
+
+    同时在处理中的条目不超过 concurrency 的两倍，结果按完成顺序逐行追加写入。
+    返回 (成功数, 失败数, 跳过数)。
+    """
+    done = load_checkpoint(output_path)
+    ok = failed = skipped = 0
+    max_in_flight = max(1, concurrency) * 2
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+
+    with open(output_path, 'a', encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        in_flight = set()
+
+        def drain(block_until):
+            nonlocal ok, failed
+            while len(in_flight) > block_until:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    in_flight.discard(future)
+                    record = future.result()
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                    if record.get("error"):
+                        failed += 1
+                        log(f"[云岚AI] 失败 {record['id']}: {record['error']}")
+                    else:
+                        ok += 1
+                    if (ok + failed) % 50 == 0:
+                        log(f"[云岚AI] 已完成 {ok + failed} 个（失败 {failed}，跳过 {skipped}）")
+
+        for item in items:
+            if item["id"] in done:
+                skipped += 1
+                continue
+            in_flight.add(executor.submit(process_item, engine, item, model, max_side))
+            drain(max_in_flight - 1)
+        drain(0)
+
+    return ok, failed, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="云岚AI 命令行批量处理工具")
+    parser.add_argument("--input", required=True, help="图片目录，或清单文件（文本/JSONL）")
+    parser.add_argument("--output", required=True, help="结果JSONL文件（已存在时从断点继续）")
+    parser.add_argument("--model", help="模型名称，默认使用settings.json中的apiModel")
+    parser.add_argument("--prompt", default="默认提示词", help="提示词名称（或直接写提示内容）")
+    parser.add_argument("--extra", default="", help="附加文本")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求数")
+    parser.add_argument("--max-side", type=int, default=0, help="发送前把图片最长边缩小到该值，0表示不缩放")
+    parser.add_argument("--settings", default=DEFAULT_SETTINGS_PATH, help="settings.json路径")
+    parser.add_argument("--prompts", default=DEFAULT_PROMPTS_PATH, help="prompts.json路径")
+    args = parser.parse_args(argv)
+
+    settings = load_json_file(args.settings, {})
+    engine = DialogEngine(settings=settings, prompts=load_json_file(args.prompts, {}))
+    model = args.model or settings.get("apiModel")
+    if not model:
+        parser.error("未指定模型，请使用 --model 或在settings.json中配置apiModel")
+
+    started = time.time()
+    items = iter_items(args.input, args.prompt, args.extra)
+    ok, failed, skipped = run_pipeline(engine, items, args.output, model, args.concurrency, args.max_side)
+    print(f"[云岚AI] 处理完成: 成功 {ok}，失败 {failed}，跳过 {skipped}，耗时 {time.time() - started:.1f} 秒")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,7 @@
 
 // 注册自定义组件
 import { app } from "../../scripts/app.js";
+import { api } from "../../scripts/api.js";
 
 console.log("[云岚AI] yunlanfy.js 文件已加载");
 
@@ -108,35 +109,193 @@ function getPromptManager() {
     return window.yunlanPromptManager;
 }
 
-// 更新提示词下拉框
-async function updatePromptDropdown(widget) {
-    if (!widget) return;
-    
-    try {
-        // 获取最新的提示词列表
-        const response = await fetch('/yunlan/prompts/names');
-        if (response.ok) {
-            const promptNames = await response.json();
-            if (Array.isArray(promptNames) && promptNames.length > 0) {
-                // 保存当前选中的值
-                const currentValue = widget.value;
-                
-                // 更新下拉框选项
-                widget.options.values = promptNames;
-                
-                // 如果当前值不在新列表中，选择第一个选项
-                if (!promptNames.includes(currentValue)) {
-                    widget.value = promptNames[0];
-                } else {
-                    widget.value = currentValue;
+// 共享数据仓库
+// 所有节点共用一份提示词/设置数据：每个修订号只请求一次，
+// 后端保存后通过websocket推送变更事件，由仓库统一更新所有已注册的控件。
+const yunlanStore = {
+    prompts: { revision: null, data: null, pending: null },
+    settings: { revision: null, data: null, pending: null },
+    models: { revision: null, data: null, pending: null },
+    // 控件 -> 所属节点
+    promptWidgets: new Map(),
+    modelWidgets: new Map(),
+
+    async _load(kind, url, revision) {
+        const entry = this[kind];
+        if (entry.data && (revision === undefined || revision === entry.revision)) {
+            return entry.data;
+        }
+        if (entry.pending && (revision === undefined || revision === entry.pendingRevision)) {
+            return entry.pending;
+        }
+        entry.pendingRevision = revision;
+        entry.pending = (async () => {
+            try {
+                const response = await fetch(url);
+                if (response.ok) {
+                    entry.data = await response.json();
+                    entry.revision = revision ?? entry.revision;
                 }
-                
-                // 通知ComfyUI更新画布
-                if (widget.node && widget.node.graph) {
-                    widget.node.graph.setDirtyCanvas(true, true);
+            } catch (e) {
+                console.error(`[云岚AI] 加载${kind}失败:`, e);
+            } finally {
+                entry.pending = null;
+            }
+            return entry.data || {};
+        })();
+        return entry.pending;
+    },
+
+    getPrompts(revision) {
+        return this._load("prompts", '/yunlan/prompts/load', revision);
+    },
+
+    getSettings(revision) {
+        return this._load("settings", '/yunlan/settings/load', revision);
+    },
+
+    // 模型列表由后端缓存网关的 /v1/models，并与设置中的 modelList 合并
+    getModels(revision) {
+        return this._load("models", '/yunlan/models', revision);
+    },
+
+    async getPromptNames(revision) {
+        const prompts = await this.getPrompts(revision);
+        return Object.keys(prompts || {});
+    },
+
+    // 清除缓存，下次读取时重新请求
+    invalidate(kind) {
+        this[kind].data = null;
+    },
+
+    registerWidget(widgets, widget, node) {
+        widgets.set(widget, node);
+        if (node && !node.__yunlanStoreCleanup) {
+            node.__yunlanStoreCleanup = true;
+            const onRemoved = node.onRemoved;
+            node.onRemoved = function () {
+                for (const map of [yunlanStore.promptWidgets, yunlanStore.modelWidgets]) {
+                    map.forEach((owner, w) => owner === node && map.delete(w));
                 }
+                return onRemoved?.apply(this, arguments);
+            };
+        }
+    },
+
+    async onPromptsChanged(revision) {
+        if (revision === this.prompts.revision) return;
+        const names = await this.getPromptNames(revision);
+        this.promptWidgets.forEach((node, widget) => applyDropdownValues(widget, names, node));
+    },
+
+    async onSettingsChanged(revision) {
+        if (revision === this.settings.revision) return;
+        await this.getSettings(revision);
+        this.invalidate("models");
+        await this.refreshModelWidgets();
+    },
+
+    async onModelsChanged(revision) {
+        if (revision === this.models.revision) return;
+        await this.refreshModelWidgets(revision);
+    },
+
+    async refreshModelWidgets(revision) {
+        const data = await this.getModels(revision);
+        const models = Array.isArray(data.models) ? data.models : [];
+        this.modelWidgets.forEach((node, widget) => applyDropdownValues(widget, models, node));
+    },
+};
+
+api.addEventListener("yunlan.prompts.changed", (event) => {
+    yunlanStore.onPromptsChanged(event.detail?.revision);
+});
+
+api.addEventListener("yunlan.settings.changed", (event) => {
+    yunlanStore.onSettingsChanged(event.detail?.revision);
+});
+
+api.addEventListener("yunlan.models.changed", (event) => {
+    yunlanStore.onModelsChanged(event.detail?.revision);
+});
+
+// 更新下拉框选项，保留仍然有效的当前值
+function applyDropdownValues(widget, values, node) {
+    if (!widget || !Array.isArray(values) || values.length === 0) return;
+
+    // 保存当前选中的值
+    const currentValue = widget.value;
+
+    // 更新下拉框选项
+    widget.options.values = values;
+
+    // 如果当前值不在新列表中，选择第一个选项
+    if (!values.includes(currentValue)) {
+        widget.value = values[0];
+    } else {
+        widget.value = currentValue;
+    }
+
+    // 通知ComfyUI更新画布
+    const owner = node || widget.node;
+    if (owner && owner.graph) {
+        owner.graph.setDirtyCanvas(true, true);
+    }
+}
+
+// 动态图片端口：所有图片端口都已连接时追加一个新端口，多余的未连接端口只保留一个。
+// 序号不大于 fixedInputs 的端口固定保留（AI对话节点的 图片1、图片2）；没有图片端口时添加 图片0
+const DIALOG_FIXED_IMAGE_INPUTS = 2;
+
+function manageImageInputs(node, fixedInputs) {
+    const imageInputs = (node.inputs || [])
+        .filter(input => /^图片\d+$/.test(input.name))
+        .map(input => ({ index: parseInt(input.name.slice(2)), input }));
+    if (imageInputs.length === 0) {
+        node.addInput("图片0", "IMAGE");
+        node.setSize(node.computeSize());
+        return;
+    }
+
+    const free = imageInputs.filter(item => item.input.link == null).sort((a, b) => a.index - b.index);
+    let changed = false;
+
+    if (free.length === 0) {
+        const highest = Math.max(...imageInputs.map(item => item.index));
+        node.addInput(`图片${highest + 1}`, "IMAGE");
+        changed = true;
+    } else {
+        // 从高序号开始删除，保留序号最小的空闲端口
+        for (let i = free.length - 1; i > 0; i--) {
+            if (free[i].index <= fixedInputs) continue;
+            const slot = node.inputs.indexOf(free[i].input);
+            if (slot !== -1) {
+                node.removeInput(slot);
+                changed = true;
             }
         }
+    }
+
+    if (changed) {
+        node.setSize(node.computeSize());
+        if (node.graph) {
+            node.graph.setDirtyCanvas(true, true);
+        }
+    }
+}
+
+// 更新提示词下拉框（force为true时忽略缓存重新请求）
+async function updatePromptDropdown(widget, node, force = false) {
+    if (!widget) return;
+
+    try {
+        yunlanStore.registerWidget(yunlanStore.promptWidgets, widget, node);
+        if (force) {
+            yunlanStore.invalidate("prompts");
+        }
+        const promptNames = await yunlanStore.getPromptNames();
+        applyDropdownValues(widget, promptNames, node);
     } catch (e) {
         console.error("[云岚AI] 更新提示词下拉框失败:", e);
     }
@@ -186,15 +345,14 @@ app.registerExtension({
                     
                     // 更新预览内容的函数
                     const updatePreview = async () => {
-                        const pm = getPromptManager();
-                        await pm.loadPrompts();
+                        const prompts = await yunlanStore.getPrompts();
                         
                         const selectedPrompt = promptWidget.value;
                         const additionalText = additionalTextWidget.value || "";
                         const selectedModel = modelWidget ? modelWidget.value : "未选择模型";
                         
                         // 获取完整提示词内容
-                        const promptContent = pm.prompts[selectedPrompt] || selectedPrompt;
+                        const promptContent = prompts[selectedPrompt] || selectedPrompt;
                         const fullPrompt = promptContent + additionalText;
                         
                         // 安全地构建预览内容（防止HTML注入）
@@ -285,7 +443,7 @@ app.registerExtension({
                     refreshButton.onclick = (e) => {
                         e.stopPropagation();
                         e.preventDefault();
-                        updatePromptDropdown(promptWidget);
+                        updatePromptDropdown(promptWidget, this, true);
                     };
                     
                     buttonContainer.appendChild(refreshButton);
@@ -295,9 +453,26 @@ app.registerExtension({
                         promptWidget.element.parentElement.appendChild(buttonContainer);
                     }
                     
-                    // 初始加载时更新一次
-                    updatePromptDropdown(promptWidget);
+                    // 初始加载时更新一次（所有节点共享同一次请求）
+                    updatePromptDropdown(promptWidget, this);
                 }
+
+                // 模型下拉框跟随设置变更事件更新
+                if (modelWidget) {
+                    yunlanStore.registerWidget(yunlanStore.modelWidgets, modelWidget, this);
+                }
+
+                // 图片端口：图片1、图片2 固定，全部连接后自动添加 图片3、图片4 ...
+                const onConnectionsChange = this.onConnectionsChange;
+                this.onConnectionsChange = function(type, slotIndex, connected, link_info) {
+                    if (onConnectionsChange) {
+                        onConnectionsChange.apply(this, arguments);
+                    }
+                    if (type === LiteGraph.INPUT) {
+                        setTimeout(() => manageImageInputs(this, DIALOG_FIXED_IMAGE_INPUTS), 10);
+                    }
+                };
+                setTimeout(() => manageImageInputs(this, DIALOG_FIXED_IMAGE_INPUTS), 100);
             };
 
             // 添加节点执行完成后的回调，用于更新随机种子
@@ -334,165 +509,25 @@ app.registerExtension({
             };
         }
 
-        // --- 逻辑 for 云岚_智能选图 ---
-        if (nodeData.name === "云岚_智能选图") {
+        // --- 逻辑 for 云岚_宫格拼图（动态图片端口，从 图片0 开始） ---
+        if (nodeData.name === "云岚_宫格拼图") {
             const onNodeCreated = nodeType.prototype.onNodeCreated;
             nodeType.prototype.onNodeCreated = function () {
                 const r = onNodeCreated ? onNodeCreated.apply(this, arguments) : undefined;
-                
-                // 获取选择器组件
-                const selectionWidget = this.widgets.find(w => w.name === "选择");
-                
-                // 动态管理输入端口的函数
-                const manageDynamicInputs = () => {
-                    // 查找所有图片输入端口
-                    const imageInputs = this.inputs.filter(input => input.name.startsWith("图片"));
-                    
-                    // 记录已连接的和未连接的端口
-                    const connectedInputs = [];
-                    const disconnectedInputs = [];
-                    let highestConnectedIndex = -1;
-                    
-                    // 分析所有图片端口的连接状态
-                    for (const input of imageInputs) {
-                        try {
-                            const index = parseInt(input.name.slice(2));
-                            if (input.link !== null) {
-                                connectedInputs.push({index, input});
-                                highestConnectedIndex = Math.max(highestConnectedIndex, index);
-                            } else {
-                                disconnectedInputs.push({index, input});
-                            }
-                        } catch (e) {
-                            continue;
-                        }
-                    }
-                    
-                    // 记录已连接端口的索引集合，用于选择器更新
-                    const connectedIndices = new Set(connectedInputs.map(item => item.index));
-                    
-                    // 修复选择器的更新
-                    if (selectionWidget && connectedIndices.size > 0) {
-                        // 将已连接端口的索引排序
-                        const connectedArray = Array.from(connectedIndices).sort((a, b) => a - b);
-                        
-                        // 检查当前选择值是否在连接的索引中
-                        const currentValue = parseInt(selectionWidget.value);
-                        if (!connectedIndices.has(currentValue)) {
-                            // 找到最接近当前值的有效索引
-                            let closestIndex = connectedArray[0];
-                            let minDistance = Math.abs(currentValue - closestIndex);
-                            
-                            for (const idx of connectedArray) {
-                                const distance = Math.abs(currentValue - idx);
-                                if (distance < minDistance) {
-                                    minDistance = distance;
-                                    closestIndex = idx;
-                                }
-                            }
-                            // 更新选择器值为最近的有效索引
-                            selectionWidget.value = closestIndex;
-                        }
-                        
-                        // 更新选择器的最大值限制
-                        selectionWidget.options.max = highestConnectedIndex;
-                    } else if (selectionWidget) {
-                        // 如果没有连接的端口，将选择器值重置为0
-                        selectionWidget.value = 0;
-                    }
-                    
-                    // 处理端口管理 - 修复方法：不重建所有端口，而是精确添加或删除所需的端口
-                    
-                    // 1. 确保至少有一个端口
-                    if (imageInputs.length === 0) {
-                        this.addInput("图片0", "IMAGE");
-                        return;
-                    }
-                    
-                    // 2. 确保至少有一个未连接的端口
-                    if (disconnectedInputs.length === 0) {
-                        const newIndex = highestConnectedIndex + 1;
-                        this.addInput(`图片${newIndex}`, "IMAGE");
-                        
-                        // 关键修复：添加新端口后不要立即返回，继续处理布局
-                        // 强制重新计算节点尺寸
-                        this.setSize(this.computeSize());
-                        
-                        // 通知画布更新
-                        if (this.graph) {
-                            this.graph.setDirtyCanvas(true, true);
-                        }
-                        return;
-                    }
-                    
-                    // 3. 如果有多余的未连接端口，只保留一个（索引最小的）
-                    if (disconnectedInputs.length > 1) {
-                        // 按索引排序，保留最小索引的未连接端口
-                        disconnectedInputs.sort((a, b) => a.index - b.index);
-                        
-                        // 从高索引开始删除多余的未连接端口，避免索引变化影响删除操作
-                        for (let i = disconnectedInputs.length - 1; i > 0; i--) {
-                            const input = disconnectedInputs[i];
-                            const inputIndex = this.inputs.indexOf(input.input);
-                            if (inputIndex !== -1) {
-                                this.removeInput(inputIndex);
-                            }
-                        }
-                    }
-                    
-                    // 强制更新节点布局
-                    this.setSize(this.computeSize());
-                    
-                    // 通知画布更新
-                    if (this.graph) {
-                        this.graph.setDirtyCanvas(true, true);
-                    }
-                };
-                
-                // 监听连接变化事件
                 const onConnectionsChange = this.onConnectionsChange;
                 this.onConnectionsChange = function(type, slotIndex, connected, link_info) {
-                    // 调用原始方法
                     if (onConnectionsChange) {
                         onConnectionsChange.apply(this, arguments);
                     }
-                    
-                    // 当连接变化时管理动态输入端口
                     if (type === LiteGraph.INPUT) {
-                        // 使用setTimeout确保连接状态已更新
-                        setTimeout(() => {
-                            manageDynamicInputs();
-                            
-                            // 通知 ComfyUI 该节点需要重新执行
-                            if (this.graph && this.graph.onNodeConnectionChange) {
-                                this.graph.onNodeConnectionChange(this);
-                            }
-                            
-                            // 关键修复：额外的延时处理，确保节点布局完全更新
-                            setTimeout(() => {
-                                this.setSize(this.computeSize());
-                                if (this.graph) {
-                                    this.graph.setDirtyCanvas(true, true);
-                                }
-                            }, 50);
-                        }, 10);
+                        setTimeout(() => manageImageInputs(this, 0), 10);
                     }
                 };
-                
-                // 初始化
-                setTimeout(() => {
-                    manageDynamicInputs();
-                    // 确保初始化后节点布局正确
-                    this.setSize(this.computeSize());
-                    if (this.graph) {
-                        this.graph.setDirtyCanvas(true, true);
-                    }
-                }, 100);
-                
+                setTimeout(() => manageImageInputs(this, 0), 100);
                 return r;
             };
         }
-        
+
         // --- 逻辑 for 云岚_条件选词 ---
         if (nodeData.name === "云岚_条件选词") {
             const onNodeCreated = nodeType.prototype.onNodeCreated;
@@ -707,7 +742,7 @@ function createPromptDialog(node, widget) {
         
         // 更新提示词下拉框
         if (widget) {
-            updatePromptDropdown(widget);
+            updatePromptDropdown(widget, node, true);
             
             // 查找并更新预览区域
             const previewContainer = document.querySelector(".yunlan-prompt-preview");
@@ -1501,40 +1536,57 @@ app.registerExtension({
                 }
             }, 10);
 
-            // 2. 如果需要，使用轮询来安全地添加按钮，避免冲突
+            // 2. 如果需要，交给共享的定时器安全地添加按钮，避免冲突
             if (nodeData.input?.hidden?.prompt_id === "PROMPT_DIALOG") {
-                const self = this;
-                let attempts = 0;
-                const maxAttempts = 50; // 轮询最多10秒
-
-                const intervalId = setInterval(() => {
-                    attempts++;
-                    if (self.promptButtonAdded || attempts > maxAttempts) {
-                        clearInterval(intervalId);
-                        return;
-                    }
-                    if (!self.graph) { // 如果节点已被删除
-                        clearInterval(intervalId);
-                        return;
-                    }
-                    try {
-                        self.addPromptManagerButton();
-                    } catch (e) {
-                        console.error("[云岚AI] 添加提示词按钮时出错:", e);
-                        clearInterval(intervalId); // 出错时停止
-                    }
-                }, 200);
-
-                const onRemoved = self.onRemoved;
-                self.onRemoved = function() {
-                    clearInterval(intervalId);
-                    onRemoved?.apply(this, arguments);
-                };
+                schedulePromptButton(this);
             }
         };
     }
 });
 
+// 等待添加提示词管理按钮的节点
+// 所有节点共用一个定时器，而不是每个节点各自轮询
+const pendingButtonNodes = new Map(); // 节点 -> 已尝试次数
+const BUTTON_POLL_INTERVAL = 200;
+const BUTTON_MAX_ATTEMPTS = 50; // 每个节点最多尝试10秒
+let buttonPollTimer = null;
+
+function schedulePromptButton(node) {
+    pendingButtonNodes.set(node, 0);
+
+    const onRemoved = node.onRemoved;
+    node.onRemoved = function() {
+        pendingButtonNodes.delete(node);
+        onRemoved?.apply(this, arguments);
+    };
+
+    if (buttonPollTimer === null) {
+        buttonPollTimer = setInterval(pollPromptButtons, BUTTON_POLL_INTERVAL);
+    }
+}
+
+function pollPromptButtons() {
+    for (const [node, attempts] of pendingButtonNodes) {
+        // 按钮已添加、超过尝试次数或节点已被删除时不再处理
+        if (node.promptButtonAdded || attempts >= BUTTON_MAX_ATTEMPTS || !node.graph) {
+            pendingButtonNodes.delete(node);
+            continue;
+        }
+        pendingButtonNodes.set(node, attempts + 1);
+        try {
+            node.addPromptManagerButton();
+        } catch (e) {
+            console.error("[云岚AI] 添加提示词按钮时出错:", e);
+            pendingButtonNodes.delete(node); // 出错时停止
+        }
+    }
+
+    if (pendingButtonNodes.size === 0) {
+        clearInterval(buttonPollTimer);
+        buttonPollTimer = null;
+    }
+}
+
 // 添加样式
 document.addEventListener("DOMContentLoaded", function() {
     const style = document.createElement("style");
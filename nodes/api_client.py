@@ -0,0 +1,140 @@
+"""
+OpenAI客户端管理
+按设置创建并缓存OpenAI客户端，使多次运行复用同一个连接池，
+并根据 transportMode 挂载录制/回放传输层。
+"""
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+import threading
+from contextlib import contextmanager
+
+from .logger import get_logger
+from .transport import build_http_client, get_cassette_path, get_transport_mode
+
+logger = get_logger("api_client")
+
+# 回放模式下不需要真实的API Key
+REPLAY_API_KEY = "replay"
+
+# 缓存的客户端数量上限（设置变更后旧客户端会被淘汰）
+MAX_CACHED_CLIENTS = 4
+
+
+# Helper function to sanitize the base URL
+def sanitize_base_url(url):
+    """
+    Automagically corrects the user-provided API URL.
+    Removes common suffixes like /chat/completions to prevent URL duplication.
+    """
+    if not url:
+        return ""
+    url = url.strip()
+    # Remove trailing suffixes if they exist
+    suffixes_to_remove = ["/chat/completions", "/chat/completions/"]
+    for suffix in suffixes_to_remove:
+        if url.endswith(suffix):
+            url = url[:-len(suffix)]
+            break
+    return url.rstrip('/')
+
+
+def resolve_api_key(settings):
+    """读取API Key；回放模式下允许为空"""
+    api_key = settings.get("apiKey")
+    if not api_key and get_transport_mode(settings) == "replay":
+        return REPLAY_API_KEY
+    return api_key
+
+
+_clients = {}
+# 正在使用的客户端的引用计数（按 id），以及已被淘汰、等待最后一个使用者归还后关闭的客户端
+_in_use = {}
+_retired = {}
+_clients_lock = threading.Lock()
+
+
+def _close_clients(clients):
+    # 在锁外关闭，避免关闭连接时阻塞其他线程获取客户端
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            logger.debug("关闭旧的OpenAI客户端失败 - %s", e)
+
+
+def _client_for(settings, acquire):
+    if openai is None:
+        raise ImportError("OpenAI库未安装，请运行: pip install openai>=1.0.0")
+
+    api_key = resolve_api_key(settings)
+    base_url = sanitize_base_url(settings.get("apiUrl"))
+    mode = get_transport_mode(settings)
+    cassette_path = get_cassette_path(settings) if mode != "live" else None
+    key = (api_key, base_url, mode, cassette_path)
+
+    idle = []
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=build_http_client(settings))
+            while len(_clients) >= MAX_CACHED_CLIENTS:
+                old_client = _clients.pop(next(iter(_clients)))
+                if _in_use.get(id(old_client)):
+                    # 仍有线程在使用（包括 with_options 派生的共享同一连接池的客户端），归还后再关闭
+                    _retired[id(old_client)] = old_client
+                else:
+                    idle.append(old_client)
+            _clients[key] = client
+        if acquire:
+            _in_use[id(client)] = _in_use.get(id(client), 0) + 1
+    _close_clients(idle)
+    return client
+
+
+def get_openai_client(settings):
+    """
+    获取与设置对应的OpenAI客户端（不登记使用）
+
+    相同的 apiKey/apiUrl/传输模式 复用同一个客户端实例；超出缓存上限时最早创建的客户端被淘汰，
+    没有使用者时立即关闭，释放其连接池。发送请求时应使用 acquire_openai_client / use_openai_client，
+    避免客户端在请求过程中被关闭。
+    """
+    return _client_for(settings, acquire=False)
+
+
+def acquire_openai_client(settings):
+    """获取客户端并登记为使用中，用完后必须调用 release_openai_client"""
+    return _client_for(settings, acquire=True)
+
+
+def release_openai_client(client):
+    """归还客户端；已被淘汰的客户端在最后一个使用者归还后关闭"""
+    retired = []
+    with _clients_lock:
+        count = _in_use.get(id(client), 0) - 1
+        if count > 0:
+            _in_use[id(client)] = count
+        else:
+            _in_use.pop(id(client), None)
+            if _retired.pop(id(client), None) is not None:
+                retired.append(client)
+    _close_clients(retired)
+
+
+@contextmanager
+def use_openai_client(settings):
+    """
+    在 with 块内使用客户端，期间即使被淘汰也不会关闭
+
+        with use_openai_client(settings) as client:
+            client.chat.completions.create(...)
+    """
+    client = acquire_openai_client(settings)
+    try:
+        yield client
+    finally:
+        release_openai_client(client)
@@ -3,43 +3,48 @@ API节点模块
 包含与API交互的节点
 """
 
+import logging
+
+from .logger import get_logger, log_rate_limited
+
+logger = get_logger("api_nodes")
+
 # 导入检查和错误处理
 try:
     import requests
 except ImportError:
-    print("[云岚AI] 错误: 缺少 requests 库，请运行: pip install requests>=2.25.0")
+    logger.error("错误: 缺少 requests 库，请运行: pip install requests>=2.25.0")
     requests = None
 
 try:
     import openai
 except ImportError:
-    print("[云岚AI] 错误: 缺少 openai 库，请运行: pip install openai>=1.0.0")
+    logger.error("错误: 缺少 openai 库，请运行: pip install openai>=1.0.0")
     openai = None
 
 try:
     from PIL import Image
 except ImportError:
-    print("[云岚AI] 错误: 缺少 Pillow 库，请运行: pip install Pillow>=8.0.0")
+    logger.error("错误: 缺少 Pillow 库，请运行: pip install Pillow>=8.0.0")
     Image = None
 
 try:
     import torch
 except ImportError:
-    print("[云岚AI] 错误: 缺少 PyTorch 库，这通常由ComfyUI提供")
+    logger.error("错误: 缺少 PyTorch 库，这通常由ComfyUI提供")
     torch = None
 
 try:
     import numpy as np
 except ImportError:
-    print("[云岚AI] 错误: 缺少 NumPy 库，这通常由ComfyUI提供")
+    logger.error("错误: 缺少 NumPy 库，这通常由ComfyUI提供")
     np = None
 
 import json
 import base64
 import io
 import random
-import html
-import re
+from types import SimpleNamespace
 
 # 安全导入父模块的函数
 try:
@@ -51,70 +56,62 @@ except ImportError as e:
     def get_prompts():
         return {"默认提示词": ""}
 
+from .api_client import (acquire_openai_client, release_openai_client, resolve_api_key, sanitize_base_url,
+                         use_openai_client)
+from .batch_jobs import get_batch_manager, request_custom_id
+from .batch_select import select_frames
+from .coordination import CoordinationTimeout, get_coordinator
+from .dialog_engine import image_parts, parse_response, resolve_prompt
+from .image_encoder import get_encode_service, payload_budget_bytes
+from .image_grid import FIT_MODES, compose_grid
+from .model_catalog import get_model_catalog
+from .response_images import decode_images_to_tensor, remote_images_enabled
+from .session_store import get_session_store, trim_history
+from .structured_output import (
+    JSON_REPLY_HINT, MAX_REPORTED_ERRORS, OUTPUT_FORMATS, build_response_format, field_as_number, field_as_text, get_field,
+    get_validator, parse_schema, retry_message, validate_reply, validator_name,
+)
+from .text_sanitizer import clean_text_for_ui
+from .token_estimator import (
+    DEFAULT_MAX_OUTPUT_TOKENS, estimate_message_tokens, estimate_messages_tokens, estimate_text_tokens,
+    estimator_name, get_model_limits, plan_max_tokens, truncate_text_to_tokens,
+)
+from .usage_store import get_usage_store
+
+# 发送请求前至少需要为输出保留的Token数
+MIN_OUTPUT_TOKENS = 64
+
+# 结构化输出（JSON、字段文本、字段整数、字段浮点）在出错或未开启时的默认值
+EMPTY_STRUCTURED_OUTPUTS = ("", "", 0, 0.0)
+
 # 通用辅助函数
+_empty_image = None
+
 def create_empty_image():
-    """创建空的图像tensor，如果torch不可用则返回None"""
+    """获取共享的空图像tensor（只创建一次），如果torch不可用则返回None"""
+    global _empty_image
     if torch is not None:
-        return torch.zeros((1, 64, 64, 3), dtype=torch.float32, device="cpu")
+        if _empty_image is None:
+            _empty_image = torch.zeros((1, 64, 64, 3), dtype=torch.float32, device="cpu")
+        return _empty_image
     else:
-        print("[云岚AI] 警告: PyTorch不可用，无法创建图像tensor")
+        logger.warning("警告: PyTorch不可用，无法创建图像tensor")
         return None
 
-def clean_text_for_ui(text):
-    """清理文本以防止UI错乱"""
-    if not text:
-        return ""
-
-    # 转换为字符串
-    text = str(text)
-
-    # 移除或转义HTML标签
-    text = html.escape(text)
-
-    # 移除控制字符（保留换行符和制表符）
-    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
-
-    # 限制文本长度（防止超长文本导致UI问题）
-    max_length = 50000  # 50K字符限制
-    if len(text) > max_length:
-        text = text[:max_length] + "\n\n[文本过长，已截断...]"
-
-    # 规范化换行符
-    text = text.replace('\r\n', '\n').replace('\r', '\n')
-
-    return text
-
-def safe_return_with_image(text_result, seed_value=0):
+def safe_return_with_image(text_result, seed_value=0, token_stats=""):
     """安全地返回带图像的结果，处理torch不可用的情况"""
     # 清理文本以防止UI错乱
     cleaned_text = clean_text_for_ui(text_result)
 
     empty_img = create_empty_image()
     if empty_img is not None:
-        return (cleaned_text, empty_img, seed_value)
+        return (cleaned_text, empty_img, seed_value, token_stats) + EMPTY_STRUCTURED_OUTPUTS
     else:
-        return (cleaned_text, seed_value)
-
-# Helper function to sanitize the base URL
-def sanitize_base_url(url):
-    """
-    Automagically corrects the user-provided API URL.
-    Removes common suffixes like /chat/completions to prevent URL duplication.
-    """
-    if not url:
-        return ""
-    url = url.strip()
-    # Remove trailing suffixes if they exist
-    suffixes_to_remove = ["/chat/completions", "/chat/completions/"]
-    for suffix in suffixes_to_remove:
-        if url.endswith(suffix):
-            url = url[:-len(suffix)]
-            break
-    return url.rstrip('/')
+        return (cleaned_text, seed_value, token_stats) + EMPTY_STRUCTURED_OUTPUTS
 
 # Helper function to convert tensor to base64
-def tensor_to_base64(tensor):
-    """安全地将tensor转换为base64编码的图像"""
+def tensor_to_base64_list(tensor):
+    """安全地将IMAGE tensor的每一帧转换为base64编码的图像"""
     try:
         if Image is None:
             raise ImportError("PIL库未安装")
@@ -123,35 +120,91 @@ def tensor_to_base64(tensor):
         if np is None:
             raise ImportError("NumPy库未安装")
 
-        # Convert tensor to numpy array
-        np_array = tensor.squeeze(0).cpu().numpy()
-
-        # Ensure the values are in the 0-255 range and uint8 type
-        np_array = (np_array * 255).astype(np.uint8)
-
-        # Create PIL Image from numpy array
-        image = Image.fromarray(np_array)
-
-        # Save image to a byte buffer
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-
-        # Get base64 representation
-        img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        return f"data:image/png;base64,{img_str}"
+        return get_encode_service().encode_tensor(tensor)
     except Exception as e:
-        print(f"[云岚AI] 错误: 转换图像为base64时发生错误 - {e}")
+        logger.error("错误: 转换图像为base64时发生错误 - %s", e)
         raise
 
+def tensor_to_base64(tensor):
+    """安全地将tensor转换为base64编码的图像（取第一帧）"""
+    return tensor_to_base64_list(tensor[:1])[0]
+
+def dialog_optional_inputs():
+    """AI对话节点的可选输入（新增的控件都放在这里，避免打乱旧工作流的控件顺序）"""
+    return {
+        "图片1": ("IMAGE",),
+        "图片2": ("IMAGE",),
+        "会话模式": (["关闭", "开启", "重置"], {"default": "关闭"}),
+        "会话ID": ("STRING", {"default": ""}),
+        "历史Token上限": ("INT", {"default": 8000, "min": 0, "max": 1000000, "step": 256}),
+        # 0 表示自动：按 settings.json 中的 defaultMaxTokens 和 modelLimits 决定
+        "最大输出Token": ("INT", {"default": 0, "min": 0, "max": 1000000, "step": 64}),
+        "超长截断附加文本": ("BOOLEAN", {"default": False}),
+        # 批处理：请求加入批次，通过 /v1/batches 离线执行，完成后重新运行即可取回结果
+        "执行模式": (["同步", "批处理"], {"default": "同步"}),
+        # 结构化输出：通过 response_format 要求模型返回JSON，并在本地按Schema校验
+        "输出格式": (list(OUTPUT_FORMATS), {"default": "文本"}),
+        "输出Schema": ("STRING", {"multiline": True, "default": ""}),
+        "校验重试次数": ("INT", {"default": 2, "min": 0, "max": 5, "step": 1}),
+        # 字段路径如 "name"、"items[0].score"，对应的值从 字段文本/字段整数/字段浮点 输出
+        "文本字段": ("STRING", {"default": ""}),
+        "整数字段": ("STRING", {"default": ""}),
+        "浮点字段": ("STRING", {"default": ""}),
+    }
+
+def collect_dialog_images(图片1=None, 图片2=None, extra_inputs=None):
+    """
+    按端口序号收集AI对话节点的图片输入
+
+    图片1、图片2 为固定端口，图片3 及以后由前端动态添加，通过 extra_inputs 传入。
+    返回 [(端口名, IMAGE张量), ...]
+    """
+    images = {1: 图片1, 2: 图片2}
+    for key, value in (extra_inputs or {}).items():
+        if key.startswith("图片"):
+            try:
+                images[int(key[2:])] = value
+            except ValueError:
+                continue
+    return [(f"图片{index}", images[index]) for index in sorted(images) if images[index] is not None]
+
+def start_batch_polling():
+    """启动批处理任务的后台轮询"""
+    get_batch_manager().start_polling(use_openai_client, get_api_settings)
+
+def workflow_id_from(extra_pnginfo):
+    """从工作流信息中取出工作流ID，用于按工作流统计用量"""
+    workflow = extra_pnginfo.get("workflow") if isinstance(extra_pnginfo, dict) else None
+    if isinstance(workflow, dict) and workflow.get("id"):
+        return str(workflow["id"])
+    return "未知"
+
+def merge_usage(total, usage):
+    """累加多次请求（如校验失败后的重试）的用量"""
+    if usage is None:
+        return total
+    if total is None:
+        return dict(usage)
+    merged = {key: total.get(key, 0) + value for key, value in usage.items()}
+    merged["cost"] = round(merged.get("cost", 0), 6)
+    return merged
+
+def batch_record_to_response(record):
+    """把批处理结果记录转换为与同步调用相同结构的响应对象"""
+    message = SimpleNamespace(**(record.get("message") or {}))
+    usage = record.get("usage")
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=message)],
+        usage=SimpleNamespace(**usage) if isinstance(usage, dict) else None,
+    )
+
 class YunlanAIDialog:
     @classmethod
     def INPUT_TYPES(s):
         try:
-            # 动态加载模型列表
+            # 动态加载模型列表（网关 /v1/models 的缓存结果，不可用时使用设置中的列表，不会阻塞等待网络）
             settings = get_api_settings()
-            models = settings.get("modelList", [])
-            if not models or not isinstance(models, list) or len(models) == 0:
-                models = ["gpt-4o", "gpt-4-turbo"]  # 备用列表
+            models = get_model_catalog().model_choices(settings)
             
             # 确保模型列表中至少有一个元素
             if len(models) == 0:
@@ -168,7 +221,7 @@ class YunlanAIDialog:
                 if "默认提示词" not in prompt_names:
                     prompt_names.append("默认提示词")
             except Exception as e:
-                print(f"[云岚AI] 加载提示词时出错: {e}")
+                logger.error("加载提示词时出错: %s", e)
                 prompt_names = ["默认提示词"]
             
             return {
@@ -179,18 +232,16 @@ class YunlanAIDialog:
                     "种子模式": (["随机", "固定"],),
                     "种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),
                 },
-                "optional": {
-                    "图片1": ("IMAGE",),
-                    "图片2": ("IMAGE",),
-                },
+                "optional": dialog_optional_inputs(),
                 "hidden": {
                     "prompt_id": "PROMPT_DIALOG",
                     "node_id": "UNIQUE_ID",
                     "preview": "PROMPT_PREVIEW",
+                    "extra_pnginfo": "EXTRA_PNGINFO",
                 },
             }
         except Exception as e:
-            print(f"[云岚AI] 初始化AI对话节点时出错: {e}")
+            logger.error("初始化AI对话节点时出错: %s", e)
             # 提供一个后备方案以确保节点能够加载
             return {
                 "required": {
@@ -200,24 +251,34 @@ class YunlanAIDialog:
                     "种子模式": (["随机", "固定"],),
                     "种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),
                 },
-                "optional": {
-                    "图片1": ("IMAGE",),
-                    "图片2": ("IMAGE",),
-                },
+                "optional": dialog_optional_inputs(),
                 "hidden": {
                     "prompt_id": "PROMPT_DIALOG",
                     "node_id": "UNIQUE_ID",
                     "preview": "PROMPT_PREVIEW",
+                    "extra_pnginfo": "EXTRA_PNGINFO",
                 },
             }
 
-    RETURN_TYPES = ("STRING", "IMAGE", "INT")
-    RETURN_NAMES = ("文本", "图片", "使用的种子")
+    RETURN_TYPES = ("STRING", "IMAGE", "INT", "STRING", "STRING", "STRING", "INT", "FLOAT")
+    RETURN_NAMES = ("文本", "图片", "使用的种子", "Token统计", "JSON", "字段文本", "字段整数", "字段浮点")
     FUNCTION = "run_dialog"
     CATEGORY = "云岚AI"
 
-    def run_dialog(self, 模型, 提示词, 附加文本, 种子模式, 种子, 图片1=None, 图片2=None, prompt_id=None, node_id=None, preview=None):
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        # 批处理模式下每次都重新执行，以便取回已完成的结果
+        if kwargs.get("执行模式") == "批处理":
+            return float("NaN")
+        return ""
+
+    def run_dialog(self, 模型, 提示词, 附加文本, 种子模式, 种子, 图片1=None, 图片2=None,
+                   会话模式="关闭", 会话ID="", 历史Token上限=8000,
+                   最大输出Token=0, 超长截断附加文本=False, 执行模式="同步",
+                   输出格式="文本", 输出Schema="", 校验重试次数=2, 文本字段="", 整数字段="", 浮点字段="",
+                   prompt_id=None, node_id=None, preview=None, extra_pnginfo=None, **kwargs):
         base_url = None  # Define for access in exception handlers
+        client = None
 
         try:
             # 检查关键依赖
@@ -232,7 +293,7 @@ class YunlanAIDialog:
             if not settings:
                 return safe_return_with_image("错误: 无法加载API设置，请检查settings.json文件。")
 
-            api_key = settings.get("apiKey")
+            api_key = resolve_api_key(settings)
             raw_base_url = settings.get("apiUrl")
 
             if not api_key:
@@ -242,53 +303,63 @@ class YunlanAIDialog:
 
             base_url = sanitize_base_url(raw_base_url)
 
-            # 2. 初始化OpenAI客户端
+            # 2. 获取OpenAI客户端（按设置缓存复用，并按 transportMode 挂载录制/回放传输）
             try:
-                client = openai.OpenAI(api_key=api_key, base_url=base_url)
+                # 登记为使用中，设置变更导致客户端被淘汰时也要等本次运行结束后才关闭
+                client = acquire_openai_client(settings)
             except Exception as e:
                 return safe_return_with_image(f"错误: 无法初始化OpenAI客户端 - {e}")
 
+            # 结构化输出：先解析并编译Schema，Schema有误时不发送请求
+            structured = 输出格式 in OUTPUT_FORMATS[1:]
+            schema = response_format = None
+            if structured:
+                try:
+                    schema = parse_schema(输出Schema)
+                    response_format = build_response_format(输出格式, schema)
+                    if schema is not None:
+                        get_validator(schema)
+                except ValueError as e:
+                    return safe_return_with_image(f"错误: {e}")
+
             # 3. 构建提示
-            prompt_content = ""
-            try:
-                prompts_dict = get_prompts()
-                if isinstance(prompts_dict, dict) and 提示词 in prompts_dict:
-                    prompt_content = prompts_dict[提示词]
+            prompt_content, 附加文本_safe = resolve_prompt(提示词, 附加文本, get_prompts)
+            # json_object 模式要求消息中提到JSON，提示词中没有时补充说明
+            if structured and "json" not in (prompt_content + 附加文本_safe).lower():
+                if 附加文本_safe:
+                    附加文本_safe += JSON_REPLY_HINT
                 else:
-                    # 提示词不在字典中，使用提示词名称作为内容
-                    prompt_content = 提示词
-            except Exception as e:
-                print(f"[云岚AI] 警告: 构建提示时发生错误 - {e}")
-                # 异常情况下，安全地使用提示词名称作为内容
-                prompt_content = 提示词 if 提示词 else ""
-
-            # 确保prompt_content是字符串类型
-            if not isinstance(prompt_content, str):
-                prompt_content = str(prompt_content) if prompt_content else ""
-
-            # 确保附加文本是字符串类型
-            附加文本_safe = str(附加文本) if 附加文本 else ""
+                    prompt_content += JSON_REPLY_HINT
 
             # 构建完整提示
             full_prompt = prompt_content + 附加文本_safe
 
             # 4. 构建API请求内容
-            messages_content = [{"type": "text", "text": full_prompt}]
-
-            # 安全地处理图片输入
-            try:
-                if 图片1 is not None:
-                    base64_image = tensor_to_base64(图片1)
-                    messages_content.append({"type": "image_url", "image_url": {"url": base64_image}})
-            except Exception as e:
-                print(f"[云岚AI] 警告: 处理图片1时发生错误 - {e}")
-
-            try:
-                if 图片2 is not None:
-                    base64_image_2 = tensor_to_base64(图片2)
-                    messages_content.append({"type": "image_url", "image_url": {"url": base64_image_2}})
-            except Exception as e:
-                pass
+            # 会话模式下，预设提示词作为固定的system前缀，附加文本作为本轮的用户消息，
+            # 使多轮请求共享同一个稳定前缀，便于服务端的前缀缓存复用
+            session_id = None
+            if 会话模式 in ("开启", "重置"):
+                session_id = (str(会话ID).strip() if 会话ID else "") or f"node-{node_id}"
+            use_system_prefix = bool(session_id is not None and prompt_content and 附加文本_safe)
+            user_text = 附加文本_safe if use_system_prefix else full_prompt
+            messages_content = [{"type": "text", "text": user_text}]
+
+            # 处理图片输入：所有端口的图片按内容去重后一次性并行编码，总大小超出上限时等比例缩小
+            # 任何一张图片处理失败都直接报错，避免在缺少图片的情况下发送请求
+            frames = []
+            for name, image in collect_dialog_images(图片1, 图片2, kwargs):
+                try:
+                    frames.append(image[0].cpu().numpy())
+                except Exception as e:
+                    return safe_return_with_image(f"错误: 处理{name}时发生错误 - {e}")
+            image_stats = None
+            if frames:
+                try:
+                    urls, image_stats = get_encode_service().encode_for_request(
+                        frames, payload_budget_bytes(settings))
+                except Exception as e:
+                    return safe_return_with_image(f"错误: 编码图片时发生错误 - {e}")
+                messages_content.extend(image_parts(urls))
 
             # 5. 处理种子（仅用于工作流刷新，不传递给API）
             actual_seed = 种子
@@ -296,63 +367,199 @@ class YunlanAIDialog:
                 actual_seed = random.randint(0, 0xffffffffffffffff)
             # 注意：种子仅用于ComfyUI工作流的刷新机制，不传递给API
 
-            # 6. 调用API
-            response = client.chat.completions.create(
-                model=模型,
-                messages=[{"role": "user", "content": messages_content}],
-                max_tokens=2048,
-            )
+            user_message = {"role": "user", "content": messages_content}
+            messages = [user_message]
+            history = []
+            if session_id is not None:
+                store = get_session_store()
+                if 会话模式 == "重置":
+                    store.clear(session_id)
+                reserved = estimate_message_tokens(user_message, 模型)
+                if use_system_prefix:
+                    reserved += estimate_message_tokens({"role": "system", "content": prompt_content}, 模型)
+                history = trim_history(store.get_history(session_id), 历史Token上限, reserved, 模型)
+                messages = ([{"role": "system", "content": prompt_content}] if use_system_prefix else []) \
+                    + history + [user_message]
+
+            # 6. 估算提示大小，按模型限制决定 max_tokens，超长时在上传前拦截
+            limits = get_model_limits(settings, 模型)
+            try:
+                default_max_tokens = int(settings.get("defaultMaxTokens") or DEFAULT_MAX_OUTPUT_TOKENS)
+            except (TypeError, ValueError):
+                default_max_tokens = DEFAULT_MAX_OUTPUT_TOKENS
+            target_tokens = plan_max_tokens(0, {"maxOutputTokens": limits["maxOutputTokens"]},
+                                            最大输出Token, default_max_tokens)
+            floor_tokens = min(MIN_OUTPUT_TOKENS, target_tokens)
+            prompt_tokens = estimate_messages_tokens(messages, 模型)
+            max_tokens = plan_max_tokens(prompt_tokens, limits, 最大输出Token, default_max_tokens)
+
+            truncated = False
+            if max_tokens < floor_tokens and 超长截断附加文本 and 附加文本_safe:
+                extra_tokens = estimate_text_tokens(附加文本_safe, 模型)
+                keep_tokens = extra_tokens - (floor_tokens - max_tokens)
+                if keep_tokens > 0:
+                    附加文本_safe = truncate_text_to_tokens(附加文本_safe, keep_tokens, 模型)
+                    messages_content[0]["text"] = 附加文本_safe if use_system_prefix else prompt_content + 附加文本_safe
+                    truncated = True
+                    prompt_tokens = estimate_messages_tokens(messages, 模型)
+                    max_tokens = plan_max_tokens(prompt_tokens, limits, 最大输出Token, default_max_tokens)
+
+            token_stats = {
+                "model": 模型,
+                "estimator": estimator_name(模型),
+                "prompt_tokens": prompt_tokens,
+                "max_tokens": max_tokens,
+                "context_window": limits["contextWindow"],
+                "truncated": truncated,
+            }
+            if image_stats:
+                token_stats["images"] = image_stats
+            if max_tokens < floor_tokens:
+                error_msg = (f"错误: 提示过长（约 {prompt_tokens} 个Token），超出模型 {模型} 的上下文窗口 "
+                             f"{limits['contextWindow']}。请缩短输入或开启“超长截断附加文本”。")
+                logger.error(error_msg)
+                return safe_return_with_image(error_msg, token_stats=json.dumps(token_stats, ensure_ascii=False))
+
+            # 7. 调用API（批处理模式下加入批次或取回已完成的结果）
+            # 发送新请求前先检查每日预算，超出时按设置限流或拒绝
+            usage_store = get_usage_store()
+            request_body = {"model": 模型, "messages": messages, "max_tokens": max_tokens}
+            if response_format is not None:
+                request_body["response_format"] = response_format
+            dedupe_id = None
+            if 执行模式 == "批处理":
+                manager = get_batch_manager()
+                custom_id = dedupe_id = request_custom_id(request_body)
+                # 新请求以及失败、过期后重新排队的请求都要经过每日预算检查
+                previous_error = None
+                if manager.needs_enqueue(custom_id):
+                    previous_error = manager.last_error(custom_id)
+                    refusal = usage_store.admit(settings)
+                    if refusal:
+                        return safe_return_with_image(refusal, actual_seed, json.dumps(token_stats, ensure_ascii=False))
+                manager.enqueue(request_body)
+                record = manager.lookup(custom_id)
+                if record is None:
+                    manager.maybe_auto_submit(client, settings)
+                    if manager.has_active_jobs():
+                        start_batch_polling()
+                    status_msg = (f"[批处理] 请求 {custom_id} 当前状态: {manager.request_status(custom_id)}，"
+                                  f"待提交 {manager.pending_count()} 个。任务完成后重新运行工作流即可取回结果。")
+                    if previous_error:
+                        status_msg += f"\n上次提交失败（{previous_error}），已重新排队。"
+                    return safe_return_with_image(status_msg, actual_seed, json.dumps(token_stats, ensure_ascii=False))
+                response = batch_record_to_response(record)
+            else:
+                refusal = usage_store.admit(settings)
+                if refusal:
+                    return safe_return_with_image(refusal, actual_seed, json.dumps(token_stats, ensure_ascii=False))
+                # 开启跨进程协调时，与同一台机器上的其他ComfyUI进程共享并发和速率上限
+                with get_coordinator().slot(settings, prompt_tokens + max_tokens) as lease:
+                    response = client.chat.completions.create(**request_body)
+                    lease.record_usage(getattr(response, "usage", None))
+            workflow_id = workflow_id_from(extra_pnginfo)
+            allow_remote_images = remote_images_enabled(settings)
+            usage = usage_store.record(settings, 模型, workflow_id, getattr(response, "usage", None), dedupe_id)
 
             # 兼容处理不同格式的API响应
-            ai_response = None
-            if hasattr(response, 'choices') and response.choices:
-                if response.choices[0].message and response.choices[0].message.content:
-                    ai_response = response.choices[0].message.content
-                else:
-                    error_msg = "错误: API返回了空的响应内容。"
-                    return safe_return_with_image(error_msg)
-            elif isinstance(response, str):
-                ai_response = response # The response is already the string content
-            else:
-                error_msg = f"错误: 收到未知的API响应格式。"
-                return safe_return_with_image(error_msg)
+            ai_response, image_sources, error_msg = parse_response(response, allow_remote_images)
+
+            # 结构化输出：本地校验，未通过时把错误反馈给模型，只重试API请求（批处理模式不重试）
+            structured_data = None
+            if structured and not error_msg:
+                attempts = 1
+                structured_data, errors = validate_reply(ai_response, schema)
+                while errors and 执行模式 == "同步" and attempts <= 校验重试次数:
+                    logger.info("回复未通过JSON校验，第 %d 次重试: %s", attempts, errors[0])
+                    retry_messages = messages + [{"role": "assistant", "content": ai_response},
+                                                 {"role": "user", "content": retry_message(errors)}]
+                    retry_prompt_tokens = estimate_messages_tokens(retry_messages, 模型)
+                    retry_max_tokens = plan_max_tokens(retry_prompt_tokens, limits, 最大输出Token, default_max_tokens)
+                    if retry_max_tokens < floor_tokens or usage_store.admit(settings):
+                        break
+                    with get_coordinator().slot(settings, retry_prompt_tokens + retry_max_tokens) as lease:
+                        response = client.chat.completions.create(
+                            **dict(request_body, messages=retry_messages, max_tokens=retry_max_tokens))
+                        lease.record_usage(getattr(response, "usage", None))
+                    attempts += 1
+                    usage = merge_usage(usage, usage_store.record(settings, 模型, workflow_id,
+                                                                  getattr(response, "usage", None)))
+                    ai_response, image_sources, error_msg = parse_response(response, allow_remote_images)
+                    if error_msg:
+                        break
+                    structured_data, errors = validate_reply(ai_response, schema)
+                token_stats["structured"] = {"format": 输出格式, "attempts": attempts, "valid": not errors,
+                                             "validator": validator_name() if schema is not None else None}
+                if errors and not error_msg:
+                    error_msg = (f"错误: 回复未通过JSON校验（共请求 {attempts} 次）- "
+                                 + "; ".join(errors[:MAX_REPORTED_ERRORS]))
+
+            if usage is not None:
+                token_stats["usage"] = usage
+            token_stats_text = json.dumps(token_stats, ensure_ascii=False)
+            if error_msg:
+                logger.error(error_msg)
+                return safe_return_with_image(error_msg, actual_seed, token_stats_text)
+
+            # 解码响应中的图片
+            output_image = None
+            if image_sources:
+                try:
+                    output_image = decode_images_to_tensor(image_sources, allow_remote_images)
+                except Exception as e:
+                    logger.warning("警告: 解码返回的图片时发生错误 - %s", e)
+            if output_image is None:
+                output_image = create_empty_image()
 
-            # 验证AI响应内容
-            if not ai_response or ai_response.strip() == "":
-                error_msg = "错误: AI返回了空的响应内容。"
-                print(f"[云岚AI] {error_msg}")
-                return safe_return_with_image(error_msg)
+            # 保存本轮对话到会话历史
+            if session_id is not None:
+                get_session_store().append_turn(
+                    session_id, history, user_message, {"role": "assistant", "content": ai_response})
 
             # 6. 返回结果
             # 清理AI响应文本以防止UI错乱
             cleaned_text = clean_text_for_ui(ai_response)
-            output_image = create_empty_image()
+
+            # 结构化输出供下游节点解析，不做HTML转义（json.dumps 已转义控制字符）
+            structured_outputs = EMPTY_STRUCTURED_OUTPUTS
+            if structured:
+                structured_outputs = (
+                    json.dumps(structured_data, ensure_ascii=False),
+                    field_as_text(get_field(structured_data, 文本字段)),
+                    field_as_number(get_field(structured_data, 整数字段), int),
+                    field_as_number(get_field(structured_data, 浮点字段), float),
+                )
 
             # 返回实际使用的种子，这样ComfyUI可以正确处理缓存和刷新
-            return (cleaned_text, output_image, actual_seed)
+            return (cleaned_text, output_image, actual_seed, token_stats_text) + structured_outputs
 
         except openai.APIConnectionError as e:
             error_msg = f"API连接错误: 无法连接到 {base_url or '未定义的URL'}。请检查API URL和网络连接。"
-            print(f"[云岚AI] {error_msg} - {e}")
+            logger.error("%s - %s", error_msg, e)
             return safe_return_with_image(error_msg)
         except openai.AuthenticationError as e:
             error_msg = "API认证错误: API Key无效或已过期。请检查设置。"
-            print(f"[云岚AI] {error_msg} - {e}")
+            logger.error("%s - %s", error_msg, e)
             return safe_return_with_image(error_msg)
         except openai.RateLimitError as e:
             error_msg = "API速率限制错误: 已超出您的配额。请检查您的账户用量。"
-            print(f"[云岚AI] {error_msg} - {e}")
+            logger.error("%s - %s", error_msg, e)
             return safe_return_with_image(error_msg)
         except openai.APIStatusError as e:
             error_msg = f"API状态错误: {e.status_code} - {e.response.text}"
-            print(f"[云岚AI] {error_msg}")
+            logger.error(error_msg)
+            return safe_return_with_image(error_msg)
+        except CoordinationTimeout as e:
+            error_msg = f"错误: {e}，其他进程的请求占满了共享的并发或速率上限。"
+            logger.error(error_msg)
             return safe_return_with_image(error_msg)
         except Exception as e:
             error_msg = f"运行对话节点时发生未知错误: {e}"
-            print(f"[云岚AI] {error_msg}")
-            import traceback
-            traceback.print_exc()
+            logger.error(error_msg, exc_info=True)
             return safe_return_with_image(error_msg)
+        finally:
+            if client is not None:
+                release_openai_client(client)
 
 class YunlanSmartImageSelector:
     MAX_INPUTS = 10  # Set a reasonable maximum for performance
@@ -403,7 +610,8 @@ class YunlanSmartImageSelector:
 
         # 如果选择的图片不可用，返回黑色图像
         if selected_image is None:
-            print(f"[云岚AI] 警告: 选择的图片 '{selection_idx}' 未连接或为空，将输出一个黑色图像。")
+            log_rate_limited(logger, logging.WARNING, (type(self).__name__, "missing"),
+                             "警告: 选择的图片 '%s' 未连接或为空，将输出一个黑色图像。", selection_idx)
             empty_img = create_empty_image()
             return (empty_img,) if empty_img is not None else (None,)
         return (selected_image,)
@@ -465,7 +673,8 @@ class DynamicImageSelector:
 
         # 如果没有连接任何图片，返回黑色图像
         if not connected_images:
-            print(f"[云岚AI] 警告: 未连接任何图片输入，将输出一个黑色图像。")
+            log_rate_limited(logger, logging.WARNING, (type(self).__name__, "empty"),
+                             "警告: 未连接任何图片输入，将输出一个黑色图像。")
             empty_img = create_empty_image()
             return (empty_img,) if empty_img is not None else (None,)
 
@@ -489,7 +698,8 @@ class DynamicImageSelector:
         
         # 如果选择的图片不可用（这种情况应该不会发生，因为我们已经检查了），返回黑色图像
         if selected_image is None:
-            print(f"[云岚AI] 警告: 选择的图片 '{selection_idx}' 未连接或为空，将输出一个黑色图像。")
+            log_rate_limited(logger, logging.WARNING, (type(self).__name__, "missing"),
+                             "警告: 选择的图片 '%s' 未连接或为空，将输出一个黑色图像。", selection_idx)
             empty_img = create_empty_image()
             return (empty_img,) if empty_img is not None else (None,)
         
@@ -497,6 +707,47 @@ class DynamicImageSelector:
         return (selected_image,)
 
 
+class YunlanBatchFrameSelector:
+    """
+    批次选帧节点
+
+    按索引表达式从图片批次中选取帧，适合从视频帧序列中抽帧。
+
+    输入:
+    - 图片: 图片批次
+    - 索引: 逗号分隔的索引或范围，例如 "3,7,12"、"0:64:4"、"-1"、"0:8,12"
+      范围与Python切片写法相同，负数从末尾倒数；超出范围的索引取最近的有效帧；留空表示全部帧
+
+    输出:
+    - 图片: 所选的帧。递增等间隔的选择直接返回原批次的视图，不复制数据；其余情况只进行一次索引收集
+    - 帧数: 所选帧的数量
+    """
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "图片": ("IMAGE",),
+                "索引": ("STRING", {"default": "0"}),
+            },
+        }
+
+    RETURN_TYPES = ("IMAGE", "INT")
+    RETURN_NAMES = ("图片", "帧数")
+    FUNCTION = "select_frames"
+    CATEGORY = "云岚AI"
+
+    def select_frames(self, 图片, 索引):
+        if 图片 is None or 图片.shape[0] == 0:
+            logger.warning("警告: 输入的图片批次为空，将输出一个黑色图像。")
+            return (create_empty_image(), 0)
+        try:
+            frames, indices = select_frames(图片, 索引)
+        except ValueError as e:
+            logger.warning("警告: %s，将输出一个黑色图像。", e)
+            return (create_empty_image(), 0)
+        return (frames, len(indices))
+
+
 class YunlanImageCombiner:
     """
     图片拼接节点
@@ -533,12 +784,12 @@ class YunlanImageCombiner:
         # 检查依赖
         if Image is None:
             error_msg = "错误: PIL库未安装，请运行: pip install Pillow>=8.0.0"
-            print(f"[云岚AI] {error_msg}")
+            logger.error(error_msg)
             return safe_return_with_image(error_msg)
 
         if torch is None or np is None:
             error_msg = "错误: PyTorch或NumPy库未安装"
-            print(f"[云岚AI] {error_msg}")
+            logger.error(error_msg)
             return safe_return_with_image(error_msg)
 
         try:
@@ -547,7 +798,7 @@ class YunlanImageCombiner:
             append_img = self.tensor_to_pil(拼接图片)
         except Exception as e:
             error_msg = f"错误: 转换图像时发生错误 - {e}"
-            print(f"[云岚AI] {error_msg}")
+            logger.error(error_msg)
             return safe_return_with_image(error_msg)
         
         # 调整原图大小，保持纵横比
@@ -632,6 +883,71 @@ class YunlanImageCombiner:
         return image.resize((new_width, new_height), resize_method)
 
 
+class YunlanGridCombiner:
+    """
+    宫格拼图节点
+
+    把任意数量的图片（或图片批次）按宫格排列成一张图。布局只计算一次，
+    每个单元格缩放后直接写入预先分配的输出画布，不会像链式拼接那样反复复制整张画布。
+
+    输入:
+    - 图片0, 图片1, ...: 可连接多张图片或批次，会动态添加新端口，按端口顺序依次排入宫格
+    - 列数: 宫格列数，0表示自动（接近正方形）
+    - 适配方式: 适应（完整显示并留边）、填充（铺满并裁剪）、拉伸
+    - 单元格最大尺寸: 单元格最长边，单元格纵横比取第一张图片
+    - 间距: 单元格之间的间距（像素）
+    - 背景亮度: 留边和间距的填充亮度（0为黑，1为白）
+
+    输出:
+    - 图片: 拼接后的图片
+    """
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "列数": ("INT", {"default": 0, "min": 0, "max": 64, "step": 1}),
+                "适配方式": (list(FIT_MODES), {"default": "适应"}),
+                "单元格最大尺寸": ("INT", {"default": 512, "min": 64, "max": 4096, "step": 8}),
+                "间距": ("INT", {"default": 0, "min": 0, "max": 256, "step": 1}),
+                "背景亮度": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.0, "step": 0.01}),
+            },
+            "hidden": {
+                "node_id": "UNIQUE_ID",
+            },
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("图片",)
+    FUNCTION = "combine_grid"
+    CATEGORY = "云岚AI"
+
+    def combine_grid(self, 列数, 适配方式, 单元格最大尺寸, 间距, 背景亮度, node_id=None, **kwargs):
+        if torch is None:
+            logger.error("错误: PyTorch库未安装，这通常由ComfyUI提供")
+            return (None,)
+
+        # 按端口序号收集所有连接的图片
+        connected_images = []
+        for key, value in kwargs.items():
+            if key.startswith("图片") and value is not None:
+                try:
+                    connected_images.append((int(key[2:]), value))
+                except ValueError:
+                    continue
+
+        if not connected_images:
+            log_rate_limited(logger, logging.WARNING, (type(self).__name__, "empty"),
+                             "警告: 未连接任何图片输入，将输出一个黑色图像。")
+            return (create_empty_image(),)
+
+        batches = [image for _, image in sorted(connected_images, key=lambda item: item[0])]
+        try:
+            return (compose_grid(batches, 列数, 适配方式, 单元格最大尺寸, 间距, 背景亮度),)
+        except Exception as e:
+            logger.error("错误: 宫格拼图时发生错误 - %s", e)
+            return (create_empty_image(),)
+
+
 class DynamicTextSelector:
     """
     动态文本选择器
@@ -690,7 +1006,8 @@ class DynamicTextSelector:
 
         # 如果没有连接任何文本，返回空字符串
         if not connected_texts:
-            print(f"[云岚AI] 警告: 未连接任何文本输入，将输出一个空字符串。")
+            log_rate_limited(logger, logging.WARNING, (type(self).__name__, "empty"),
+                             "警告: 未连接任何文本输入，将输出一个空字符串。")
             return ("",)
 
         # 获取所有有效的索引并排序
@@ -715,6 +1032,8 @@ NODE_CLASS_MAPPINGS = {
     "云岚_条件选图": DynamicImageSelector,
     "云岚_条件选词": DynamicTextSelector,
     "云岚_拼图": YunlanImageCombiner,
+    "云岚_宫格拼图": YunlanGridCombiner,
+    "云岚_批次选帧": YunlanBatchFrameSelector,
 
 }
 
@@ -723,5 +1042,7 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "云岚_条件选图": "云岚_条件选图",
     "云岚_条件选词": "云岚_条件选词",
     "云岚_拼图": "云岚_拼图",
+    "云岚_宫格拼图": "云岚_宫格拼图",
+    "云岚_批次选帧": "云岚_批次选帧",
 
 }
\ No newline at end of file
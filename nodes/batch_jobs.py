@@ -0,0 +1,343 @@
+"""
+批处理任务管理
+把AI对话请求累积到JSONL文件，通过OpenAI兼容的 /v1/files + /v1/batches 接口批量提交，
+在后台轮询任务状态，并把结果写回结果文件。任务状态持久化在磁盘上，重启ComfyUI后继续跟踪。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .logger import get_logger
+
+logger = get_logger("batch_jobs")
+
+# 批处理数据目录（插件根目录下的batches文件夹）
+DEFAULT_BATCH_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "batches")
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+
+# 默认的自动提交阈值和轮询间隔（秒），可在settings.json中通过 batchAutoSubmitSize / batchPollInterval 修改
+DEFAULT_AUTO_SUBMIT_SIZE = 1000
+DEFAULT_POLL_INTERVAL = 60
+
+# 任务的终止状态
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# 处于这些状态的请求可以重新加入队列（unknown 表示从未排队）
+REQUEUE_STATUSES = ("unknown", "failed", "expired", "cancelled")
+
+
+def request_custom_id(body):
+    """根据请求体生成稳定的custom_id，相同的请求只会排队一次"""
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return "yl-" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def _int_setting(settings, key, default):
+    try:
+        value = int(settings.get(key, default))
+        return value if value > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+
+class BatchJobManager:
+    """
+    批处理任务管理器
+
+    目录结构：
+    - pending.jsonl: 尚未提交的请求
+    - state.json: 排队中的custom_id和已提交任务的状态
+    - results.jsonl: 已完成请求的结果（每行一个custom_id）；单个请求的错误记录也写在这里，
+      但不视为完成，请求状态为 failed，可重新排队
+    """
+
+    def __init__(self, batch_dir=DEFAULT_BATCH_DIR):
+        self.batch_dir = batch_dir
+        self.pending_path = os.path.join(batch_dir, "pending.jsonl")
+        self.state_path = os.path.join(batch_dir, "state.json")
+        self.results_path = os.path.join(batch_dir, "results.jsonl")
+        self._lock = threading.RLock()
+        self._poller = None
+        self._stop_event = threading.Event()
+        self._state = self._load_state()
+        self._results, self._errors = self._load_results()
+
+    # --- 持久化 ---
+    def _load_state(self):
+        state = {"pending": [], "jobs": {}}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    loaded = json.load(f)
+                if isinstance(loaded, dict):
+                    state["pending"] = list(loaded.get("pending", []))
+                    state["jobs"] = dict(loaded.get("jobs", {}))
+            except Exception as e:
+                logger.warning("警告: 读取批处理状态失败 - %s", e)
+        return state
+
+    def _save_state(self):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _load_results(self):
+        """返回 (成功的结果, 最近一次的错误记录)"""
+        results, errors = {}, {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        (errors if record.get("error") else results)[record["custom_id"]] = record
+                    except (ValueError, KeyError, AttributeError):
+                        continue
+        return results, errors
+
+    def _append_results(self, records):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        with open(self.results_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                (self._errors if record.get("error") else self._results)[record["custom_id"]] = record
+
+    # --- 排队与查询 ---
+    def lookup(self, custom_id):
+        """返回已完成的结果记录，没有时返回None"""
+        with self._lock:
+            return self._results.get(custom_id)
+
+    def last_error(self, custom_id):
+        """返回请求最近一次失败的错误信息，没有时返回None"""
+        with self._lock:
+            record = self._errors.get(custom_id)
+            return record.get("error") if record else None
+
+    def request_status(self, custom_id):
+        """
+        返回请求的状态：completed / pending / 任务状态 / unknown
+
+        任务已结束但结果中没有该请求时返回 failed。同一请求重新提交过时以最近的任务为准。
+        """
+        with self._lock:
+            if custom_id in self._results:
+                return "completed"
+            if custom_id in self._state["pending"]:
+                return "pending"
+            for job in reversed(list(self._state["jobs"].values())):
+                if custom_id in job.get("failed_ids", ()):
+                    return "failed"
+                if custom_id in job.get("custom_ids", []):
+                    return job.get("status", "submitted")
+            return "unknown"
+
+    def needs_enqueue(self, custom_id):
+        """请求是否需要（重新）加入队列，调用方应在加入前检查每日预算"""
+        return self.request_status(custom_id) in REQUEUE_STATUSES
+
+    def enqueue(self, body):
+        """
+        把请求加入待提交队列
+
+        已完成、已排队或已提交的相同请求不会重复加入。返回 custom_id。
+        """
+        custom_id = request_custom_id(body)
+        with self._lock:
+            if not self.needs_enqueue(custom_id):
+                return custom_id
+            self._errors.pop(custom_id, None)
+            os.makedirs(self.batch_dir, exist_ok=True)
+            line = {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+            with open(self.pending_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            self._state["pending"].append(custom_id)
+            self._save_state()
+        return custom_id
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._state["pending"])
+
+    def summary(self):
+        """返回队列和任务的概要信息"""
+        with self._lock:
+            return {
+                "pending": len(self._state["pending"]),
+                "results": len(self._results),
+                "jobs": {
+                    batch_id: {**{k: v for k, v in job.items() if k not in ("custom_ids", "failed_ids")},
+                               "requests": len(job.get("custom_ids", [])),
+                               "failed": len(job.get("failed_ids", []))}
+                    for batch_id, job in self._state["jobs"].items()
+                },
+            }
+
+    # --- 提交与轮询 ---
+    def submit(self, client):
+        """上传待提交队列并创建批处理任务，返回任务ID；队列为空时返回None"""
+        with self._lock:
+            if not self._state["pending"]:
+                return None
+            if not os.path.exists(self.pending_path):
+                # 队列文件丢失（被手动删除等），这些请求无法提交，清空后下次运行时会重新排队
+                logger.warning("警告: 待提交队列文件不存在，丢弃 %d 个排队中的请求", len(self._state["pending"]))
+                self._state["pending"] = []
+                self._save_state()
+                return None
+            # 先改名再上传，上传期间新加入的请求写入新的pending文件
+            upload_path = os.path.join(self.batch_dir, f"upload-{int(time.time() * 1000)}.jsonl")
+            os.replace(self.pending_path, upload_path)
+            custom_ids = self._state["pending"]
+            self._state["pending"] = []
+            self._save_state()
+
+        try:
+            with open(upload_path, 'rb') as f:
+                input_file = client.files.create(file=f, purpose="batch")
+            batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                          completion_window=COMPLETION_WINDOW)
+        except Exception:
+            # 提交失败时把请求放回队列
+            with self._lock:
+                with open(upload_path, 'r', encoding='utf-8') as src, open(self.pending_path, 'a', encoding='utf-8') as dst:
+                    dst.write(src.read())
+                os.remove(upload_path)
+                self._state["pending"] = custom_ids + self._state["pending"]
+                self._save_state()
+            raise
+
+        with self._lock:
+            self._state["jobs"][batch.id] = {
+                "status": getattr(batch, "status", "validating") or "validating",
+                "input_file_id": input_file.id,
+                "submitted_at": time.time(),
+                "custom_ids": custom_ids,
+            }
+            self._save_state()
+        os.remove(upload_path)
+        logger.info("已提交批处理任务 %s，共 %d 个请求", batch.id, len(custom_ids))
+        return batch.id
+
+    def maybe_auto_submit(self, client, settings):
+        """待提交请求达到阈值时自动提交"""
+        if self.pending_count() >= _int_setting(settings, "batchAutoSubmitSize", DEFAULT_AUTO_SUBMIT_SIZE):
+            return self.submit(client)
+        return None
+
+    def _collect_output(self, client, file_id, batch_id):
+        content = client.files.content(file_id)
+        text = content.text if hasattr(content, "text") else content.read().decode("utf-8")
+        records = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            record = {"custom_id": item.get("custom_id"), "batch_id": batch_id}
+            response = item.get("response") or {}
+            body = response.get("body") or {}
+            if item.get("error") or response.get("status_code", 200) >= 400:
+                record["error"] = item.get("error") or body.get("error") or f"状态码 {response.get('status_code')}"
+            else:
+                choices = body.get("choices") or []
+                record["message"] = (choices[0].get("message") if choices else None) or {}
+                record["usage"] = body.get("usage")
+            if record["custom_id"]:
+                records.append(record)
+        return records
+
+    def poll(self, client):
+        """检查所有未结束的任务，下载已完成任务的结果。返回仍未结束的任务数"""
+        with self._lock:
+            active = [bid for bid, job in self._state["jobs"].items() if job.get("status") not in TERMINAL_STATUSES]
+
+        for batch_id in active:
+            try:
+                batch = client.batches.retrieve(batch_id)
+            except Exception as e:
+                logger.warning("警告: 查询批处理任务 %s 失败 - %s", batch_id, e)
+                continue
+
+            records = []
+            try:
+                for file_id in (getattr(batch, "output_file_id", None), getattr(batch, "error_file_id", None)):
+                    if file_id and batch.status in TERMINAL_STATUSES:
+                        records.extend(self._collect_output(client, file_id, batch_id))
+            except Exception as e:
+                logger.warning("警告: 下载批处理任务 %s 的结果失败 - %s", batch_id, e)
+                continue
+
+            with self._lock:
+                job = self._state["jobs"].get(batch_id, {})
+                job["status"] = batch.status
+                job["output_file_id"] = getattr(batch, "output_file_id", None)
+                if records:
+                    self._append_results(records)
+                if batch.status in TERMINAL_STATUSES:
+                    job["finished_at"] = time.time()
+                    # 出错或结果文件中缺少的请求视为失败，下次运行时可重新排队
+                    job["failed_ids"] = [cid for cid in job.get("custom_ids", []) if cid not in self._results]
+                    logger.info("批处理任务 %s 已结束，状态: %s，结果 %d 条", batch_id, batch.status, len(records))
+                self._save_state()
+
+        with self._lock:
+            return sum(1 for job in self._state["jobs"].values() if job.get("status") not in TERMINAL_STATUSES)
+
+    def has_active_jobs(self):
+        with self._lock:
+            return any(job.get("status") not in TERMINAL_STATUSES for job in self._state["jobs"].values())
+
+    def start_polling(self, client_factory, settings_loader):
+        """
+        启动后台轮询线程（已在运行时不重复启动）
+
+        client_factory: 根据设置返回OpenAI客户端上下文管理器的函数（如 use_openai_client），
+                        轮询期间客户端保持登记为使用中
+        settings_loader: 返回当前设置的函数
+        """
+        with self._lock:
+            if self._poller is not None and self._poller.is_alive():
+                return
+            self._stop_event.clear()
+            self._poller = threading.Thread(target=self._poll_loop, args=(client_factory, settings_loader),
+                                            name="yunlan-batch-poller", daemon=True)
+            self._poller.start()
+
+    def stop_polling(self):
+        self._stop_event.set()
+
+    def _poll_loop(self, client_factory, settings_loader):
+        while not self._stop_event.is_set():
+            settings = settings_loader() or {}
+            try:
+                with client_factory(settings) as client:
+                    remaining = self.poll(client)
+            except Exception as e:
+                logger.warning("警告: 轮询批处理任务时发生错误 - %s", e)
+                remaining = 1
+            if remaining == 0:
+                break
+            self._stop_event.wait(_int_setting(settings, "batchPollInterval", DEFAULT_POLL_INTERVAL))
+        with self._lock:
+            self._poller = None
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_batch_manager():
+    """获取共享的批处理任务管理器"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = BatchJobManager()
+        return _manager
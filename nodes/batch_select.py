@@ -0,0 +1,91 @@
+"""
+批次帧选择
+解析形如 "0:64:4"、"3,7,12"、"-1"、"0:8,12" 的索引表达式，并尽量以张量视图（切片）返回所选帧，
+只有无法表示为等间隔切片时才进行一次gather，避免为视频工作流复制大批次。
+"""
+
+import re
+
+_PART_PATTERN = re.compile(r"^\s*(-?\d+)?\s*(?::\s*(-?\d+)?\s*(?::\s*(-?\d+)?\s*)?)?$")
+
+
+def _nearest_valid(index, length):
+    """把索引限制到最近的有效索引（负数从末尾倒数）"""
+    if index < 0:
+        index += length
+    return min(max(index, 0), length - 1)
+
+
+def parse_index_spec(spec, length):
+    """
+    把索引表达式解析为帧索引列表
+
+    - 单个索引: "3"、"-1"（负数从末尾倒数），超出范围时取最近的有效索引
+    - 范围: "start:stop:step"，与Python切片相同；范围完全落在批次之外时取最接近起点的有效帧
+    - 多个部分用逗号分隔，按书写顺序拼接（允许重复）
+    空表达式表示全部帧。格式错误或只有分隔符（如 ","）时抛出 ValueError。
+    """
+    if length <= 0:
+        return []
+    spec = (spec or "").strip()
+    if not spec:
+        return list(range(length))
+
+    indices = []
+    for part in spec.replace("，", ",").split(","):
+        if not part.strip():
+            continue
+        match = _PART_PATTERN.match(part)
+        if not match:
+            raise ValueError(f"无法解析的索引: '{part.strip()}'")
+        start, stop, step = (int(g) if g is not None else None for g in match.groups())
+        if ":" not in part:
+            indices.append(_nearest_valid(start, length))
+            continue
+        if step == 0:
+            raise ValueError(f"步长不能为0: '{part.strip()}'")
+        selected = range(length)[slice(start, stop, step)]
+        if len(selected) == 0:
+            anchor = start if start is not None else (0 if (step or 1) > 0 else length - 1)
+            selected = [_nearest_valid(anchor, length)]
+        indices.extend(selected)
+    if not indices:
+        raise ValueError(f"索引表达式中没有任何索引: '{spec}'")
+    return indices
+
+
+def indices_as_slice(indices):
+    """
+    等间隔且递增的索引返回对应的 slice，否则返回None
+
+    递增的切片可以直接得到张量视图，不需要复制数据。
+    """
+    if not indices:
+        return None
+    if len(indices) == 1:
+        return slice(indices[0], indices[0] + 1, 1)
+    step = indices[1] - indices[0]
+    if step <= 0:
+        return None
+    for previous, current in zip(indices, indices[1:]):
+        if current - previous != step:
+            return None
+    return slice(indices[0], indices[-1] + 1, step)
+
+
+def select_frames(images, spec):
+    """
+    按索引表达式从批次（第0维）中选取帧
+
+    能表示为递增等间隔切片时返回视图，否则进行一次 index_select。
+    返回 (所选帧, 索引列表)
+    """
+    indices = parse_index_spec(spec, images.shape[0])
+    if not indices:
+        return images, indices
+    selection = indices_as_slice(indices)
+    if selection is not None:
+        return images[selection], indices
+    import torch
+    index = torch.as_tensor(indices, dtype=torch.long, device=images.device)
+    return images.index_select(0, index), indices
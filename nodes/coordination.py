@@ -0,0 +1,415 @@
+"""
+多进程请求协调
+同一台机器上的多个ComfyUI进程（以及命令行工具）共用插件目录下的SQLite数据库，
+对相同 apiUrl/apiKey 的请求统一执行并发上限、每分钟请求数和每分钟Token数限制，
+等待中的请求在各进程之间轮流放行，避免某个进程占满配额、所有进程同时收到429。
+
+需要在settings.json中设置 coordinationEnabled 为 true，并至少配置一项上限才会生效；
+未开启时不访问数据库。
+"""
+
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from .api_client import resolve_api_key, sanitize_base_url
+from .logger import get_logger
+from .usage_store import usage_from_response
+
+logger = get_logger("coordination")
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "coordination.db")
+
+# 速率限制的统计窗口（秒）
+RATE_WINDOW = 60
+# 等待放行的默认超时时间（秒），可通过 coordinationTimeout 修改
+DEFAULT_TIMEOUT = 300
+# 占用中的并发名额由持有进程定期续期，超过该时间（秒）未续期时视为进程已退出，自动回收
+LEASE_TTL = 60
+# 续期间隔（秒）
+LEASE_RENEW_INTERVAL = 15
+# 排队中的请求超过该时间（秒）未刷新时视为进程已退出，移出队列
+TICKET_TTL = 15
+# 轮询间隔（秒）：从最小值开始逐步加长
+POLL_MIN_INTERVAL = 0.02
+POLL_MAX_INTERVAL = 0.25
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, worker TEXT NOT NULL,
+    acquired_at REAL NOT NULL, expires_at REAL NOT NULL, host TEXT NOT NULL DEFAULT '',
+    pid INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, worker TEXT NOT NULL,
+    enqueued_at REAL NOT NULL, heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, at REAL NOT NULL, tokens INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    scope TEXT NOT NULL, worker TEXT NOT NULL, last_granted REAL NOT NULL DEFAULT 0,
+    granted INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (scope, worker)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    scope TEXT NOT NULL, name TEXT NOT NULL, value REAL NOT NULL DEFAULT 0, PRIMARY KEY (scope, name)
+);
+CREATE INDEX IF NOT EXISTS idx_events_scope_at ON events (scope, at);
+CREATE INDEX IF NOT EXISTS idx_tickets_scope ON tickets (scope, id);
+"""
+
+
+class CoordinationTimeout(TimeoutError):
+    """等待放行超时"""
+
+
+def _process_alive(pid):
+    """检查本机进程是否仍在运行；无法判断时（如Windows）视为仍在运行，交给续期超时回收"""
+    if pid <= 0 or os.name == "nt":
+        # Windows 上 os.kill(pid, 0) 会向进程发送 CTRL_C_EVENT，不能用于探测
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 无权限等情况说明进程存在
+        return True
+    return True
+
+
+def _int_setting(settings, name, default=0):
+    try:
+        return max(0, int(settings.get(name) or default))
+    except (TypeError, ValueError):
+        return default
+
+
+def coordination_limits(settings):
+    """读取协调设置：(并发上限, 每分钟请求数, 每分钟Token数)，0表示不限制"""
+    return (_int_setting(settings, "maxConcurrentRequests"),
+            _int_setting(settings, "maxRequestsPerMinute"),
+            _int_setting(settings, "maxTokensPerMinute"))
+
+
+def coordination_enabled(settings):
+    """是否开启了跨进程协调（开启且至少配置了一项上限）"""
+    return bool(settings.get("coordinationEnabled")) and any(coordination_limits(settings))
+
+
+def coordination_scope(settings):
+    """协调范围：相同的API地址和Key共享同一组限制（Key只保存哈希）"""
+    key_hash = hashlib.sha1(str(resolve_api_key(settings) or "").encode("utf-8")).hexdigest()[:12]
+    return f"{sanitize_base_url(settings.get('apiUrl'))}#{key_hash}"
+
+
+class Lease:
+    """
+    已放行的请求
+
+    请求完成后调用 record_usage() 传入响应的 usage，按实际Token数修正速率统计；
+    release() 归还并发名额（由 Coordinator.slot() 自动调用）。
+    """
+
+    def __init__(self, coordinator=None, lease_id=None, event_id=None, waited=0.0):
+        self._coordinator = coordinator
+        self.lease_id = lease_id
+        self.event_id = event_id
+        self.waited = waited
+        self.tokens_used = None
+
+    def record_usage(self, usage):
+        counts = usage_from_response(usage)
+        if counts is not None:
+            self.tokens_used = counts[0] + counts[1]
+
+    def release(self):
+        if self._coordinator is not None:
+            self._coordinator.release(self)
+            self._coordinator = None
+
+
+class Coordinator:
+    """
+    基于SQLite的跨进程协调器
+
+    每次请求前在 tickets 表中排队；每个进程在自己的事务中检查是否轮到自己：
+    排队的请求按“所属进程上次被放行的时间”排序，再按排队顺序，
+    因此提交大量请求的进程不会让其他进程一直等待。
+    放行时写入 leases（并发名额）和 events（速率窗口），请求结束后释放名额。
+
+    名额记录持有进程的主机名和PID：同一台机器上持有进程已退出的名额会立即回收；
+    其余情况下由后台线程每 LEASE_RENEW_INTERVAL 秒续期，超过 LEASE_TTL 未续期的名额被回收。
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.worker = f"{self.host}:{self.pid}"
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._renewer = None
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout = 30000")
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode = WAL")
+                    conn.executescript(_SCHEMA)
+                    # 旧版本创建的 leases 表没有 host/pid 列
+                    columns = {row[1] for row in conn.execute("PRAGMA table_info(leases)")}
+                    for column, definition in (("host", "TEXT NOT NULL DEFAULT ''"),
+                                               ("pid", "INTEGER NOT NULL DEFAULT 0")):
+                        if column not in columns:
+                            conn.execute(f"ALTER TABLE leases ADD COLUMN {column} {definition}")
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _bump(conn, scope, name, value=1, use_max=False):
+        update = "MAX(value, excluded.value)" if use_max else "value + excluded.value"
+        conn.execute(f"INSERT INTO counters (scope, name, value) VALUES (?, ?, ?) "
+                     f"ON CONFLICT (scope, name) DO UPDATE SET value = {update}", (scope, name, value))
+
+    def _cleanup(self, conn, scope, now):
+        expired = conn.execute("DELETE FROM leases WHERE scope = ? AND expires_at < ?", (scope, now)).rowcount
+        # 本机上持有进程已退出的名额不必等待过期
+        pids = [row[0] for row in conn.execute(
+            "SELECT DISTINCT pid FROM leases WHERE scope = ? AND host = ? AND pid != ?", (scope, self.host, self.pid))]
+        for pid in pids:
+            if not _process_alive(pid):
+                expired += conn.execute("DELETE FROM leases WHERE scope = ? AND host = ? AND pid = ?",
+                                        (scope, self.host, pid)).rowcount
+        conn.execute("DELETE FROM tickets WHERE scope = ? AND heartbeat < ?", (scope, now - TICKET_TTL))
+        conn.execute("DELETE FROM events WHERE scope = ? AND at < ?", (scope, now - RATE_WINDOW))
+        if expired:
+            self._bump(conn, scope, "expired_leases", expired)
+
+    def _try_admit(self, scope, ticket_id, tokens, limits, started):
+        """
+        在一个事务中检查并尝试放行，返回 (租约ID, 速率事件ID) 或 (None, 建议等待秒数)
+        """
+        max_concurrent, max_requests, max_tokens = limits
+        now = time.time()
+        with self._transaction() as conn:
+            self._cleanup(conn, scope, now)
+            if conn.execute("UPDATE tickets SET heartbeat = ? WHERE id = ?", (now, ticket_id)).rowcount == 0:
+                # 长时间未刷新（如进程被挂起）已被移出队列，按原排队序号重新加入
+                conn.execute("INSERT INTO tickets (id, scope, worker, enqueued_at, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                             (ticket_id, scope, self.worker, started, now))
+
+            # 本轮可以放行的请求数
+            available = None
+            retry_after = 0.0
+            if max_concurrent:
+                active = conn.execute("SELECT COUNT(*) FROM leases WHERE scope = ?", (scope,)).fetchone()[0]
+                available = max_concurrent - active
+            if max_requests or max_tokens:
+                count, used, oldest = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(tokens), 0), MIN(at) FROM events WHERE scope = ?",
+                    (scope,)).fetchone()
+                if oldest is not None:
+                    retry_after = oldest + RATE_WINDOW - now
+                if max_requests:
+                    remaining = max_requests - count
+                    available = remaining if available is None else min(available, remaining)
+                # 单个请求超过每分钟Token上限时，只在窗口为空时放行，避免永远等待
+                if max_tokens and count and used + tokens > max_tokens:
+                    available = 0
+            if available is not None and available <= 0:
+                return None, retry_after
+
+            # 公平排队：按进程上次被放行的时间轮流，同一进程内按排队顺序
+            rows = conn.execute(
+                "SELECT t.id FROM tickets t LEFT JOIN workers w ON w.scope = t.scope AND w.worker = t.worker "
+                "WHERE t.scope = ? ORDER BY COALESCE(w.last_granted, 0), t.id LIMIT ?",
+                (scope, available if available is not None else 1 << 30)).fetchall()
+            if ticket_id not in (row[0] for row in rows):
+                return None, 0.0
+
+            conn.execute("DELETE FROM tickets WHERE id = ?", (ticket_id,))
+            lease_id = conn.execute(
+                "INSERT INTO leases (scope, worker, acquired_at, expires_at, host, pid) VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, self.worker, now, now + LEASE_TTL, self.host, self.pid)).lastrowid
+            event_id = conn.execute("INSERT INTO events (scope, at, tokens) VALUES (?, ?, ?)",
+                                    (scope, now, int(tokens))).lastrowid
+            conn.execute(
+                "INSERT INTO workers (scope, worker, last_granted, granted) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (scope, worker) DO UPDATE SET last_granted = excluded.last_granted, "
+                "granted = granted + 1", (scope, self.worker, now))
+            waited_ms = round((now - started) * 1000, 1)
+            self._bump(conn, scope, "admitted")
+            self._bump(conn, scope, "wait_ms_total", waited_ms)
+            self._bump(conn, scope, "wait_ms_max", waited_ms, use_max=True)
+            return (lease_id, event_id), 0.0
+
+    def acquire(self, settings, tokens=0):
+        """
+        等待放行一个请求，tokens 为预计消耗的Token数（输入加输出上限）
+
+        未开启协调时立即返回空租约；超过 coordinationTimeout 仍未放行时抛出 CoordinationTimeout。
+        """
+        if not coordination_enabled(settings):
+            return Lease()
+        limits = coordination_limits(settings)
+        scope = coordination_scope(settings)
+        try:
+            timeout = float(settings.get("coordinationTimeout", DEFAULT_TIMEOUT))
+        except (TypeError, ValueError):
+            timeout = DEFAULT_TIMEOUT
+
+        started = time.time()
+        with self._transaction() as conn:
+            ticket_id = conn.execute(
+                "INSERT INTO tickets (scope, worker, enqueued_at, heartbeat) VALUES (?, ?, ?, ?)",
+                (scope, self.worker, started, started)).lastrowid
+
+        interval = POLL_MIN_INTERVAL
+        try:
+            while True:
+                admitted, retry_after = self._try_admit(scope, ticket_id, tokens, limits, started)
+                waited = time.time() - started
+                if admitted is not None:
+                    break
+                if waited >= timeout:
+                    with self._transaction() as conn:
+                        self._bump(conn, scope, "timeouts")
+                    raise CoordinationTimeout(f"等待请求名额超过 {timeout:g} 秒")
+                # 受速率限制时等到窗口内最早的请求过期，否则逐步加长轮询间隔
+                time.sleep(min(max(retry_after, interval), POLL_MAX_INTERVAL, max(0.0, timeout - waited)))
+                interval = min(interval * 2, POLL_MAX_INTERVAL)
+        except BaseException:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM tickets WHERE id = ?", (ticket_id,))
+            raise
+
+        if waited >= 1:
+            logger.debug("等待请求名额 %.1f 秒", waited)
+        self._hold(admitted[0])
+        return Lease(self, admitted[0], admitted[1], waited)
+
+    def _hold(self, lease_id):
+        """记录本进程持有的名额，并确保续期线程在运行"""
+        with self._held_lock:
+            self._held.add(lease_id)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_loop, name="yunlan-lease-renewer", daemon=True)
+                self._renewer.start()
+
+    def _renew_loop(self):
+        while True:
+            time.sleep(LEASE_RENEW_INTERVAL)
+            with self._held_lock:
+                held = list(self._held)
+                if not held:
+                    self._renewer = None
+                    return
+            try:
+                with self._transaction() as conn:
+                    conn.executemany("UPDATE leases SET expires_at = ? WHERE id = ?",
+                                     [(time.time() + LEASE_TTL, lease_id) for lease_id in held])
+            except sqlite3.Error as e:
+                logger.warning("警告: 续期请求名额失败 - %s", e)
+
+    def release(self, lease):
+        """归还并发名额，并按实际用量修正速率窗口中的Token数"""
+        with self._held_lock:
+            self._held.discard(lease.lease_id)
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM leases WHERE id = ?", (lease.lease_id,))
+                if lease.tokens_used is not None:
+                    conn.execute("UPDATE events SET tokens = ? WHERE id = ?", (lease.tokens_used, lease.event_id))
+        except sqlite3.Error as e:
+            # 释放失败时名额不再续期，会在 LEASE_TTL 后自动回收
+            logger.warning("警告: 释放请求名额失败 - %s", e)
+
+    @contextmanager
+    def slot(self, settings, tokens=0):
+        """
+        在请求期间占用一个名额
+
+            with get_coordinator().slot(settings, tokens) as lease:
+                response = client.chat.completions.create(...)
+                lease.record_usage(response.usage)
+        """
+        lease = self.acquire(settings, tokens)
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    def status(self, settings):
+        """当前范围内的并发、排队、速率窗口和累计计数"""
+        scope = coordination_scope(settings)
+        max_concurrent, max_requests, max_tokens = coordination_limits(settings)
+        result = {
+            "enabled": coordination_enabled(settings),
+            "worker": self.worker,
+            "limits": {"maxConcurrentRequests": max_concurrent, "maxRequestsPerMinute": max_requests,
+                       "maxTokensPerMinute": max_tokens},
+        }
+        if not os.path.exists(self.db_path):
+            return result
+        now = time.time()
+        with self._transaction() as conn:
+            self._cleanup(conn, scope, now)
+            active = dict(conn.execute(
+                "SELECT worker, COUNT(*) FROM leases WHERE scope = ? GROUP BY worker", (scope,)).fetchall())
+            waiting = dict(conn.execute(
+                "SELECT worker, COUNT(*) FROM tickets WHERE scope = ? GROUP BY worker", (scope,)).fetchall())
+            requests, tokens = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM events WHERE scope = ?", (scope,)).fetchone()
+            workers = conn.execute(
+                "SELECT worker, granted, last_granted FROM workers WHERE scope = ?", (scope,)).fetchall()
+            counters = {name: round(value, 1) if name.startswith("wait_ms") else int(value)
+                        for name, value in conn.execute("SELECT name, value FROM counters WHERE scope = ?", (scope,))}
+        result.update({
+            "active": sum(active.values()),
+            "waiting": sum(waiting.values()),
+            "requests_last_minute": requests,
+            "tokens_last_minute": tokens,
+            "counters": counters,
+            "workers": {
+                worker: {"granted": granted, "last_granted": last_granted,
+                         "active": active.get(worker, 0), "waiting": waiting.get(worker, 0)}
+                for worker, granted, last_granted in workers
+            },
+        })
+        return result
+
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def get_coordinator():
+    """获取共享的协调器"""
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is None:
+            _coordinator = Coordinator()
+        return _coordinator
@@ -0,0 +1,163 @@
+"""
+AI对话引擎
+AI对话节点与命令行工具共用的提示词解析、图片编码、请求发送和响应清理逻辑。
+本模块不依赖ComfyUI（server/PromptServer）和PyTorch，可在ComfyUI之外单独使用。
+"""
+
+import json
+import os
+
+from .api_client import use_openai_client
+from .coordination import get_coordinator
+from .image_encoder import get_encode_service, payload_budget_bytes
+from .logger import get_logger
+from .response_images import extract_images_from_message, remote_images_enabled
+from .text_sanitizer import clean_text_for_ui
+from .token_estimator import (
+    DEFAULT_MAX_OUTPUT_TOKENS, estimate_messages_tokens, get_model_limits, plan_max_tokens,
+)
+from .usage_store import get_usage_store
+
+logger = get_logger("dialog_engine")
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(__file__))
+DEFAULT_SETTINGS_PATH = os.path.join(PLUGIN_DIR, "settings.json")
+DEFAULT_PROMPTS_PATH = os.path.join(PLUGIN_DIR, "prompts.json")
+
+
+def load_json_file(path, default):
+    """读取JSON文件，文件不存在或格式错误时返回默认值"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, type(default)) else default
+    except FileNotFoundError:
+        return default
+    except Exception as e:
+        logger.warning("警告: 读取 %s 失败 - %s", path, e)
+        return default
+
+
+def resolve_prompt(prompt_name, extra_text, prompts):
+    """
+    解析提示词
+
+    prompts 可以是提示词字典，也可以是返回字典的函数。
+    提示词名称不在字典中时直接把名称作为内容。
+    返回 (提示词内容, 附加文本)，两者都保证为字符串。
+    """
+    prompt_content = ""
+    try:
+        prompts_dict = prompts() if callable(prompts) else prompts
+        if isinstance(prompts_dict, dict) and prompt_name in prompts_dict:
+            prompt_content = prompts_dict[prompt_name]
+        else:
+            # 提示词不在字典中，使用提示词名称作为内容
+            prompt_content = prompt_name
+    except Exception as e:
+        logger.warning("警告: 构建提示时发生错误 - %s", e)
+        # 异常情况下，安全地使用提示词名称作为内容
+        prompt_content = prompt_name if prompt_name else ""
+
+    # 确保prompt_content是字符串类型
+    if not isinstance(prompt_content, str):
+        prompt_content = str(prompt_content) if prompt_content else ""
+
+    # 确保附加文本是字符串类型
+    extra_text_safe = str(extra_text) if extra_text else ""
+    return prompt_content, extra_text_safe
+
+
+def image_parts(data_urls):
+    """把图片数据URL转换为消息内容片段"""
+    return [{"type": "image_url", "image_url": {"url": url}} for url in data_urls]
+
+
+def parse_response(response, allow_remote_images=False):
+    """
+    解析对话接口的响应
+
+    allow_remote_images 为True时才收集图片链接（否则只收集数据URL）。
+    返回 (文本, 图片地址列表, 错误信息)。出错时文本为None。
+    """
+    if hasattr(response, 'choices') and response.choices:
+        message = response.choices[0].message
+        text, sources = extract_images_from_message(message, allow_remote_images) if message else (None, [])
+    elif isinstance(response, str):
+        text, sources = extract_images_from_message(response, allow_remote_images)
+    else:
+        return None, [], "错误: 收到未知的API响应格式。"
+
+    # 验证AI响应内容
+    if (not text or text.strip() == "") and not sources:
+        return None, [], "错误: AI返回了空的响应内容。"
+    return text or "", sources, None
+
+
+class DialogEngine:
+    """
+    无界面的AI对话引擎
+
+    settings / prompts 可直接传入字典，默认读取插件目录下的 settings.json 和 prompts.json。
+    """
+
+    def __init__(self, settings=None, prompts=None):
+        self.settings = settings if settings is not None else load_json_file(DEFAULT_SETTINGS_PATH, {})
+        self.prompts = prompts if prompts is not None else load_json_file(DEFAULT_PROMPTS_PATH, {})
+
+    def encode_frames(self, frames):
+        """并行编码多帧图像（HxWxC的numpy数组）为数据URL，按内容去重并受 imagePayloadBudgetMB 限制"""
+        if not frames:
+            return []
+        urls, _ = get_encode_service().encode_for_request(frames, payload_budget_bytes(self.settings))
+        return urls
+
+    def build_messages(self, prompt_name, extra_text="", data_urls=()):
+        """构建单轮对话的消息列表"""
+        prompt_content, extra_text_safe = resolve_prompt(prompt_name, extra_text, self.prompts)
+        content = [{"type": "text", "text": prompt_content + extra_text_safe}] + image_parts(data_urls)
+        return [{"role": "user", "content": content}]
+
+    def plan_max_tokens(self, model, messages, requested=0):
+        """按设置中的模型限制决定 max_tokens"""
+        try:
+            default_max_tokens = int(self.settings.get("defaultMaxTokens") or DEFAULT_MAX_OUTPUT_TOKENS)
+        except (TypeError, ValueError):
+            default_max_tokens = DEFAULT_MAX_OUTPUT_TOKENS
+        limits = get_model_limits(self.settings, model)
+        return plan_max_tokens(estimate_messages_tokens(messages, model), limits, requested, default_max_tokens)
+
+    def request(self, model, messages, max_tokens=None):
+        """发送对话请求，返回原始响应（开启跨进程协调时与ComfyUI进程共享并发和速率上限）"""
+        if max_tokens is None:
+            max_tokens = self.plan_max_tokens(model, messages)
+        if max_tokens <= 0:
+            raise ValueError(f"提示过长，超出模型 {model} 的上下文窗口")
+        tokens = estimate_messages_tokens(messages, model) + max_tokens
+        with get_coordinator().slot(self.settings, tokens) as lease, use_openai_client(self.settings) as client:
+            response = client.chat.completions.create(model=model, messages=messages, max_tokens=max_tokens)
+            lease.record_usage(getattr(response, "usage", None))
+        return response
+
+    def run(self, model, prompt_name, extra_text="", frames=(), data_urls=(), workflow="cli"):
+        """
+        执行一次完整的对话：编码 → 请求 → 清理
+
+        用量按 workflow 记入用量统计，超出每日预算时按设置限流或拒绝。
+        返回字典：text（清理后的文本）、raw_text、image_sources、usage、error
+        """
+        usage_store = get_usage_store()
+        refusal = usage_store.admit(self.settings)
+        if refusal:
+            return {"text": "", "raw_text": None, "image_sources": [], "usage": None, "error": refusal}
+        urls = list(data_urls) + self.encode_frames(list(frames))
+        messages = self.build_messages(prompt_name, extra_text, urls)
+        response = self.request(model, messages)
+        text, sources, error = parse_response(response, remote_images_enabled(self.settings))
+        return {
+            "text": clean_text_for_ui(text) if text is not None else "",
+            "raw_text": text,
+            "image_sources": sources,
+            "usage": usage_store.record(self.settings, model, workflow, getattr(response, "usage", None)),
+            "error": error,
+        }
@@ -0,0 +1,226 @@
+"""
+图像编码服务
+将IMAGE帧编码为PNG base64数据URL，多帧大图在线程池中并行编码。
+"""
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import atexit
+import base64
+import hashlib
+import io
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import get_logger
+
+logger = get_logger("image_encoder")
+
+# 批次总像素数低于该值时直接在当前线程编码，线程调度的开销不划算
+# （benchmarks/bench_image_encoder.py：2 帧 512x512 以内线程池没有收益）
+THREAD_POOL_PIXEL_THRESHOLD = 1024 * 1024
+
+# PNG压缩等级，与Pillow默认值一致
+PNG_COMPRESS_LEVEL = 6
+
+# 单次请求中图片数据URL的默认总大小上限（MB），可在settings.json中通过 imagePayloadBudgetMB 修改，0表示不限制
+DEFAULT_PAYLOAD_BUDGET_MB = 16
+# 超出上限时最多重新缩放编码的次数
+MAX_BUDGET_PASSES = 3
+# 缩放后的最短边下限（像素）
+MIN_DOWNSCALE_SIDE = 64
+
+
+def frame_to_uint8(frame):
+    """将 HxWxC 的float帧(0~1)转换为uint8数组"""
+    if frame.dtype == np.uint8:
+        return frame
+    return np.clip(frame * 255.0, 0, 255).astype(np.uint8)
+
+
+def encode_png_data_url(array, compress_level=PNG_COMPRESS_LEVEL):
+    """将uint8数组编码为PNG数据URL"""
+    if Image is None:
+        raise ImportError("PIL库未安装")
+    image = Image.fromarray(array)
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG", compress_level=compress_level)
+    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+    return f"data:image/png;base64,{img_str}"
+
+
+def payload_budget_bytes(settings):
+    """读取图片总大小上限（字节），0表示不限制"""
+    try:
+        budget_mb = float(settings.get("imagePayloadBudgetMB", DEFAULT_PAYLOAD_BUDGET_MB))
+    except (TypeError, ValueError, AttributeError):
+        budget_mb = DEFAULT_PAYLOAD_BUDGET_MB
+    return int(max(0.0, budget_mb) * 1024 * 1024)
+
+
+def dedupe_frames(frames):
+    """
+    按内容去重
+
+    返回 (去重后的uint8帧列表, 每个输入帧对应的去重后序号)
+    """
+    unique, mapping, seen = [], [], {}
+    for frame in frames:
+        array = np.ascontiguousarray(frame_to_uint8(frame))
+        key = (array.shape, hashlib.blake2b(array.data, digest_size=16).digest())
+        if key not in seen:
+            seen[key] = len(unique)
+            unique.append(array)
+        mapping.append(seen[key])
+    return unique, mapping
+
+
+def downscale_frame(array, scale):
+    """按比例缩小uint8帧，最短边不小于 MIN_DOWNSCALE_SIDE"""
+    height, width = array.shape[:2]
+    scale = max(scale, min(1.0, MIN_DOWNSCALE_SIDE / max(1, min(height, width))))
+    if scale >= 1.0:
+        return array
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    image = Image.fromarray(array).resize(size, getattr(Image, "LANCZOS", Image.BICUBIC))
+    return np.asarray(image)
+
+
+class FrameEncodeError(RuntimeError):
+    """部分帧编码失败；failures 为 {帧序号: 异常}，其余帧已正常编码"""
+
+    def __init__(self, failures, labels=None):
+        self.failures = dict(failures)
+        labels = labels or {}
+        details = "; ".join(f"{labels.get(i, f'第{i + 1}帧')}: {e}" for i, e in sorted(self.failures.items()))
+        super().__init__(f"{len(self.failures)} 张图片编码失败 - {details}")
+
+
+class ImageEncodeService:
+    """
+    图像编码服务
+
+    - 总像素数小于 thread_pixel_threshold 或只有一帧时，在调用线程内直接编码
+    - 更大的批次交给线程池：Pillow 的PNG压缩在C代码中执行时会释放GIL，多帧可以并行编码，
+      也没有进程间传递帧数据的开销（见 benchmarks/bench_image_encoder.py）
+    """
+
+    def __init__(self, max_workers=None, thread_pixel_threshold=THREAD_POOL_PIXEL_THRESHOLD):
+        self.max_workers = max_workers or max(1, min(os.cpu_count() or 1, 8))
+        self.thread_pixel_threshold = thread_pixel_threshold
+        self._threads = None
+        self._lock = threading.Lock()
+
+    def _get_threads(self):
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                   thread_name_prefix="yunlan-encode")
+            return self._threads
+
+    def shutdown(self):
+        with self._lock:
+            threads, self._threads = self._threads, None
+        if threads is not None:
+            threads.shutdown(wait=True)
+
+    def encode_frames(self, frames, compress_level=PNG_COMPRESS_LEVEL):
+        """
+        编码多帧图像
+
+        frames: HxWxC 的numpy数组列表（float 0~1 或 uint8）
+        返回与输入顺序一致的数据URL列表。单帧失败不会中断其他帧，
+        全部完成后若有失败帧则抛出 FrameEncodeError，其中记录了失败帧的序号。
+        """
+        if np is None:
+            raise ImportError("NumPy库未安装")
+
+        def encode_inline(frame):
+            return encode_png_data_url(frame_to_uint8(frame), compress_level)
+
+        results = [None] * len(frames)
+        failures = {}
+        total_pixels = sum(f.shape[0] * f.shape[1] for f in frames)
+        if len(frames) > 1 and total_pixels >= self.thread_pixel_threshold:
+            threads = self._get_threads()
+            tasks = [threads.submit(encode_inline, frame).result for frame in frames]
+        else:
+            tasks = [lambda frame=frame: encode_inline(frame) for frame in frames]
+
+        for i, task in enumerate(tasks):
+            try:
+                results[i] = task()
+            except Exception as e:
+                failures[i] = e
+
+        if failures:
+            raise FrameEncodeError(failures)
+        return results
+
+    def _encode_unique(self, unique, mapping, compress_level):
+        """编码去重后的帧，失败时按输入图片的序号报告"""
+        try:
+            return self.encode_frames(unique, compress_level)
+        except FrameEncodeError as e:
+            labels = {}
+            for index in e.failures:
+                inputs = [str(i + 1) for i, u in enumerate(mapping) if u == index]
+                labels[index] = f"第{'、'.join(inputs)}张图片"
+            raise FrameEncodeError(e.failures, labels) from None
+
+    def encode_for_request(self, frames, budget_bytes=0, compress_level=PNG_COMPRESS_LEVEL):
+        """
+        编码一次请求中的所有图片：按内容去重后并行编码，总大小超过 budget_bytes 时等比例缩小所有图片重新编码
+
+        返回 (数据URL列表, 统计信息)。统计信息包含 images（输入数）、unique（去重后数量）、bytes、scale。
+        """
+        unique, mapping = dedupe_frames(frames)
+        urls = self._encode_unique(unique, mapping, compress_level)
+        total = sum(len(url) for url in urls)
+        scale = 1.0
+
+        for _ in range(MAX_BUDGET_PASSES):
+            if not budget_bytes or total <= budget_bytes:
+                break
+            # PNG大小大致与像素数成正比，按面积比例缩小，并留出少量余量
+            scale *= math.sqrt(budget_bytes / total) * 0.95
+            urls = self._encode_unique([downscale_frame(frame, scale) for frame in unique], mapping, compress_level)
+            total = sum(len(url) for url in urls)
+
+        if budget_bytes and total > budget_bytes:
+            logger.warning("警告: 缩小后图片总大小 %.1f MB 仍超过上限 %.1f MB",
+                           total / 1048576, budget_bytes / 1048576)
+        elif scale < 1.0:
+            logger.info("图片总大小超过上限，已等比例缩小到 %.0f%%（%.1f MB）", scale * 100, total / 1048576)
+        return urls, {"images": len(frames), "unique": len(unique), "bytes": total, "scale": round(scale, 3)}
+
+    def encode_tensor(self, tensor, compress_level=PNG_COMPRESS_LEVEL):
+        """将 BxHxWxC 的IMAGE tensor每一帧编码为数据URL"""
+        array = tensor.cpu().numpy()
+        if array.ndim == 3:
+            array = array[None, ...]
+        return self.encode_frames(list(array), compress_level)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_encode_service():
+    """获取共享的图像编码服务实例"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ImageEncodeService()
+            atexit.register(_service.shutdown)
+        return _service
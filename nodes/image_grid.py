@@ -0,0 +1,121 @@
+"""
+宫格拼图
+一次性计算宫格布局，预先分配整张输出画布，把每个单元格缩放后直接写入画布对应的区域，
+避免逐次两两拼接时反复转换PIL图像和复制不断增长的画布。
+"""
+
+try:
+    import torch
+    import torch.nn.functional as F
+except ImportError:
+    torch = None
+    F = None
+
+import math
+
+# 单元格适配方式：适应（完整显示，留边）/ 填充（铺满，裁掉多余部分）/ 拉伸（忽略纵横比）
+FIT_MODES = ("适应", "填充", "拉伸")
+
+
+def compute_grid_layout(count, frame_size, columns=0, max_cell_size=512, padding=0):
+    """
+    计算宫格布局
+
+    count: 单元格数量；frame_size: 第一张图片的 (高, 宽)，决定单元格的纵横比；
+    columns 为0时自动取接近正方形的列数。单元格最长边不超过 max_cell_size，且不放大。
+    返回字典：rows、columns、cell_height、cell_width、padding、height、width
+    """
+    count = max(1, int(count))
+    columns = int(columns) if columns and columns > 0 else math.ceil(math.sqrt(count))
+    columns = min(columns, count)
+    rows = math.ceil(count / columns)
+
+    height, width = frame_size
+    scale = min(1.0, max_cell_size / max(height, width)) if max_cell_size > 0 else 1.0
+    cell_height = max(1, round(height * scale))
+    cell_width = max(1, round(width * scale))
+    padding = max(0, int(padding))
+    return {
+        "rows": rows,
+        "columns": columns,
+        "cell_height": cell_height,
+        "cell_width": cell_width,
+        "padding": padding,
+        "height": rows * cell_height + (rows - 1) * padding,
+        "width": columns * cell_width + (columns - 1) * padding,
+    }
+
+
+def _fit_size(height, width, cell_height, cell_width, fit_mode):
+    """返回缩放后的 (高, 宽)"""
+    if fit_mode == "拉伸":
+        return cell_height, cell_width
+    ratio = width / height
+    if (fit_mode == "填充") == (ratio > cell_width / cell_height):
+        return cell_height, max(1, round(cell_height * ratio))
+    return max(1, round(cell_width / ratio)), cell_width
+
+
+def _resize_batch(frames, height, width):
+    """缩放一批同尺寸的帧（B,H,W,C），返回 (B,height,width,C)"""
+    if frames.shape[1] == height and frames.shape[2] == width:
+        return frames
+    nchw = frames.permute(0, 3, 1, 2)
+    try:
+        resized = F.interpolate(nchw, size=(height, width), mode="bilinear", align_corners=False, antialias=True)
+    except TypeError:
+        # 旧版PyTorch不支持antialias参数
+        resized = F.interpolate(nchw, size=(height, width), mode="bilinear", align_corners=False)
+    return resized.permute(0, 2, 3, 1)
+
+
+def _match_channels(frames, channels):
+    if frames.shape[-1] == channels:
+        return frames
+    if frames.shape[-1] > channels:
+        return frames[..., :channels]
+    return frames[..., :1].expand(*frames.shape[:-1], channels)
+
+
+def compose_grid(batches, columns=0, fit_mode="适应", max_cell_size=512, padding=0, background=0.0):
+    """
+    把多批图片（每批为 B,H,W,C 的IMAGE张量）按顺序排入宫格
+
+    同一批内的帧尺寸相同，只需一次缩放调用；所有单元格直接写入预分配的输出张量。
+    返回 (1,H,W,C) 的IMAGE张量。
+    """
+    if torch is None:
+        raise ImportError("缺少 PyTorch 库，这通常由ComfyUI提供")
+    batches = [b for b in batches if b is not None and b.shape[0] > 0]
+    if not batches:
+        raise ValueError("没有可拼接的图片")
+
+    first = batches[0]
+    count = sum(b.shape[0] for b in batches)
+    layout = compute_grid_layout(count, (first.shape[1], first.shape[2]), columns, max_cell_size, padding)
+    channels = 3 if first.shape[-1] < 3 else first.shape[-1]
+    cell_height, cell_width, pad = layout["cell_height"], layout["cell_width"], layout["padding"]
+
+    canvas = torch.full((1, layout["height"], layout["width"], channels), float(background),
+                        dtype=torch.float32, device=first.device)
+
+    index = 0
+    for batch in batches:
+        batch = _match_channels(batch.to(device=canvas.device, dtype=torch.float32), channels)
+        height, width = _fit_size(batch.shape[1], batch.shape[2], cell_height, cell_width, fit_mode)
+        resized = _resize_batch(batch, height, width)
+
+        # 适应模式居中留边，填充模式居中裁剪
+        crop_y, crop_x = max(0, (height - cell_height) // 2), max(0, (width - cell_width) // 2)
+        off_y, off_x = max(0, (cell_height - height) // 2), max(0, (cell_width - width) // 2)
+        visible_h, visible_w = min(height, cell_height), min(width, cell_width)
+        cells = resized[:, crop_y:crop_y + visible_h, crop_x:crop_x + visible_w, :]
+
+        for frame in cells:
+            row, col = divmod(index, layout["columns"])
+            y = row * (cell_height + pad) + off_y
+            x = col * (cell_width + pad) + off_x
+            canvas[0, y:y + visible_h, x:x + visible_w, :] = frame
+            index += 1
+
+    return canvas.clamp_(0.0, 1.0)
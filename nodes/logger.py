@@ -0,0 +1,118 @@
+"""
+插件日志
+基于标准库logging的插件日志：按 settings.json 中的 logLevel 过滤，低于该级别的消息不会被格式化和输出；
+重复出现的警告可按键限流；最近的日志保存在内存中的环形缓冲区，通过 /yunlan/logs 查看。
+"""
+
+import logging
+import sys
+import threading
+import time
+from collections import deque
+
+LOGGER_NAME = "yunlan"
+LOG_PREFIX = "[云岚AI]"
+DEFAULT_LEVEL = "INFO"
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+# 内存中保留的日志条数
+RING_BUFFER_SIZE = 500
+# 限流日志的默认间隔（秒）
+DEFAULT_RATE_LIMIT_INTERVAL = 60
+
+
+class RingBufferHandler(logging.Handler):
+    """把日志保存到定长的环形缓冲区"""
+
+    def __init__(self, capacity=RING_BUFFER_SIZE):
+        super().__init__()
+        self._records = deque(maxlen=capacity)
+        self._records_lock = threading.Lock()
+
+    def emit(self, record):
+        try:
+            entry = {
+                "time": record.created,
+                "level": record.levelname,
+                "source": record.name,
+                "message": record.getMessage(),
+            }
+            if record.exc_info:
+                entry["exception"] = logging.Formatter().formatException(record.exc_info)
+            with self._records_lock:
+                self._records.append(entry)
+        except Exception:
+            self.handleError(record)
+
+    def records(self, limit=None, level=None):
+        """返回最近的日志（按时间顺序），可按最低级别过滤"""
+        with self._records_lock:
+            records = list(self._records)
+        if level:
+            threshold = logging.getLevelName(str(level).upper())
+            if isinstance(threshold, int):
+                records = [r for r in records if logging.getLevelName(r["level"]) >= threshold]
+        if limit:
+            records = records[-int(limit):]
+        return records
+
+
+_logger = logging.getLogger(LOGGER_NAME)
+_ring_buffer = RingBufferHandler()
+
+if not _logger.handlers:
+    _console = logging.StreamHandler(sys.stdout)
+    _console.setFormatter(logging.Formatter(f"{LOG_PREFIX} %(message)s"))
+    _logger.addHandler(_console)
+    _logger.addHandler(_ring_buffer)
+    _logger.setLevel(DEFAULT_LEVEL)
+    # 使用自己的输出格式，不再交给ComfyUI的根日志重复输出
+    _logger.propagate = False
+
+
+def get_logger(name=None):
+    """获取插件日志记录器，name 为子模块名"""
+    return _logger.getChild(name) if name else _logger
+
+
+def set_level(level):
+    """设置日志级别，无效的级别会被忽略。返回生效的级别名"""
+    level = str(level or DEFAULT_LEVEL).upper()
+    if level not in LEVELS:
+        level = DEFAULT_LEVEL
+    _logger.setLevel(level)
+    return level
+
+
+def configure_from_settings(settings):
+    """按设置中的 logLevel 调整日志级别"""
+    return set_level(settings.get("logLevel") if isinstance(settings, dict) else None)
+
+
+_rate_limits = {}
+_rate_limits_lock = threading.Lock()
+
+
+def log_rate_limited(logger, level, key, msg, *args, interval=DEFAULT_RATE_LIMIT_INTERVAL):
+    """
+    按键限流记录日志
+
+    同一个 key 在 interval 秒内只记录一次，之后再次记录时附带被省略的次数。
+    """
+    if not logger.isEnabledFor(level):
+        return
+    now = time.monotonic()
+    with _rate_limits_lock:
+        last, suppressed = _rate_limits.get(key, (None, 0))
+        if last is not None and now - last < interval:
+            _rate_limits[key] = (last, suppressed + 1)
+            return
+        _rate_limits[key] = (now, 0)
+    if suppressed:
+        msg = f"{msg}（{interval:g} 秒内省略了 {suppressed} 条相同的日志）"
+    logger.log(level, msg, *args)
+
+
+def recent_logs(limit=200, level=None):
+    """返回环形缓冲区中最近的日志"""
+    return _ring_buffer.records(limit, level)
@@ -0,0 +1,202 @@
+"""
+模型列表发现
+通过OpenAI兼容的 /v1/models 接口获取网关实际提供的模型，带TTL缓存。
+缓存过期后继续返回旧列表，同时在后台线程刷新（stale-while-revalidate），
+使 /object_info 等请求永远不会因网络而阻塞；获取失败时退回 settings.json 中的 modelList。
+"""
+
+import hashlib
+import threading
+import time
+
+from .api_client import resolve_api_key, sanitize_base_url, use_openai_client
+from .logger import get_logger
+from .transport import get_transport_mode
+
+logger = get_logger("model_catalog")
+
+# 默认缓存有效期（秒），可在settings.json中通过 modelListTTL 修改
+DEFAULT_MODELS_TTL = 600
+# 获取失败后的重试间隔（秒）
+RETRY_INTERVAL = 60
+# 请求 /v1/models 的超时时间（秒）
+FETCH_TIMEOUT = 10
+
+# 设置中没有模型列表时使用的备用列表
+FALLBACK_MODELS = ["gpt-4o", "gpt-4-turbo"]
+
+
+def static_model_list(settings):
+    """读取settings.json中手动维护的模型列表"""
+    models = settings.get("modelList") if isinstance(settings, dict) else None
+    if not isinstance(models, list) or not models:
+        return list(FALLBACK_MODELS)
+    return [str(m) for m in models]
+
+
+def merge_model_lists(static_models, live_models):
+    """
+    合并手动维护的列表和网关返回的列表
+
+    手动列表中的模型全部保留并排在前面（保持原有顺序，已保存的工作流不会因网关列表缺少某个模型而失效），
+    只有网关提供的模型按名称排序追加在后面。
+    """
+    merged = list(dict.fromkeys(static_models))
+    chosen = set(merged)
+    return merged + sorted(m for m in set(live_models or ()) if m not in chosen)
+
+
+def fetch_models(settings):
+    """请求网关的 /v1/models，返回排序后的模型ID列表"""
+    with use_openai_client(settings) as client:
+        models = client.with_options(timeout=FETCH_TIMEOUT, max_retries=0).models.list()
+        return sorted({model.id for model in models})
+
+
+def _ttl(settings):
+    try:
+        ttl = float(settings.get("modelListTTL", DEFAULT_MODELS_TTL))
+        return ttl if ttl > 0 else DEFAULT_MODELS_TTL
+    except (TypeError, ValueError):
+        return DEFAULT_MODELS_TTL
+
+
+def _cache_key(settings):
+    api_key = resolve_api_key(settings) or ""
+    return (sanitize_base_url(settings.get("apiUrl")),
+            hashlib.sha1(api_key.encode("utf-8")).hexdigest()[:12],
+            get_transport_mode(settings))
+
+
+class ModelCatalog:
+    """
+    带TTL的模型列表缓存
+
+    缓存按 apiUrl/apiKey/传输模式 区分，设置变更后自动重新获取。
+    列表发生变化时调用 on_update 回调（用于向前端广播）。
+    """
+
+    def __init__(self, fetcher=fetch_models):
+        self._fetcher = fetcher
+        self._entry = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.on_update = None
+
+    def _can_fetch(self, settings):
+        return bool(settings.get("apiUrl")) and bool(resolve_api_key(settings))
+
+    def _current_entry(self, settings):
+        entry = self._entry
+        if entry is None or entry["key"] != _cache_key(settings):
+            return None
+        return entry
+
+    def update(self, settings, models, error=None):
+        """
+        写入已获取的网关模型列表，返回当前缓存的网关列表
+
+        error 不为空表示获取失败，此时保留旧列表并在 RETRY_INTERVAL 后重试。
+        连接预热已经请求过 /models 时用它直接填充缓存，不再重复请求。
+        """
+        key = _cache_key(settings)
+        previous = self._current_entry(settings)
+        if error is not None:
+            models = previous["models"] if previous else []
+        else:
+            models = sorted(set(models))
+
+        now = time.time()
+        entry = {
+            "key": key,
+            "models": models,
+            "fetched_at": now if error is None else (previous["fetched_at"] if previous else 0),
+            "retry_at": now + RETRY_INTERVAL if error else 0,
+            "error": error,
+        }
+        changed = previous is None or previous["models"] != models
+        with self._lock:
+            self._entry = entry
+
+        if error is None and changed:
+            logger.info("已获取 %d 个模型", len(models))
+            if self.on_update:
+                try:
+                    self.on_update()
+                except Exception as e:
+                    logger.warning("警告: 通知模型列表变更失败 - %s", e)
+        return models
+
+    def refresh(self, settings):
+        """同步获取模型列表并更新缓存，失败时保留旧列表。返回当前缓存的网关列表"""
+        try:
+            models, error = self._fetcher(settings), None
+        except Exception as e:
+            models, error = None, str(e)
+            logger.warning("警告: 获取模型列表失败，继续使用缓存或设置中的列表 - %s", e)
+        try:
+            return self.update(settings, models, error)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh_async(self, settings):
+        """在后台线程中刷新（已有刷新在进行时不重复启动）"""
+        if not self._can_fetch(settings):
+            return False
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+        threading.Thread(target=self.refresh, args=(dict(settings),),
+                         name="yunlan-model-catalog", daemon=True).start()
+        return True
+
+    def _needs_refresh(self, settings, entry):
+        now = time.time()
+        if entry is None:
+            return True
+        if entry["error"]:
+            return now >= entry["retry_at"]
+        return now - entry["fetched_at"] >= _ttl(settings)
+
+    def cached_models(self, settings):
+        """
+        立即返回缓存的网关模型列表（可能已过期，没有时为空列表）
+
+        缓存缺失或过期时在后台刷新，本次调用不会等待网络。
+        """
+        entry = self._current_entry(settings)
+        if self._needs_refresh(settings, entry):
+            self.refresh_async(settings)
+        return list(entry["models"]) if entry else []
+
+    def model_choices(self, settings):
+        """节点下拉框使用的模型列表"""
+        return merge_model_lists(static_model_list(settings), self.cached_models(settings))
+
+    def status(self, settings):
+        """返回模型列表及缓存状态，用于 /yunlan/models"""
+        live = self.cached_models(settings)
+        entry = self._current_entry(settings)
+        return {
+            "models": merge_model_lists(static_model_list(settings), live),
+            "live": live,
+            "fetchedAt": entry["fetched_at"] if entry else None,
+            "stale": entry is None or time.time() - entry["fetched_at"] >= _ttl(settings),
+            "refreshing": self._refreshing,
+            "error": entry["error"] if entry else None,
+        }
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_model_catalog():
+    """获取共享的模型列表缓存"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ModelCatalog()
+        return _catalog
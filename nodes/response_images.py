@@ -0,0 +1,195 @@
+"""
+响应图片解析
+从对话接口的返回中提取图片（base64数据URL或图片链接），
+并行解码为 ComfyUI 的 IMAGE 批量tensor（float32, BxHxWx3）。
+
+图片链接由模型生成，从ComfyUI所在的机器下载可能访问到内网地址，
+因此只有在settings.json中开启 remoteImageDownload 后才会下载，默认只解码数据URL。
+"""
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import base64
+import binascii
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import get_logger
+
+logger = get_logger("response_images")
+
+# Markdown图片链接：![描述](https://...)
+_MARKDOWN_IMAGE_PATTERN = re.compile(r'!\[[^\]]*\]\(\s*(https?://[^)\s]+)\s*\)')
+
+# 正文中裸露的base64数据URL
+_DATA_URL_PATTERN = re.compile(r'data:image/[a-zA-Z0-9.+-]+;base64,[A-Za-z0-9+/=\s]+')
+# 文本中替换数据URL的占位符，避免 文本 输出和会话历史携带base64数据
+DATA_URL_PLACEHOLDER = "[图片]"
+
+# 下载图片链接的超时时间（秒）和最大大小
+DOWNLOAD_TIMEOUT = 15
+MAX_DOWNLOAD_BYTES = 32 * 1024 * 1024
+
+# 并行解码的最大线程数
+MAX_DECODE_WORKERS = 8
+
+
+def _part_url(part):
+    """从 image_url 片段（dict或SDK对象）中取出地址"""
+    if isinstance(part, dict):
+        if part.get("type") not in (None, "image_url"):
+            return None
+        image_url = part.get("image_url")
+        if isinstance(image_url, dict):
+            return image_url.get("url")
+        return image_url if isinstance(image_url, str) else None
+    image_url = getattr(part, "image_url", None)
+    return getattr(image_url, "url", None) if image_url is not None else None
+
+
+def remote_images_enabled(settings):
+    """是否允许下载回复中的图片链接（默认关闭）"""
+    return isinstance(settings, dict) and bool(settings.get("remoteImageDownload"))
+
+
+def _is_remote(source):
+    return not source.startswith("data:")
+
+
+def extract_images_from_message(message, allow_remote=False):
+    """
+    提取消息中的图片
+
+    支持以下格式：
+    - content 为字符串时，其中裸露的base64数据URL（allow_remote 时还包括Markdown图片链接）
+    - content 为片段列表时，type 为 image_url 的片段
+    - 部分网关使用的 message.images 扩展字段
+    - message 本身为字符串时按正文处理
+
+    未开启 allow_remote 时忽略 http(s) 图片链接。返回的文本中数据URL替换为 DATA_URL_PLACEHOLDER，
+    其余内容（包括图片链接）保持原样。
+    返回 (文本, 图片地址列表)
+    """
+    sources = []
+    text_parts = []
+
+    content = message if isinstance(message, str) else getattr(message, "content", None)
+    if isinstance(content, str):
+        text_parts.append(content)
+    elif isinstance(content, list):
+        for part in content:
+            part_type = part.get("type") if isinstance(part, dict) else getattr(part, "type", None)
+            if part_type == "text":
+                text_parts.append(part.get("text", "") if isinstance(part, dict) else getattr(part, "text", ""))
+            elif part_type == "image_url":
+                url = _part_url(part)
+                if url:
+                    sources.append(url)
+
+    text = "".join(t for t in text_parts if t)
+    if text:
+        if allow_remote:
+            sources.extend(match.group(1) for match in _MARKDOWN_IMAGE_PATTERN.finditer(text))
+        sources.extend(re.sub(r'\s+', '', match.group(0)) for match in _DATA_URL_PATTERN.finditer(text))
+        # 匹配可能包含数据URL之后的空白，替换时保留
+        text = _DATA_URL_PATTERN.sub(lambda m: DATA_URL_PLACEHOLDER + m.group(0)[len(m.group(0).rstrip()):], text)
+
+    extra_images = None
+    if not isinstance(message, str):
+        extra_images = getattr(message, "images", None)
+        if extra_images is None:
+            model_extra = getattr(message, "model_extra", None) or {}
+            extra_images = model_extra.get("images")
+    for part in extra_images or []:
+        url = _part_url(part)
+        if url:
+            sources.append(url)
+
+    if not allow_remote:
+        sources = [source for source in sources if not _is_remote(source)]
+    return text, sources
+
+
+def _download(source):
+    if requests is None:
+        raise ImportError("requests库未安装，无法下载图片")
+    with requests.get(source, timeout=DOWNLOAD_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(chunk_size=65536):
+            data.extend(chunk)
+            if len(data) > MAX_DOWNLOAD_BYTES:
+                raise ValueError(f"图片超过 {MAX_DOWNLOAD_BYTES // 1048576} MB")
+        return bytes(data)
+
+
+def _load_image_bytes(source, allow_remote=False):
+    if not _is_remote(source):
+        try:
+            return base64.b64decode(source.split(",", 1)[1])
+        except (IndexError, binascii.Error) as e:
+            raise ValueError(f"无效的base64图片数据 - {e}")
+    if not allow_remote:
+        raise ValueError("未开启 remoteImageDownload，不下载图片链接")
+    return _download(source)
+
+
+def decode_image_source(source, allow_remote=False):
+    """将单个图片地址解码为 RGB 的PIL图像"""
+    if Image is None:
+        raise ImportError("PIL库未安装")
+    image = Image.open(io.BytesIO(_load_image_bytes(source, allow_remote)))
+    return image.convert("RGB")
+
+
+def decode_images_to_tensor(sources, allow_remote=False):
+    """
+    并行解码图片并合成一个IMAGE批量tensor
+
+    尺寸不一致时统一缩放到第一张图片的尺寸。
+    解码失败的图片会被跳过；没有任何可用图片时返回None。
+    """
+    if not sources:
+        return None
+    if torch is None or np is None or Image is None:
+        raise ImportError("缺少必要的库: PyTorch, NumPy 或 PIL")
+
+    def _decode(source):
+        try:
+            return decode_image_source(source, allow_remote)
+        except Exception as e:
+            logger.warning("警告: 解码返回的图片失败 - %s", e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(MAX_DECODE_WORKERS, len(sources))) as executor:
+        images = [img for img in executor.map(_decode, sources) if img is not None]
+    if not images:
+        return None
+
+    width, height = images[0].size
+    resize_method = getattr(Image, "LANCZOS", Image.BICUBIC)
+    batch = np.empty((len(images), height, width, 3), dtype=np.float32)
+    for i, image in enumerate(images):
+        if image.size != (width, height):
+            image = image.resize((width, height), resize_method)
+        np.multiply(np.asarray(image), 1.0 / 255.0, out=batch[i], casting="unsafe")
+    return torch.from_numpy(batch)
@@ -0,0 +1,210 @@
+"""
+多轮对话会话存储
+按会话ID保存对话历史：内存中保留最近使用的会话，同时持久化到磁盘，
+并按Token预算裁剪历史。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .logger import get_logger
+from .token_estimator import estimate_message_tokens
+
+logger = get_logger("session_store")
+
+# 默认的会话存储目录（插件根目录下的sessions文件夹）
+DEFAULT_SESSION_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "sessions")
+
+# 超出预算时裁剪到预算的该比例，留出余量，避免每一轮都改变历史前缀导致缓存失效
+TRIM_TARGET_RATIO = 0.75
+
+# 磁盘上最多保留的会话文件数，以及未更新的会话文件保留天数
+MAX_SESSION_FILES = 256
+MAX_SESSION_AGE_DAYS = 30
+# 两次清理会话目录之间的最短间隔（秒）
+PRUNE_INTERVAL = 300
+
+
+def _image_reference(part):
+    """把图片片段替换为只包含内容摘要的文本片段"""
+    image_url = part.get("image_url")
+    url = image_url.get("url", "") if isinstance(image_url, dict) else str(image_url or "")
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+    return {"type": "text", "text": f"[图片 {digest}]"}
+
+
+def strip_history_images(history):
+    """
+    只保留最后一条用户消息中的图片
+
+    更早的图片替换为带摘要的占位文本，历史中不再携带base64数据，
+    内存、磁盘占用和后续请求的大小都不随轮数增长。返回新列表。
+    """
+    last_user = max((i for i, m in enumerate(history) if m.get("role") == "user"), default=-1)
+    stripped = []
+    for index, message in enumerate(history):
+        content = message.get("content")
+        if index != last_user and isinstance(content, list) \
+                and any(isinstance(p, dict) and p.get("type") == "image_url" for p in content):
+            content = [_image_reference(p) if isinstance(p, dict) and p.get("type") == "image_url" else p
+                       for p in content]
+            message = {**message, "content": content}
+        stripped.append(message)
+    return stripped
+
+
+def trim_history(history, budget, reserved_tokens=0, model=None):
+    """
+    按Token预算裁剪对话历史
+
+    从最早的一轮（user+assistant）开始丢弃。仅在超出预算时裁剪，
+    且一次裁剪到预算的 TRIM_TARGET_RATIO，使随后的若干轮请求共享同一个稳定前缀。
+    返回裁剪后的新列表。
+    """
+    if budget <= 0:
+        return list(history)
+
+    costs = [estimate_message_tokens(m, model) for m in history]
+    total = sum(costs) + reserved_tokens
+    if total <= budget:
+        return list(history)
+
+    target = int(budget * TRIM_TARGET_RATIO)
+    start = 0
+    while start < len(history) and total > target:
+        # 成对丢弃，保证历史始终以user消息开头
+        step = 2 if start + 1 < len(history) and history[start + 1].get("role") == "assistant" else 1
+        total -= sum(costs[start:start + step])
+        start += step
+    return list(history[start:])
+
+
+class ConversationSessionStore:
+    """
+    有界的会话存储
+
+    - 内存中最多保留 max_sessions 个会话（LRU淘汰）
+    - 每次更新后原子写入磁盘，重启ComfyUI后可继续之前的会话
+    - 只有最近一轮的用户消息保留图片，更早的图片替换为摘要占位文本
+    - 磁盘上最多保留 max_files 个会话文件，超过 max_age_days 天未更新的会话文件会被删除
+    """
+
+    def __init__(self, session_dir=DEFAULT_SESSION_DIR, max_sessions=64,
+                 max_files=MAX_SESSION_FILES, max_age_days=MAX_SESSION_AGE_DAYS):
+        self.session_dir = session_dir
+        self.max_sessions = max_sessions
+        self.max_files = max_files
+        self.max_age_days = max_age_days
+        self._sessions = OrderedDict()
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+
+    def _session_path(self, session_id):
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.session_dir, f"{digest}.json")
+
+    def _load_from_disk(self, session_id):
+        path = self._session_path(session_id)
+        if not os.path.exists(path):
+            return []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            history = data.get("history", [])
+            return strip_history_images(history) if isinstance(history, list) else []
+        except Exception as e:
+            logger.warning("警告: 读取会话 '%s' 失败，将重新开始 - %s", session_id, e)
+            return []
+
+    def _save_to_disk(self, session_id, history):
+        try:
+            os.makedirs(self.session_dir, exist_ok=True)
+            path = self._session_path(session_id)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"session_id": session_id, "updated": time.time(), "history": history},
+                          f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("警告: 保存会话 '%s' 失败 - %s", session_id, e)
+        self._prune_files()
+
+    def _prune_files(self, force=False):
+        """删除过期的会话文件，并把文件数控制在 max_files 以内（调用方需持有锁）"""
+        now = time.time()
+        if not force and now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        try:
+            entries = []
+            with os.scandir(self.session_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith(".json"):
+                        entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            return
+        entries.sort(reverse=True)
+        cutoff = now - self.max_age_days * 86400 if self.max_age_days > 0 else None
+        keep = self.max_files if self.max_files > 0 else len(entries)
+        removed = 0
+        for index, (mtime, path) in enumerate(entries):
+            if index < keep and (cutoff is None or mtime >= cutoff):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info("已清理 %d 个过期的会话文件", removed)
+
+    def _remember(self, session_id, history):
+        self._sessions[session_id] = history
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get_history(self, session_id):
+        """获取会话历史（返回副本）"""
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is None:
+                history = self._load_from_disk(session_id)
+            self._remember(session_id, history)
+            return list(history)
+
+    def append_turn(self, session_id, history, user_message, assistant_message):
+        """在给定历史后追加一轮对话并保存（更早轮次的图片替换为摘要占位文本）"""
+        new_history = strip_history_images(list(history) + [user_message, assistant_message])
+        with self._lock:
+            self._remember(session_id, new_history)
+            self._save_to_disk(session_id, new_history)
+        return new_history
+
+    def clear(self, session_id):
+        """清空会话"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            path = self._session_path(session_id)
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                logger.warning("警告: 删除会话 '%s' 失败 - %s", session_id, e)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """获取共享的会话存储实例"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConversationSessionStore()
+        return _store
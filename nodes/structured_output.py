@@ -0,0 +1,391 @@
+"""
+结构化JSON输出
+为AI对话节点构建 response_format，在本地用预编译的校验器检查回复是否符合JSON Schema，
+并按路径取出字段作为文本/整数/浮点输出，下游不再需要额外的解析节点。
+
+安装了 jsonschema 时使用其校验器；否则使用本模块内置的校验器，
+支持常用的 type、enum、const、properties、required、additionalProperties、items、
+长度/数值范围、pattern 以及 allOf/anyOf/oneOf。
+"""
+
+try:
+    import jsonschema
+except ImportError:
+    jsonschema = None
+
+import json
+import re
+import threading
+from collections import OrderedDict
+
+# 节点上“输出格式”的选项
+OUTPUT_FORMATS = ("文本", "JSON对象", "JSON Schema")
+# json_object 模式要求消息中出现 "JSON"，提示词中没有时追加该说明
+JSON_REPLY_HINT = "\n请以JSON格式回复。"
+# 校验失败时最多反馈给模型的错误条数
+MAX_REPORTED_ERRORS = 5
+# 缓存的已编译校验器数量
+MAX_CACHED_VALIDATORS = 32
+
+_FENCE_PATTERN = re.compile(r"^\s*```(?:json)?\s*\n?(.*?)\n?\s*```\s*$", re.S | re.I)
+_PATH_PATTERN = re.compile(r"[^.\[\]]+|\[(-?\d+)\]")
+_NAME_PATTERN = re.compile(r"[^a-zA-Z0-9_-]")
+
+_JSON_TYPES = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: (isinstance(v, int) and not isinstance(v, bool))
+    or (isinstance(v, float) and v.is_integer()),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def parse_schema(text):
+    """
+    解析节点上填写的JSON Schema
+
+    为空时返回None；不是JSON对象时抛出 ValueError。
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    try:
+        schema = json.loads(text)
+    except ValueError as e:
+        raise ValueError(f"JSON Schema 不是有效的JSON - {e}")
+    if not isinstance(schema, dict):
+        raise ValueError("JSON Schema 必须是JSON对象")
+    return schema
+
+
+def build_response_format(output_format, schema=None):
+    """按输出格式构建请求的 response_format，文本模式返回None"""
+    if output_format == "JSON对象":
+        return {"type": "json_object"}
+    if output_format == "JSON Schema":
+        if schema is None:
+            raise ValueError("JSON Schema 模式需要填写 JSON Schema")
+        # 接口要求名称只包含字母、数字、下划线和连字符
+        name = _NAME_PATTERN.sub("_", str(schema.get("title") or ""))[:64]
+        if not re.search(r"[a-zA-Z0-9]", name):
+            name = "response"
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}
+    return None
+
+
+def extract_json(text):
+    """
+    从回复中解析JSON（兼容包裹在 ```json 代码块中的回复）
+
+    返回 (数据, 错误信息)，成功时错误信息为None。
+    """
+    text = (text or "").strip()
+    match = _FENCE_PATTERN.match(text)
+    if match:
+        text = match.group(1).strip()
+    try:
+        return json.loads(text), None
+    except ValueError as e:
+        return None, f"回复不是有效的JSON - {e}"
+
+
+# --- 内置校验器 ---
+# 把Schema预先编译为嵌套的检查函数，每个函数接收 (数据, 路径) 并返回错误列表，
+# 校验时不再重复解析Schema。
+
+def _format_path(path):
+    return "$" + "".join(f"[{p}]" if isinstance(p, int) else f".{p}" for p in path)
+
+
+def _is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _is_string_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+# 关键字取值的类型要求：(检查函数, 说明)；类型不对时编译阶段抛出 ValueError，
+# 而不是在编译或校验时出现 TypeError，或被静默忽略
+_KEYWORD_TYPES = {
+    "type": (lambda v: isinstance(v, str) or _is_string_list(v), "字符串或字符串数组"),
+    "enum": (lambda v: isinstance(v, list), "数组"),
+    "properties": (lambda v: isinstance(v, dict), "对象"),
+    "required": (_is_string_list, "字符串数组"),
+    "items": (lambda v: isinstance(v, (dict, bool, list)), "对象、布尔值或数组"),
+    "minItems": (_is_count, "非负整数"),
+    "maxItems": (_is_count, "非负整数"),
+    "minLength": (_is_count, "非负整数"),
+    "maxLength": (_is_count, "非负整数"),
+    "pattern": (lambda v: isinstance(v, str), "字符串"),
+    "minimum": (_JSON_TYPES["number"], "数值"),
+    "maximum": (_JSON_TYPES["number"], "数值"),
+    "exclusiveMinimum": (_JSON_TYPES["number"], "数值"),
+    "exclusiveMaximum": (_JSON_TYPES["number"], "数值"),
+    "allOf": (lambda v: isinstance(v, list) and len(v) > 0, "非空数组"),
+    "anyOf": (lambda v: isinstance(v, list) and len(v) > 0, "非空数组"),
+    "oneOf": (lambda v: isinstance(v, list) and len(v) > 0, "非空数组"),
+}
+
+
+def _check_keywords(schema):
+    for keyword, (check, expected) in _KEYWORD_TYPES.items():
+        if keyword in schema and not check(schema[keyword]):
+            raise ValueError(f"'{keyword}' 应为{expected}，实际为 {schema[keyword]!r}")
+
+
+def _compile(schema):
+    if schema is True or schema == {}:
+        return lambda value, path: []
+    if schema is False:
+        return lambda value, path: [f"{_format_path(path)}: 不允许出现该值"]
+    if not isinstance(schema, dict):
+        raise ValueError(f"子Schema应为对象或布尔值，实际为 {schema!r}")
+    _check_keywords(schema)
+
+    checks = []
+
+    types = schema.get("type")
+    if types is not None:
+        types = [types] if isinstance(types, str) else types
+        unknown = [t for t in types if t not in _JSON_TYPES]
+        if unknown:
+            raise ValueError(f"未知的类型: {unknown}")
+        type_checks = [_JSON_TYPES[t] for t in types]
+
+        def check_type(value, path):
+            if any(check(value) for check in type_checks):
+                return []
+            return [f"{_format_path(path)}: 应为 {'/'.join(types)} 类型"]
+        checks.append(check_type)
+
+    if "enum" in schema:
+        options = schema["enum"]
+
+        def check_enum(value, path):
+            return [] if value in options else [f"{_format_path(path)}: 应为 {options} 之一"]
+        checks.append(check_enum)
+
+    if "const" in schema:
+        const = schema["const"]
+
+        def check_const(value, path):
+            return [] if value == const else [f"{_format_path(path)}: 应为 {const!r}"]
+        checks.append(check_const)
+
+    properties = {name: _compile(sub) for name, sub in schema.get("properties", {}).items()}
+    required = schema.get("required", [])
+    additional = schema.get("additionalProperties", True)
+    additional_check = None if additional is True else _compile(additional)
+    if properties or required or additional_check is not None:
+        def check_object(value, path):
+            if not isinstance(value, dict):
+                return []
+            errors = [f"{_format_path(path)}: 缺少必填字段 '{name}'" for name in required if name not in value]
+            for name, item in value.items():
+                check = properties.get(name, additional_check)
+                if check is not None:
+                    errors.extend(check(item, path + [name]))
+            return errors
+        checks.append(check_object)
+
+    items = schema.get("items")
+    items_check = _compile(items) if isinstance(items, (dict, bool)) else None
+    min_items, max_items = schema.get("minItems"), schema.get("maxItems")
+    if items_check is not None or min_items is not None or max_items is not None:
+        def check_array(value, path):
+            if not isinstance(value, list):
+                return []
+            errors = []
+            if min_items is not None and len(value) < min_items:
+                errors.append(f"{_format_path(path)}: 至少需要 {min_items} 项")
+            if max_items is not None and len(value) > max_items:
+                errors.append(f"{_format_path(path)}: 最多允许 {max_items} 项")
+            if items_check is not None:
+                for index, item in enumerate(value):
+                    errors.extend(items_check(item, path + [index]))
+            return errors
+        checks.append(check_array)
+
+    min_length, max_length = schema.get("minLength"), schema.get("maxLength")
+    pattern = re.compile(schema["pattern"]) if "pattern" in schema else None
+    if min_length is not None or max_length is not None or pattern is not None:
+        def check_string(value, path):
+            if not isinstance(value, str):
+                return []
+            errors = []
+            if min_length is not None and len(value) < min_length:
+                errors.append(f"{_format_path(path)}: 长度不能小于 {min_length}")
+            if max_length is not None and len(value) > max_length:
+                errors.append(f"{_format_path(path)}: 长度不能大于 {max_length}")
+            if pattern is not None and not pattern.search(value):
+                errors.append(f"{_format_path(path)}: 不匹配 {pattern.pattern}")
+            return errors
+        checks.append(check_string)
+
+    bounds = [(schema.get(key), key) for key in ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum")]
+    if any(limit is not None for limit, _ in bounds):
+        def check_number(value, path):
+            if not _JSON_TYPES["number"](value):
+                return []
+            errors = []
+            for limit, key in bounds:
+                if limit is None:
+                    continue
+                if (key == "minimum" and value < limit) or (key == "maximum" and value > limit) \
+                        or (key == "exclusiveMinimum" and value <= limit) \
+                        or (key == "exclusiveMaximum" and value >= limit):
+                    errors.append(f"{_format_path(path)}: 不满足 {key} {limit}")
+            return errors
+        checks.append(check_number)
+
+    for keyword in ("allOf", "anyOf", "oneOf"):
+        if keyword not in schema:
+            continue
+        branches = [_compile(sub) for sub in schema[keyword]]
+
+        def check_combination(value, path, keyword=keyword, branches=branches):
+            results = [branch(value, path) for branch in branches]
+            if keyword == "allOf":
+                return [error for errors in results for error in errors]
+            matched = sum(1 for errors in results if not errors)
+            if keyword == "anyOf" and matched == 0:
+                return [f"{_format_path(path)}: 不符合 anyOf 中的任何一项"]
+            if keyword == "oneOf" and matched != 1:
+                return [f"{_format_path(path)}: 应恰好符合 oneOf 中的一项（实际 {matched} 项）"]
+            return []
+        checks.append(check_combination)
+
+    def validate(value, path):
+        errors = []
+        for check in checks:
+            errors.extend(check(value, path))
+        return errors
+    return validate
+
+
+def _compile_jsonschema(schema):
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    validator = cls(schema)
+
+    def validate(value):
+        errors = sorted(validator.iter_errors(value), key=lambda e: list(e.absolute_path))
+        return [f"{_format_path(list(e.absolute_path))}: {e.message}" for e in errors]
+    return validate
+
+
+_validators = OrderedDict()
+_validators_lock = threading.Lock()
+
+
+def validator_name():
+    """当前使用的校验器"""
+    return "jsonschema" if jsonschema is not None else "builtin"
+
+
+def get_validator(schema):
+    """
+    获取Schema对应的已编译校验器（按Schema内容缓存）
+
+    校验器接收解析后的数据，返回错误信息列表（为空表示通过）。Schema本身无效时抛出 ValueError。
+    """
+    key = json.dumps(schema, sort_keys=True, ensure_ascii=False)
+    with _validators_lock:
+        validator = _validators.get(key)
+        if validator is not None:
+            _validators.move_to_end(key)
+            return validator
+
+    if jsonschema is not None:
+        try:
+            validator = _compile_jsonschema(schema)
+        except jsonschema.exceptions.SchemaError as e:
+            raise ValueError(f"无效的JSON Schema - {e.message}")
+    else:
+        try:
+            compiled = _compile(schema)
+        except re.error as e:
+            raise ValueError(f"无效的JSON Schema - pattern 错误: {e}")
+        except ValueError as e:
+            raise ValueError(f"无效的JSON Schema - {e}")
+        except (TypeError, AttributeError) as e:
+            # 关键字检查之外的结构错误，同样作为无效Schema报告
+            raise ValueError(f"无效的JSON Schema - {e}")
+        validator = lambda value: compiled(value, [])
+
+    with _validators_lock:
+        _validators[key] = validator
+        while len(_validators) > MAX_CACHED_VALIDATORS:
+            _validators.popitem(last=False)
+    return validator
+
+
+def validate_reply(text, schema=None):
+    """
+    解析并校验回复
+
+    返回 (数据, 错误列表)；schema 为None时只检查是否为有效的JSON。
+    """
+    data, error = extract_json(text)
+    if error:
+        return None, [error]
+    if schema is None:
+        return data, []
+    return data, get_validator(schema)(data)
+
+
+def retry_message(errors):
+    """校验失败后反馈给模型的提示"""
+    shown = errors[:MAX_REPORTED_ERRORS]
+    more = f"\n（另有 {len(errors) - len(shown)} 处错误）" if len(errors) > len(shown) else ""
+    return ("上一次的回复未通过JSON校验:\n" + "\n".join(f"- {error}" for error in shown) + more
+            + "\n请修正后重新回复，只输出JSON，不要包含其他内容。")
+
+
+def get_field(data, path):
+    """
+    按路径取出字段，如 "name"、"items[0].score"、"items.0.score"
+
+    路径为空时返回整个数据；字段不存在时返回None。
+    """
+    path = (path or "").strip()
+    if not path:
+        return data
+    current = data
+    for match in _PATH_PATTERN.finditer(path):
+        key = match.group(1) if match.group(1) is not None else match.group(0)
+        if isinstance(current, list):
+            try:
+                current = current[int(key)]
+            except (ValueError, IndexError):
+                return None
+        elif isinstance(current, dict):
+            if key not in current:
+                return None
+            current = current[key]
+        else:
+            return None
+    return current
+
+
+def field_as_text(value):
+    """字段转为文本：字符串原样返回，其他值序列化为JSON"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def field_as_number(value, cast):
+    """字段转为整数或浮点数（cast 为 int 或 float），无法转换时返回0"""
+    if isinstance(value, bool):
+        return cast(value)
+    try:
+        return cast(float(value)) if cast is int else cast(value)
+    except (TypeError, ValueError, OverflowError):
+        return cast(0)
@@ -0,0 +1,102 @@
+"""
+文本清理
+清理AI返回的文本，防止在ComfyUI界面中显示错乱
+
+先截取需要的部分再处理，超长响应不会被完整扫描和复制多次；控制字符使用预编译的正则移除，
+换行符规范化只在文本含有回车符时进行。StreamingSanitizer 支持逐块清理流式返回的文本。
+
+注：CPython中 str.translate 遇到多字符替换或非ASCII文本时会逐字符查表，
+实测比 html.escape 的连续 str.replace 慢数倍，因此转义仍使用 html.escape。
+性能对比见 benchmarks/bench_sanitizer.py。
+"""
+
+import html
+import re
+
+# 清理后文本的最大长度（防止超长文本导致UI问题）
+MAX_TEXT_LENGTH = 50000  # 50K字符限制
+TRUNCATION_NOTICE = "\n\n[文本过长，已截断...]"
+
+# 控制字符（保留换行符、制表符和回车符，回车符在之后规范化）
+_CONTROL_CHARS = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+# html.escape 生成的实体的最大长度（&quot; / &#x27;），截断时据此避免切断实体
+_MAX_ENTITY_LENGTH = 6
+
+
+def _safe_cut(text, length):
+    """在 length 处截断，如果会切断转义实体则退到实体之前"""
+    cut = text[:length]
+    amp = cut.rfind("&", max(0, length - _MAX_ENTITY_LENGTH + 1))
+    if amp != -1 and ";" not in cut[amp:]:
+        cut = cut[:amp]
+    return cut
+
+
+class StreamingSanitizer:
+    """
+    增量文本清理器
+
+    依次调用 feed() 传入文本块，返回该块清理后的文本；全部传入后调用 finish() 取回剩余部分。
+    跨块的 "\\r\\n" 会被正确合并为一个换行符；输出达到 max_length 后截断并忽略后续输入。
+    """
+
+    def __init__(self, max_length=MAX_TEXT_LENGTH):
+        self.max_length = max_length
+        self.length = 0
+        self.truncated = False
+        self._pending_cr = False
+
+    @property
+    def remaining(self):
+        """在截断之前还能输出的字符数"""
+        return max(0, self.max_length - self.length)
+
+    def feed(self, chunk):
+        if self.truncated or not chunk:
+            return ""
+        text = html.escape(_CONTROL_CHARS.sub('', str(chunk)))
+        if not text:
+            return ""
+        if self._pending_cr:
+            # 上一块以 "\r" 结尾并已输出为换行符，本块开头的 "\n" 属于同一个换行
+            self._pending_cr = False
+            if text[0] == "\n":
+                text = text[1:]
+        # 规范化换行符（只有包含回车符时才需要额外处理）
+        if "\r" in text:
+            self._pending_cr = text.endswith("\r")
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+        if self.length + len(text) > self.max_length:
+            text = _safe_cut(text, self.max_length - self.length)
+            self.truncated = True
+        self.length += len(text)
+        return text
+
+    def finish(self):
+        return TRUNCATION_NOTICE if self.truncated else ""
+
+
+def clean_text_for_ui(text, max_length=MAX_TEXT_LENGTH):
+    """清理文本以防止UI错乱"""
+    if not text:
+        return ""
+
+    # 转换为字符串
+    text = str(text)
+    sanitizer = StreamingSanitizer(max_length)
+
+    # 常见情况：文本不超过上限，一次处理完
+    if len(text) <= max_length:
+        return sanitizer.feed(text) + sanitizer.finish()
+
+    # 超长文本：每次只取能够填满剩余长度的部分（多取一个字符用于判断是否需要截断），
+    # 通常一次就会达到上限，其余部分不再处理
+    parts = []
+    position = 0
+    while position < len(text) and not sanitizer.truncated:
+        step = sanitizer.remaining + 1
+        parts.append(sanitizer.feed(text[position:position + step]))
+        position += step
+    parts.append(sanitizer.finish())
+    return "".join(parts)
@@ -0,0 +1,212 @@
+"""
+本地Token估算
+在发送请求前估算消息占用的Token数量，无需访问网络。
+安装了 tiktoken 时使用其编码器精确计数，否则使用启发式估算。
+"""
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+import re
+import threading
+
+from .logger import get_logger
+
+logger = get_logger("token_estimator")
+
+# 中日韩字符大致按每字1个Token计算
+_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+# 其余字符大致按每4个字符1个Token计算
+CHARS_PER_TOKEN = 4
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 单张图片的估算Token数（高精度模式下一张512x512分块图片的典型开销）
+IMAGE_TOKEN_ESTIMATE = 765
+
+
+# 未配置模型限制时的默认输出上限（与旧版本固定的 max_tokens 一致）
+DEFAULT_MAX_OUTPUT_TOKENS = 2048
+
+# 计算剩余上下文时预留的安全余量
+CONTEXT_SAFETY_MARGIN = 64
+
+# 模型名不在tiktoken的映射表中时使用的编码
+DEFAULT_ENCODING = "o200k_base"
+
+# 按前缀匹配模型配置时，允许的版本后缀：-2024-08-06、-0613、-20241022
+_VERSION_SUFFIX_PATTERN = re.compile(r"^-(?:\d{4}-\d{2}-\d{2}|\d{4}|\d{8})$")
+
+_encodings = {}
+_loading = set()
+_encodings_lock = threading.Lock()
+
+
+def _load_encoding(model):
+    """在后台线程中加载编码器（首次使用时tiktoken可能需要下载编码文件），失败时缓存None不再重试"""
+    encoding = None
+    try:
+        encoding = tiktoken.encoding_for_model(model) if model else None
+    except Exception:
+        encoding = None
+    if encoding is None:
+        try:
+            encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+        except Exception as e:
+            logger.warning("警告: 加载tiktoken编码失败，使用启发式估算 - %s", e)
+    key = model or ""
+    with _encodings_lock:
+        _encodings[key] = encoding
+        _loading.discard(key)
+
+
+def _get_encoding(model):
+    """
+    获取模型对应的tiktoken编码器，不可用时返回None
+
+    不会阻塞调用方：编码器尚未加载时启动后台加载并返回None（本次使用启发式估算）。
+    """
+    if tiktoken is None:
+        return None
+    key = model or ""
+    with _encodings_lock:
+        if key in _encodings:
+            return _encodings[key]
+        if key in _loading:
+            return None
+        _loading.add(key)
+    threading.Thread(target=_load_encoding, args=(model,), name="yunlan-tiktoken", daemon=True).start()
+    return None
+
+
+def estimator_name(model=None):
+    """返回当前使用的估算方式名称"""
+    return "tiktoken" if _get_encoding(model) is not None else "heuristic"
+
+
+def _heuristic_text_tokens(text):
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_text_tokens(text, model=None):
+    """估算一段文本的Token数量"""
+    if not text:
+        return 0
+    text = str(text)
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return _heuristic_text_tokens(text)
+
+
+def estimate_content_tokens(content, model=None):
+    """估算消息content（字符串或多模态片段列表）的Token数量"""
+    if isinstance(content, str):
+        return estimate_text_tokens(content, model)
+    total = 0
+    for part in content or []:
+        if not isinstance(part, dict):
+            continue
+        if part.get("type") == "text":
+            total += estimate_text_tokens(part.get("text", ""), model)
+        elif part.get("type") == "image_url":
+            total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+
+def estimate_message_tokens(message, model=None):
+    """估算单条消息的Token数量"""
+    return MESSAGE_OVERHEAD_TOKENS + estimate_content_tokens(message.get("content"), model)
+
+
+def estimate_messages_tokens(messages, model=None):
+    """估算消息列表的Token数量"""
+    return sum(estimate_message_tokens(m, model) for m in messages)
+
+
+def truncate_text_to_tokens(text, max_tokens, model=None):
+    """将文本截断到不超过 max_tokens 个Token"""
+    if max_tokens <= 0 or not text:
+        return ""
+    if estimate_text_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    # 启发式估算是单调的，二分查找最长的合法前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if _heuristic_text_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def lookup_model_entry(table, model):
+    """
+    在按模型名组织的配置表中查找模型对应的条目
+
+    先精确匹配模型名，再匹配去掉版本后缀（如 -2024-08-06、-0613）后的模型名。
+    只按版本后缀匹配，gpt-4-turbo、gpt-4.1 等不同的模型不会匹配到 gpt-4 的条目。找不到时返回None。
+    """
+    if not isinstance(table, dict) or not model:
+        return None
+    entry = table.get(model)
+    if entry is None:
+        prefixes = [name for name in table
+                    if model.startswith(name) and _VERSION_SUFFIX_PATTERN.match(model[len(name):])]
+        if prefixes:
+            entry = table[max(prefixes, key=len)]
+    return entry
+
+
+def get_model_limits(settings, model):
+    """
+    从设置的 modelLimits 中查找模型的上下文窗口和输出上限
+
+    返回 {"contextWindow": int或None, "maxOutputTokens": int或None}
+    """
+    limits_table = settings.get("modelLimits") if isinstance(settings, dict) else None
+    limits = lookup_model_entry(limits_table, model)
+    if not isinstance(limits, dict):
+        limits = {}
+
+    def _positive_int(value):
+        try:
+            value = int(value)
+            return value if value > 0 else None
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "contextWindow": _positive_int(limits.get("contextWindow")),
+        "maxOutputTokens": _positive_int(limits.get("maxOutputTokens")),
+    }
+
+
+def plan_max_tokens(prompt_tokens, limits, requested=0, default_max_tokens=DEFAULT_MAX_OUTPUT_TOKENS):
+    """
+    根据提示大小和模型限制决定 max_tokens
+
+    requested 大于0时以其为目标，否则使用 default_max_tokens；
+    结果不超过模型的输出上限和剩余上下文。返回值可能小于等于0，表示提示已超出上下文。
+    """
+    desired = requested if requested and requested > 0 else default_max_tokens
+    if limits.get("maxOutputTokens"):
+        desired = min(desired, limits["maxOutputTokens"])
+    if limits.get("contextWindow"):
+        desired = min(desired, limits["contextWindow"] - prompt_tokens - CONTEXT_SAFETY_MARGIN)
+    return desired
+
+
+# 插件加载时即在后台加载默认编码，第一次运行节点时通常已可用
+if tiktoken is not None:
+    _get_encoding(None)
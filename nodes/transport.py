@@ -0,0 +1,193 @@
+"""
+录制/回放传输层
+挂在OpenAI客户端底层的httpx传输，支持三种模式：
+- live: 直接访问网络
+- record: 访问网络，并把请求/响应对写入cassette文件
+- replay: 只从cassette文件返回响应，未命中时直接失败，不访问网络
+"""
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+TRANSPORT_MODES = ("live", "record", "replay")
+
+# 默认的cassette文件路径（相对于插件根目录）
+DEFAULT_CASSETTE_PATH = os.path.join("cassettes", "default.cassette")
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(__file__))
+
+
+def get_transport_mode(settings):
+    """读取设置中的传输模式，无效值按live处理"""
+    mode = str(settings.get("transportMode", "live") or "live").lower() if isinstance(settings, dict) else "live"
+    return mode if mode in TRANSPORT_MODES else "live"
+
+
+def get_cassette_path(settings):
+    """读取设置中的cassette路径，相对路径以插件根目录为基准"""
+    path = settings.get("cassettePath") if isinstance(settings, dict) else None
+    path = path or DEFAULT_CASSETTE_PATH
+    return path if os.path.isabs(path) else os.path.join(PLUGIN_DIR, path)
+
+
+def request_key(method, path, body):
+    """
+    计算请求的哈希键
+
+    只使用方法、路径（含查询参数）和请求体，不包含主机名和认证头，
+    因此更换API地址或密钥后仍可回放。JSON请求体会先规范化（键排序）。
+    """
+    try:
+        canonical = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        canonical = body or b""
+    digest = hashlib.sha256()
+    digest.update(f"{method.upper()} {path}\n".encode("utf-8"))
+    digest.update(canonical)
+    return digest.hexdigest()
+
+
+class Cassette:
+    """
+    追加写入的cassette文件
+
+    每行一条记录：`键<TAB>状态码<TAB>Content-Type<TAB>base64(zlib(响应体))`。
+    打开时扫描一次建立 键→偏移量 的索引，查找时按偏移量读取单条记录。
+    同一个键重复录制时以最后一条为准。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = {}
+        self._lock = threading.Lock()
+        self._build_index()
+
+    def _build_index(self):
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                key = line.split(b"\t", 1)[0].decode("ascii", "ignore")
+                if key:
+                    self._index[key] = offset
+                offset += len(line)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, key):
+        """返回 (状态码, Content-Type, 响应体)，未命中时返回None"""
+        with self._lock:
+            offset = self._index.get(key)
+            if offset is None:
+                return None
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                line = f.readline()
+        _, status, content_type, payload = line.rstrip(b"\n").split(b"\t", 3)
+        body = zlib.decompress(base64.b64decode(payload))
+        return int(status), content_type.decode("utf-8"), body
+
+    def put(self, key, status, content_type, body):
+        """追加一条记录"""
+        payload = base64.b64encode(zlib.compress(body or b"", 6))
+        line = b"\t".join([key.encode("ascii"), str(status).encode("ascii"),
+                           (content_type or "").encode("utf-8"), payload]) + b"\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+            self._index[key] = offset
+
+
+_BaseTransport = httpx.BaseTransport if httpx is not None else object
+
+
+class RecordReplayTransport(_BaseTransport):
+    """支持录制和回放的httpx同步传输"""
+
+    def __init__(self, mode, cassette, inner=None):
+        if httpx is None:
+            raise ImportError("httpx库未安装（通常随openai一起安装）")
+        self.mode = mode
+        self.cassette = cassette
+        self.inner = inner if inner is not None else httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        if self.mode == "live":
+            return self.inner.handle_request(request)
+
+        body = request.read()
+        path = request.url.raw_path.decode("ascii", "ignore")
+        key = request_key(request.method, path, body)
+
+        if self.mode == "replay":
+            record = self.cassette.get(key)
+            if record is None:
+                error = {"error": {"message": f"回放模式下未找到录制的响应（请求键 {key[:16]}），"
+                                              f"请先在record模式下运行一次。", "type": "cassette_miss"}}
+                return httpx.Response(404, headers={"content-type": "application/json", "x-should-retry": "false"},
+                                      json=error, request=request)
+            status, content_type, content = record
+            return httpx.Response(status, headers={"content-type": content_type}, content=content, request=request)
+
+        response = self.inner.handle_request(request)
+        try:
+            content = response.read()
+        finally:
+            response.close()
+        content_type = response.headers.get("content-type", "")
+        # 只录制成功的响应，避免把临时错误固化到cassette中
+        if response.status_code < 400:
+            self.cassette.put(key, response.status_code, content_type, content)
+        # read()得到的是已解压的内容，去掉与原始编码相关的头
+        headers = [(k, v) for k, v in response.headers.items()
+                   if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    def close(self):
+        self.inner.close()
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path):
+    """按路径获取共享的cassette实例"""
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = Cassette(path)
+            _cassettes[path] = cassette
+        return cassette
+
+
+def build_http_client(settings, timeout=None):
+    """
+    按设置构建httpx客户端
+
+    live模式返回None（由OpenAI客户端自行创建默认连接池），
+    record/replay模式返回挂载了录制/回放传输的客户端。
+    """
+    mode = get_transport_mode(settings)
+    if mode == "live" or httpx is None:
+        return None
+    transport = RecordReplayTransport(mode, get_cassette(get_cassette_path(settings)))
+    return httpx.Client(transport=transport, timeout=timeout or httpx.Timeout(600.0, connect=10.0))
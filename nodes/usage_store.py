@@ -0,0 +1,275 @@
+"""
+Token用量与费用统计
+按天、模型和工作流记录每次调用的输入/输出/缓存Token数，追加写入插件目录下的usage文件夹，
+并根据 settings.json 中的 modelPrices 估算费用、执行每日预算（限流或拒绝）。
+"""
+
+import json
+import os
+import threading
+import time
+
+from .logger import get_logger
+from .token_estimator import lookup_model_entry
+
+logger = get_logger("usage_store")
+
+# 用量数据目录（插件根目录下的usage文件夹），每天一个JSONL文件
+DEFAULT_USAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "usage")
+
+# 超出预算后的处理方式：throttle 限流（拉长请求间隔）/ refuse 拒绝请求
+BUDGET_ACTIONS = ("throttle", "refuse")
+DEFAULT_THROTTLE_INTERVAL = 30
+
+# 批处理结果可能在提交后一天才取回，去重时需要覆盖的天数
+DEDUPE_DAYS = 3
+
+_FIELDS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens", "cost")
+
+
+def _day_of(timestamp):
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+
+def _get(obj, name):
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def usage_from_response(usage):
+    """
+    从响应的 usage（对象或字典）中取出 (输入Token, 输出Token, 缓存命中Token)
+
+    usage 为空时返回None。
+    """
+    if usage is None:
+        return None
+    details = _get(usage, "prompt_tokens_details")
+    return (
+        int(_get(usage, "prompt_tokens") or 0),
+        int(_get(usage, "completion_tokens") or 0),
+        int(_get(details, "cached_tokens") or 0) if details is not None else 0,
+    )
+
+
+def estimate_cost(settings, model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """
+    按 modelPrices 估算费用（价格单位为每百万Token）
+
+    价格表条目形如 {"input": 2.5, "output": 10, "cachedInput": 1.25}，未配置时返回0。
+    """
+    prices = lookup_model_entry(settings.get("modelPrices") if isinstance(settings, dict) else None, model)
+    if not isinstance(prices, dict):
+        return 0.0
+    try:
+        input_price = float(prices.get("input") or 0)
+        output_price = float(prices.get("output") or 0)
+        cached_price = float(prices.get("cachedInput", input_price) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    cost = (prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price \
+        + completion_tokens * output_price
+    return round(cost / 1_000_000, 6)
+
+
+def _budget_settings(settings):
+    try:
+        budget = float(settings.get("dailyBudget") or 0)
+    except (TypeError, ValueError):
+        budget = 0.0
+    action = settings.get("budgetAction", "throttle")
+    if action not in BUDGET_ACTIONS:
+        action = "throttle"
+    try:
+        interval = float(settings.get("budgetThrottleInterval", DEFAULT_THROTTLE_INTERVAL))
+    except (TypeError, ValueError):
+        interval = DEFAULT_THROTTLE_INTERVAL
+    return budget, action, max(0.0, interval)
+
+
+class UsageStore:
+    """
+    追加写入的用量存储
+
+    每条记录一行紧凑JSON：t 时间戳、m 模型、w 工作流、p/c/k 输入/输出/缓存Token、$ 费用、id 去重键（可选）。
+    内存中按天汇总已读取的记录，每次查询前读入文件新追加的部分（包括其他进程写入的记录），
+    用于预算检查和 /yunlan/usage 查询。
+    """
+
+    def __init__(self, usage_dir=DEFAULT_USAGE_DIR):
+        self.usage_dir = usage_dir
+        self._days = {}
+        self._seen_ids = set()
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def _day_path(self, day):
+        return os.path.join(self.usage_dir, f"{day}.jsonl")
+
+    def _ensure_day(self, day):
+        """
+        返回某一天的汇总（调用方需持有锁）
+
+        每次调用都检查文件大小，只读取上次之后追加的完整行，
+        因此其他ComfyUI进程和命令行工具写入的记录也会计入预算。
+        """
+        cached = self._days.get(day)
+        if cached is None:
+            cached = self._days[day] = {"totals": {}, "offset": 0}
+        try:
+            size = os.path.getsize(self._day_path(day))
+        except OSError:
+            return cached["totals"]
+        if size < cached["offset"]:
+            # 文件被截断或替换，重新读取
+            cached["totals"].clear()
+            cached["offset"] = 0
+        if size > cached["offset"]:
+            with open(self._day_path(day), 'rb') as f:
+                f.seek(cached["offset"])
+                data = f.read(size - cached["offset"])
+            # 其他进程可能正在写入最后一行，只读取到最后一个换行符
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._accumulate(cached["totals"], entry)
+                if entry.get("id"):
+                    self._seen_ids.add(entry["id"])
+            cached["offset"] += end
+        return cached["totals"]
+
+    @staticmethod
+    def _accumulate(totals, entry):
+        row = totals.setdefault((entry.get("m", ""), entry.get("w", "")), [0, 0, 0, 0, 0.0])
+        row[0] += 1
+        row[1] += entry.get("p", 0)
+        row[2] += entry.get("c", 0)
+        row[3] += entry.get("k", 0)
+        row[4] += entry.get("$", 0.0)
+
+    def record(self, settings, model, workflow, usage, dedupe_id=None):
+        """
+        记录一次调用的用量，返回本次的 {prompt_tokens, completion_tokens, cached_tokens, cost}
+
+        usage 可以是响应中的 usage 对象/字典；为空时不记录并返回None。
+        dedupe_id 相同的记录只计一次（用于多次取回的批处理结果）。
+        """
+        counts = usage_from_response(usage)
+        if counts is None:
+            return None
+        prompt_tokens, completion_tokens, cached_tokens = counts
+        cost = estimate_cost(settings, model, prompt_tokens, completion_tokens, cached_tokens)
+        result = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "cached_tokens": cached_tokens, "cost": cost}
+
+        now = time.time()
+        entry = {"t": round(now, 3), "m": model or "", "w": workflow or "", "p": prompt_tokens,
+                 "c": completion_tokens, "k": cached_tokens, "$": cost}
+        with self._lock:
+            if dedupe_id:
+                for offset in range(DEDUPE_DAYS):
+                    self._ensure_day(_day_of(now - offset * 86400))
+                if dedupe_id in self._seen_ids:
+                    return result
+                entry["id"] = dedupe_id
+                self._seen_ids.add(dedupe_id)
+            day = _day_of(now)
+            try:
+                os.makedirs(self.usage_dir, exist_ok=True)
+                with open(self._day_path(day), 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+                # 连同其他进程新写入的记录一起读回汇总
+                self._ensure_day(day)
+            except Exception as e:
+                logger.warning("警告: 写入用量记录失败 - %s", e)
+                self._accumulate(self._ensure_day(day), entry)
+        return result
+
+    def spent_today(self):
+        """今天已产生的费用"""
+        with self._lock:
+            return sum(row[4] for row in self._ensure_day(_day_of(time.time())).values())
+
+    def admit(self, settings):
+        """
+        在发送请求前检查每日预算
+
+        未超预算时直接返回None；超出后按 budgetAction 处理：
+        refuse 返回错误信息，throttle 让请求按 budgetThrottleInterval 的间隔依次放行（阻塞等待）。
+        """
+        budget, action, interval = _budget_settings(settings)
+        if budget <= 0:
+            return None
+        spent = self.spent_today()
+        if spent < budget:
+            return None
+        if action == "refuse":
+            return f"错误: 今日费用 {spent:.4f} 已超出每日预算 {budget:.4f}，请求已被拒绝。"
+
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + interval
+        wait = slot - now
+        if wait > 0:
+            logger.info("今日费用 %.4f 已超出每日预算 %.4f，限流等待 %.1f 秒", spent, budget, wait)
+            time.sleep(wait)
+        return None
+
+    def summary(self, days=7, settings=None):
+        """汇总最近 days 天的用量：按天、按模型、按工作流和合计"""
+        days = max(1, int(days))
+        now = time.time()
+        by_day, by_model, by_workflow = {}, {}, {}
+        total = dict.fromkeys(_FIELDS, 0)
+
+        def add(bucket, row):
+            for field, value in zip(_FIELDS, row):
+                bucket[field] = bucket.get(field, 0) + value
+
+        with self._lock:
+            for offset in range(days):
+                day = _day_of(now - offset * 86400)
+                totals = self._ensure_day(day)
+                if not totals:
+                    continue
+                for (model, workflow), row in totals.items():
+                    add(by_day.setdefault(day, {}), row)
+                    add(by_model.setdefault(model, {}), row)
+                    add(by_workflow.setdefault(workflow or "未知", {}), row)
+                    add(total, row)
+            today = dict.fromkeys(_FIELDS, 0)
+            for row in self._ensure_day(_day_of(now)).values():
+                add(today, row)
+
+        for bucket in [total, today] + list(by_day.values()) + list(by_model.values()) + list(by_workflow.values()):
+            bucket["cost"] = round(bucket.get("cost", 0), 6)
+
+        result = {"days": by_day, "models": by_model, "workflows": by_workflow, "total": total, "today": today}
+        if settings is not None:
+            budget, action, _ = _budget_settings(settings)
+            result["budget"] = {
+                "dailyBudget": budget,
+                "action": action,
+                "remaining": round(budget - today["cost"], 6) if budget > 0 else None,
+                "exceeded": budget > 0 and today["cost"] >= budget,
+            }
+        return result
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_usage_store():
+    """获取共享的用量存储"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UsageStore()
+        return _store
@@ -0,0 +1,112 @@
+"""
+连接预热
+在插件加载和保存设置后，于后台线程预先解析API地址的域名并建立连接（发送一次 /models 请求），
+使第一次对话请求不必承担DNS、TCP和TLS握手的开销。需要在settings.json中设置 connectionWarmup 为 true 开启。
+"""
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from .api_client import resolve_api_key, sanitize_base_url, use_openai_client
+from .logger import get_logger
+from .transport import get_transport_mode
+
+logger = get_logger("warmup")
+
+# 预热请求的超时时间（秒）
+WARMUP_TIMEOUT = 10
+# 同一地址在该间隔（秒）内不重复预热，避免前端频繁自动保存设置时反复请求
+WARMUP_MIN_INTERVAL = 30
+
+_results = {}
+_in_progress = set()
+_lock = threading.Lock()
+
+
+def warmup_enabled(settings):
+    """是否开启了连接预热（仅在直连模式下有效）"""
+    return bool(settings.get("connectionWarmup")) and get_transport_mode(settings) == "live"
+
+
+def warm_up(settings, on_models=None):
+    """
+    同步预热一次，返回结果字典：
+    url、dns_ms（域名解析耗时）、request_ms（请求耗时，包含建立连接）、ok、error、at
+
+    预热请求就是 /models，请求成功时把返回的模型ID列表交给 on_models（如模型列表缓存），避免再请求一次。
+    """
+    base_url = sanitize_base_url(settings.get("apiUrl"))
+    parsed = urlparse(base_url)
+    result = {"url": base_url, "dns_ms": None, "request_ms": None, "ok": False, "error": None, "at": time.time()}
+    models = None
+
+    try:
+        started = time.perf_counter()
+        socket.getaddrinfo(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80),
+                           proto=socket.IPPROTO_TCP)
+        result["dns_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        # 使用与对话请求相同的客户端，预热后的连接留在其连接池中供后续请求复用
+        with use_openai_client(settings) as client:
+            started = time.perf_counter()
+            try:
+                page = client.with_options(timeout=WARMUP_TIMEOUT, max_retries=0).models.list()
+                models = [model.id for model in page]
+            except Exception as e:
+                # 网关不支持 /models 等状态码错误也说明连接已建立
+                if openai is None or not isinstance(e, openai.APIStatusError):
+                    raise
+        result["request_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result["ok"] = True
+        logger.info("连接预热完成: %s（DNS %s ms，请求 %s ms）",
+                    parsed.hostname, result['dns_ms'], result['request_ms'])
+    except Exception as e:
+        result["error"] = str(e)
+        logger.warning("警告: 连接预热失败 - %s", e)
+
+    with _lock:
+        _results[base_url] = result
+    if models is not None and on_models:
+        on_models(models)
+    return result
+
+
+def start_warmup(settings, on_done=None, on_models=None):
+    """
+    在后台线程中预热（未开启、缺少配置或近期已预热时不启动）
+
+    on_models 见 warm_up；on_done 在预热结束后于同一线程中调用。返回是否启动了预热。
+    """
+    if not warmup_enabled(settings) or not settings.get("apiUrl") or not resolve_api_key(settings):
+        return False
+    base_url = sanitize_base_url(settings.get("apiUrl"))
+    with _lock:
+        last = _results.get(base_url)
+        if base_url in _in_progress or (last and last["ok"] and time.time() - last["at"] < WARMUP_MIN_INTERVAL):
+            return False
+        _in_progress.add(base_url)
+
+    def run():
+        try:
+            warm_up(settings, on_models)
+        finally:
+            with _lock:
+                _in_progress.discard(base_url)
+            if on_done:
+                on_done()
+
+    threading.Thread(target=run, name="yunlan-warmup", daemon=True).start()
+    return True
+
+
+def warmup_status():
+    """返回各地址最近一次预热的结果"""
+    with _lock:
+        return {url: dict(result) for url, result in _results.items()}
@@ -0,0 +1,169 @@
+"""
+本地批处理接口桩服务
+在 127.0.0.1 上实现 /v1/files 与 /v1/batches 的最小子集，用于测试 batch_jobs 的提交与轮询流程。
+安装了 openai 时使用真实客户端访问；否则使用基于 httpx 的同名接口的小客户端。
+"""
+
+import email.parser
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import httpx
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+
+class BatchStubServer:
+    """
+    批处理接口桩服务
+
+    任务创建后保持 in_progress，由测试调用 finish() 结束：
+    为每个请求生成回复，drop 中的 custom_id 不写入结果文件，
+    errors 中的 custom_id 按 {custom_id: 状态码} 写入错误文件。
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.batches = {}
+        self.requests = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _new_id(self, prefix):
+        with self._lock:
+            return f"{prefix}-{next(self._ids)}"
+
+    def input_lines(self, batch_id):
+        """任务上传的请求行"""
+        text = self.files[self.batches[batch_id]["input_file_id"]]
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    def finish(self, batch_id, status="completed", drop=(), errors=None):
+        batch = self.batches[batch_id]
+        errors = errors or {}
+        if errors:
+            error_lines = [json.dumps({"custom_id": custom_id, "response": {
+                "status_code": code, "body": {"error": {"message": f"状态码 {code}"}}}})
+                for custom_id, code in errors.items()]
+            file_id = self._new_id("file")
+            self.files[file_id] = "\n".join(error_lines) + "\n"
+            batch["error_file_id"] = file_id
+        if status == "completed":
+            lines = []
+            for line in self.input_lines(batch_id):
+                if line["custom_id"] in drop or line["custom_id"] in errors:
+                    continue
+                body = {"choices": [{"message": {"role": "assistant", "content": f"回复 {line['custom_id']}"}}],
+                        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
+                lines.append(json.dumps({"custom_id": line["custom_id"],
+                                         "response": {"status_code": 200, "body": body}}))
+            file_id = self._new_id("file")
+            self.files[file_id] = "\n".join(lines) + "\n"
+            batch["output_file_id"] = file_id
+        batch["status"] = status
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload, content_type="application/json"):
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def do_POST(self):
+                stub.requests.append(("POST", self.path))
+                if self.path == "/v1/files":
+                    raw = b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + self._body()
+                    message = email.parser.BytesParser().parsebytes(raw)
+                    parts = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                             for part in message.get_payload()}
+                    file_id = stub._new_id("file")
+                    stub.files[file_id] = parts["file"].decode("utf-8")
+                    return self._reply(200, {"id": file_id, "object": "file", "bytes": len(parts["file"]),
+                                             "created_at": 0, "filename": "input.jsonl",
+                                             "purpose": parts["purpose"].decode()})
+                if self.path == "/v1/batches":
+                    body = json.loads(self._body())
+                    batch_id = stub._new_id("batch")
+                    stub.batches[batch_id] = {"id": batch_id, "object": "batch", "endpoint": body["endpoint"],
+                                              "input_file_id": body["input_file_id"],
+                                              "completion_window": body["completion_window"],
+                                              "status": "in_progress", "created_at": 0,
+                                              "output_file_id": None, "error_file_id": None}
+                    return self._reply(200, stub.batches[batch_id])
+                self._reply(404, {"error": {"message": "not found"}})
+
+            def do_GET(self):
+                stub.requests.append(("GET", self.path))
+                parts = self.path.strip("/").split("/")
+                if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in stub.batches:
+                    return self._reply(200, stub.batches[parts[2]])
+                if parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" \
+                        and parts[2] in stub.files:
+                    return self._reply(200, stub.files[parts[2]].encode("utf-8"), "application/octet-stream")
+                self._reply(404, {"error": {"message": "not found"}})
+
+        return Handler
+
+
+class _HttpxBatchClient:
+    """没有安装 openai 时使用的小客户端，只实现 batch_jobs 用到的接口"""
+
+    def __init__(self, base_url):
+        http = httpx.Client(base_url=base_url, timeout=10)
+
+        def create_file(file, purpose):
+            response = http.post("/files", files={"file": ("input.jsonl", file.read())}, data={"purpose": purpose})
+            response.raise_for_status()
+            return SimpleNamespace(**response.json())
+
+        def file_content(file_id):
+            response = http.get(f"/files/{file_id}/content")
+            response.raise_for_status()
+            return SimpleNamespace(text=response.text)
+
+        def create_batch(**body):
+            response = http.post("/batches", json=body)
+            response.raise_for_status()
+            return SimpleNamespace(**response.json())
+
+        def retrieve_batch(batch_id):
+            response = http.get(f"/batches/{batch_id}")
+            response.raise_for_status()
+            return SimpleNamespace(**response.json())
+
+        self.files = SimpleNamespace(create=create_file, content=file_content)
+        self.batches = SimpleNamespace(create=create_batch, retrieve=retrieve_batch)
+
+
+def make_client(base_url):
+    if openai is not None:
+        return openai.OpenAI(base_url=base_url, api_key="test", max_retries=0)
+    return _HttpxBatchClient(base_url)
@@ -0,0 +1,15 @@
+"""
+测试配置
+把 nodes 目录注册为包 yunlan_nodes，测试直接导入各模块，不经过依赖ComfyUI的插件入口。
+"""
+
+import os
+import sys
+import types
+
+NODES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nodes")
+
+if "yunlan_nodes" not in sys.modules:
+    package = types.ModuleType("yunlan_nodes")
+    package.__path__ = [NODES_DIR]
+    sys.modules["yunlan_nodes"] = package
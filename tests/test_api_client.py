@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import pytest
+
+from yunlan_nodes import api_client
+
+
+class FakeClient:
+    def __init__(self, api_key, base_url, http_client):
+        self.base_url = base_url
+        self.http_client = http_client
+        self.close_calls = 0
+
+    def close(self):
+        self.close_calls += 1
+
+
+@pytest.fixture(autouse=True)
+def fake_openai(monkeypatch):
+    monkeypatch.setattr(api_client, "openai", SimpleNamespace(OpenAI=FakeClient))
+    monkeypatch.setattr(api_client, "_clients", {})
+    monkeypatch.setattr(api_client, "_in_use", {})
+    monkeypatch.setattr(api_client, "_retired", {})
+
+
+def settings(n):
+    return {"apiKey": "k", "apiUrl": f"http://127.0.0.1/{n}"}
+
+
+def test_idle_evicted_clients_are_closed():
+    clients = [api_client.get_openai_client(settings(n)) for n in range(api_client.MAX_CACHED_CLIENTS + 2)]
+
+    assert [c.close_calls for c in clients] == [1, 1] + [0] * api_client.MAX_CACHED_CLIENTS
+    assert api_client.get_openai_client(settings(api_client.MAX_CACHED_CLIENTS + 1)) is clients[-1]
+
+
+def test_client_in_use_is_closed_after_last_release():
+    with api_client.use_openai_client(settings(0)) as busy:
+        second = api_client.acquire_openai_client(settings(0))
+        assert second is busy
+        for n in range(1, api_client.MAX_CACHED_CLIENTS + 1):
+            api_client.get_openai_client(settings(n))
+        # 已被淘汰，但仍有两个使用者
+        assert api_client.get_openai_client(settings(0)) is not busy
+        assert busy.close_calls == 0
+        api_client.release_openai_client(second)
+        assert busy.close_calls == 0
+    assert busy.close_calls == 1
+    assert not api_client._in_use and not api_client._retired
+
+
+def test_released_client_that_was_not_evicted_stays_open():
+    with api_client.use_openai_client(settings(0)) as client:
+        pass
+    assert client.close_calls == 0
+    assert api_client.get_openai_client(settings(0)) is client
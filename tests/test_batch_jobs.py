@@ -0,0 +1,112 @@
+import json
+import os
+
+import pytest
+
+from batch_stub import BatchStubServer, make_client
+from yunlan_nodes.batch_jobs import BatchJobManager, request_custom_id
+
+
+def body(n):
+    return {"model": "gpt-4o", "messages": [{"role": "user", "content": f"问题 {n}"}], "max_tokens": 16}
+
+
+@pytest.fixture
+def stub():
+    with BatchStubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return BatchJobManager(str(tmp_path / "batches"))
+
+
+def test_submit_poll_and_lookup(stub, manager):
+    client = make_client(stub.base_url)
+    ids = [manager.enqueue(body(n)) for n in range(3)]
+    assert manager.enqueue(body(0)) == ids[0] and manager.pending_count() == 3
+
+    batch_id = manager.submit(client)
+    assert [line["custom_id"] for line in stub.input_lines(batch_id)] == ids
+    assert manager.poll(client) == 1
+    assert manager.request_status(ids[0]) == "in_progress"
+
+    stub.finish(batch_id)
+    assert manager.poll(client) == 0
+    record = manager.lookup(ids[1])
+    assert record["message"]["content"] == f"回复 {ids[1]}"
+    assert record["usage"]["total_tokens"] == 15
+
+    # 重新加载后仍能取回结果
+    assert BatchJobManager(manager.batch_dir).request_status(ids[2]) == "completed"
+
+
+def test_submit_without_pending_file(manager, stub):
+    manager.enqueue(body(0))
+    manager.enqueue(body(1))
+    os.remove(manager.pending_path)
+    assert manager.submit(make_client(stub.base_url)) is None
+    assert manager.pending_count() == 0
+    assert manager.needs_enqueue(request_custom_id(body(0)))
+    assert not any(path == "/v1/files" for _, path in stub.requests)
+
+
+def test_missing_results_are_marked_failed_and_can_be_requeued(stub, manager):
+    client = make_client(stub.base_url)
+    kept, dropped = manager.enqueue(body(0)), manager.enqueue(body(1))
+    batch_id = manager.submit(client)
+    stub.finish(batch_id, drop={dropped})
+    manager.poll(client)
+
+    assert manager.request_status(kept) == "completed"
+    assert manager.request_status(dropped) == "failed"
+    assert manager.needs_enqueue(dropped) and not manager.needs_enqueue(kept)
+    assert manager.summary()["jobs"][batch_id]["failed"] == 1
+
+    # 重新排队后以最近的任务状态为准，不会重复排队
+    manager.enqueue(body(1))
+    second = manager.submit(client)
+    assert manager.request_status(dropped) == "in_progress"
+    assert not manager.needs_enqueue(dropped)
+    stub.finish(second)
+    manager.poll(client)
+    assert manager.lookup(dropped)["batch_id"] == second
+
+
+def test_expired_job_requests_can_be_requeued(stub, manager):
+    client = make_client(stub.base_url)
+    custom_id = manager.enqueue(body(0))
+    batch_id = manager.submit(client)
+    stub.finish(batch_id, status="expired")
+    assert manager.poll(client) == 0
+    assert manager.request_status(custom_id) == "failed"
+    assert manager.needs_enqueue(custom_id)
+    with open(manager.state_path, encoding="utf-8") as f:
+        assert json.load(f)["jobs"][batch_id]["failed_ids"] == [custom_id]
+
+
+def test_errored_request_is_resubmitted_and_then_succeeds(stub, manager):
+    client = make_client(stub.base_url)
+    ok, flaky = manager.enqueue(body(0)), manager.enqueue(body(1))
+    first = manager.submit(client)
+    stub.finish(first, errors={flaky: 429})
+    manager.poll(client)
+
+    assert manager.request_status(ok) == "completed"
+    assert manager.request_status(flaky) == "failed"
+    assert manager.lookup(flaky) is None
+    assert "429" in str(manager.last_error(flaky))
+    assert manager.needs_enqueue(flaky)
+    # 重新加载后错误记录不会被当作结果
+    assert BatchJobManager(manager.batch_dir).needs_enqueue(flaky)
+
+    manager.enqueue(body(1))
+    assert manager.last_error(flaky) is None
+    second = manager.submit(client)
+    assert [line["custom_id"] for line in stub.input_lines(second)] == [flaky]
+    stub.finish(second)
+    manager.poll(client)
+    assert manager.request_status(flaky) == "completed"
+    assert manager.lookup(flaky)["message"]["content"] == f"回复 {flaky}"
+    assert BatchJobManager(manager.batch_dir).request_status(flaky) == "completed"
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from yunlan_nodes.batch_select import indices_as_slice, parse_index_spec, select_frames
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("0:8:2", [0, 2, 4, 6]),
+    ("2:", [2, 3, 4, 5, 6, 7, 8, 9]),
+    ("::-3", [9, 6, 3, 0]),
+    ("0:2，8:", [0, 1, 8, 9]),
+    ("3, 3", [3, 3]),
+])
+def test_ranges_and_lists(spec, expected):
+    assert parse_index_spec(spec, 10) == expected
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("-1", [9]),
+    ("-3:", [7, 8, 9]),
+    ("-2:-5:-1", [8, 7, 6]),
+])
+def test_negative_indices_count_from_the_end(spec, expected):
+    assert parse_index_spec(spec, 10) == expected
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("25", [9]),
+    ("-25", [0]),
+    ("20:30", [9]),
+    ("5:100:2", [5, 7, 9]),
+])
+def test_out_of_range_indices_are_clamped(spec, expected):
+    assert parse_index_spec(spec, 10) == expected
+
+
+@pytest.mark.parametrize("spec", ["", "   ", None])
+def test_empty_spec_selects_all_frames(spec):
+    assert parse_index_spec(spec, 4) == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize("spec", [",", " , ", "，,", "a", "1:2:0", "1:2:3:4"])
+def test_invalid_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        parse_index_spec(spec, 10)
+
+
+def test_indices_as_slice():
+    assert indices_as_slice([2, 4, 6]) == slice(2, 7, 2)
+    assert indices_as_slice([5]) == slice(5, 6, 1)
+    assert indices_as_slice([3, 1]) is None
+    assert indices_as_slice([0, 1, 3]) is None
+
+
+def test_select_frames_returns_a_view_for_even_steps():
+    images = np.arange(10 * 2).reshape(10, 2)
+    frames, indices = select_frames(images, "1:9:3")
+    assert indices == [1, 4, 7]
+    assert frames.tolist() == images[[1, 4, 7]].tolist()
+    assert np.shares_memory(frames, images)
+
+
+def test_select_frames_rejects_separator_only_spec():
+    with pytest.raises(ValueError):
+        select_frames(np.zeros((4, 2)), " , ")
+
+
+def test_select_frames_gathers_irregular_indices():
+    torch = pytest.importorskip("torch")
+    images = torch.arange(10).reshape(10, 1)
+    frames, indices = select_frames(images, "3,0,-1")
+    assert indices == [3, 0, 9]
+    assert frames.flatten().tolist() == [3, 0, 9]
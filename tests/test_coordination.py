@@ -0,0 +1,61 @@
+import multiprocessing
+import sqlite3
+import time
+
+import pytest
+
+from yunlan_nodes import coordination
+from yunlan_nodes.coordination import Coordinator
+
+SETTINGS = {"coordinationEnabled": True, "maxConcurrentRequests": 1, "coordinationTimeout": 2,
+            "apiUrl": "http://127.0.0.1:1/v1", "apiKey": "test"}
+
+
+def _dead_pid():
+    process = multiprocessing.get_context("spawn").Process(target=time.sleep, args=(0,))
+    process.start()
+    process.join()
+    return process.pid
+
+
+def _insert_lease(db_path, host, pid, expires_at):
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO leases (scope, worker, acquired_at, expires_at, host, pid) VALUES (?, ?, ?, ?, ?, ?)",
+                 (coordination.coordination_scope(SETTINGS), f"{host}:{pid}", time.time(), expires_at, host, pid))
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def coordinator(tmp_path):
+    coordinator = Coordinator(str(tmp_path / "coordination.db"))
+    coordinator.status(SETTINGS)
+    coordinator._connect()
+    return coordinator
+
+
+@pytest.mark.skipif(coordination.os.name == "nt", reason="Windows 上只依赖续期超时回收")
+def test_lease_of_dead_local_process_is_reclaimed(coordinator):
+    _insert_lease(coordinator.db_path, coordinator.host, _dead_pid(), time.time() + 3600)
+    with coordinator.slot(SETTINGS) as lease:
+        assert lease.lease_id is not None
+    assert coordinator.status(SETTINGS)["counters"]["expired_leases"] == 1
+
+
+def test_lease_of_live_process_blocks_until_it_expires(coordinator, monkeypatch):
+    _insert_lease(coordinator.db_path, "other-host", 1, time.time() + 3600)
+    monkeypatch.setitem(SETTINGS, "coordinationTimeout", 0.2)
+    with pytest.raises(coordination.CoordinationTimeout):
+        coordinator.acquire(SETTINGS)
+
+
+def test_held_leases_are_renewed(coordinator, monkeypatch):
+    monkeypatch.setattr(coordination, "LEASE_RENEW_INTERVAL", 0.05)
+    monkeypatch.setattr(coordination, "LEASE_TTL", 0.3)
+    with coordinator.slot(SETTINGS) as lease:
+        time.sleep(0.6)
+        conn = sqlite3.connect(coordinator.db_path)
+        expires_at = conn.execute("SELECT expires_at FROM leases WHERE id = ?", (lease.lease_id,)).fetchone()[0]
+        conn.close()
+        assert expires_at > time.time()
+    assert not coordinator._held
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from yunlan_nodes.image_encoder import FrameEncodeError, ImageEncodeService, encode_png_data_url, frame_to_uint8
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    return [rng.random((64, 64, 3)).astype(np.float32) for _ in range(3)]
+
+
+def expected(frames):
+    return [encode_png_data_url(frame_to_uint8(frame)) for frame in frames]
+
+
+def test_small_batch_is_encoded_inline(frames):
+    service = ImageEncodeService()
+    assert service.encode_frames(frames) == expected(frames)
+    assert service._threads is None
+
+
+def test_thread_pool_keeps_order(frames):
+    service = ImageEncodeService(thread_pixel_threshold=1)
+    try:
+        assert service.encode_frames(frames) == expected(frames)
+        assert service._threads is not None
+    finally:
+        service.shutdown()
+
+
+@pytest.mark.parametrize("thread_pixel_threshold", [10 ** 9, 1])
+def test_failed_frame_is_reported_by_index(frames, thread_pixel_threshold):
+    service = ImageEncodeService(thread_pixel_threshold=thread_pixel_threshold)
+    bad = np.zeros((4, 4, 7), dtype=np.uint8)
+    try:
+        with pytest.raises(FrameEncodeError) as info:
+            service.encode_frames([frames[0], bad, frames[1]])
+    finally:
+        service.shutdown()
+    assert list(info.value.failures) == [1]
+    assert "第2帧" in str(info.value)
+
+
+def test_request_reports_input_positions_of_duplicates(frames):
+    bad = np.zeros((4, 4, 7), dtype=np.uint8)
+    with pytest.raises(FrameEncodeError, match="第2、4张图片"):
+        ImageEncodeService().encode_for_request([frames[0], bad, frames[1], bad.copy()])
@@ -0,0 +1,63 @@
+import pytest
+
+from yunlan_nodes.image_grid import _fit_size, compute_grid_layout
+
+
+def test_layout_with_padding():
+    layout = compute_grid_layout(3, (100, 200), max_cell_size=100, padding=4)
+    assert (layout["rows"], layout["columns"]) == (2, 2)
+    assert (layout["cell_height"], layout["cell_width"]) == (50, 100)
+    assert (layout["height"], layout["width"]) == (104, 204)
+
+
+def test_layout_does_not_upscale_and_respects_columns():
+    layout = compute_grid_layout(5, (64, 32), columns=5, max_cell_size=512)
+    assert (layout["rows"], layout["columns"]) == (1, 5)
+    assert (layout["cell_height"], layout["cell_width"]) == (64, 32)
+    assert (layout["height"], layout["width"]) == (64, 160)
+
+
+@pytest.mark.parametrize("size, fit_mode, expected", [
+    ((100, 100), "适应", (50, 50)),
+    ((100, 100), "填充", (100, 100)),
+    ((100, 100), "拉伸", (50, 100)),
+    ((50, 400), "适应", (12, 100)),
+    ((50, 400), "填充", (50, 400)),
+    ((100, 200), "适应", (50, 100)),
+])
+def test_fit_size_for_mixed_inputs(size, fit_mode, expected):
+    assert _fit_size(*size, 50, 100, fit_mode) == expected
+
+
+def test_compose_grid_mixed_sizes_with_padding():
+    torch = pytest.importorskip("torch")
+    from yunlan_nodes.image_grid import compose_grid
+
+    wide = torch.full((1, 100, 200, 3), 0.5)
+    square = torch.ones((2, 100, 100, 3))
+    grid = compose_grid([wide, square], max_cell_size=100, padding=4, background=0.0)
+
+    assert grid.shape == (1, 104, 204, 3)
+    # 第一格铺满，格间距保持背景色
+    assert torch.allclose(grid[0, :50, :100], torch.tensor(0.5))
+    assert grid[0, :, 100:104].abs().max() == 0
+    assert grid[0, 50:54, :].abs().max() == 0
+    # 正方形图片在 50x100 的格子里适应为 50x50 并水平居中
+    second = grid[0, :50, 104:]
+    assert second[:, :25].abs().max() == 0
+    assert torch.allclose(second[:, 25:75], torch.tensor(1.0))
+    assert second[:, 75:].abs().max() == 0
+    third = grid[0, 54:, :100]
+    assert torch.allclose(third[:, 25:75], torch.tensor(1.0))
+    # 最后一格没有图片，保持背景色
+    assert grid[0, 54:, 104:].abs().max() == 0
+
+
+def test_compose_grid_fill_crops_to_cell():
+    torch = pytest.importorskip("torch")
+    from yunlan_nodes.image_grid import compose_grid
+
+    grid = compose_grid([torch.ones((1, 100, 200, 3)), torch.ones((1, 100, 100, 1))],
+                        fit_mode="填充", max_cell_size=100, padding=2)
+    assert grid.shape == (1, 50, 202, 3)
+    assert torch.allclose(grid[0, :, 102:], torch.tensor(1.0))
@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from yunlan_nodes import warmup
+from yunlan_nodes.model_catalog import ModelCatalog, merge_model_lists
+
+
+def test_static_models_are_kept_first_even_when_gateway_lacks_them():
+    static = ["gpt-4o", "my-finetune", "gpt-4o-mini"]
+    live = ["gpt-4o-mini", "o3", "gpt-4o", "claude-x"]
+    assert merge_model_lists(static, live) == ["gpt-4o", "my-finetune", "gpt-4o-mini", "claude-x", "o3"]
+
+
+def test_without_gateway_list_static_list_is_returned():
+    assert merge_model_lists(["a", "b", "a"], []) == ["a", "b"]
+    assert merge_model_lists(["a"], None) == ["a"]
+
+
+SETTINGS = {"apiUrl": "http://127.0.0.1:9/v1", "apiKey": "k"}
+
+
+def failing_fetcher(settings):
+    raise AssertionError("不应再次请求 /models")
+
+
+def test_update_fills_cache_without_fetching():
+    catalog = ModelCatalog(fetcher=failing_fetcher)
+    catalog.update(SETTINGS, ["b", "a", "b"])
+    assert catalog.cached_models(SETTINGS) == ["a", "b"]
+    assert not catalog.status(SETTINGS)["refreshing"]
+
+
+def test_failed_update_keeps_previous_list():
+    catalog = ModelCatalog(fetcher=failing_fetcher)
+    catalog.update(SETTINGS, ["a"])
+    catalog.update(SETTINGS, None, error="boom")
+    assert catalog.status(SETTINGS)["live"] == ["a"]
+    assert catalog.status(SETTINGS)["error"] == "boom"
+
+
+def test_warmup_response_is_handed_to_the_catalog(monkeypatch):
+    class Client:
+        def with_options(self, **kwargs):
+            return self
+
+        @property
+        def models(self):
+            return self
+
+        def list(self):
+            return [SimpleNamespace(id="m2"), SimpleNamespace(id="m1")]
+
+    @contextmanager
+    def use_client(settings):
+        yield Client()
+
+    monkeypatch.setattr(warmup, "use_openai_client", use_client)
+    monkeypatch.setattr(warmup.socket, "getaddrinfo", lambda *args, **kwargs: [])
+    catalog = ModelCatalog(fetcher=failing_fetcher)
+
+    result = warmup.warm_up(SETTINGS, on_models=lambda models: catalog.update(SETTINGS, models))
+    assert result["ok"]
+    assert catalog.cached_models(SETTINGS) == ["m1", "m2"]
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import pytest
+
+from yunlan_nodes import response_images
+from yunlan_nodes.response_images import _load_image_bytes, extract_images_from_message
+
+DATA_URL = "data:image/png;base64,iVBORw0KGgo="
+
+
+def test_links_are_kept_in_text_and_ignored_by_default():
+    text = f"结果如下 ![图](http://169.254.169.254/latest/meta-data) 以及 {DATA_URL}"
+    extracted, sources = extract_images_from_message(text)
+    assert extracted == "结果如下 ![图](http://169.254.169.254/latest/meta-data) 以及 [图片]"
+    assert sources == [DATA_URL]
+
+
+def test_base64_payload_is_removed_from_text():
+    payload = "iVBORw0KGgo" + "A" * 40000
+    text = f"第一张:\ndata:image/png;base64,{payload}\n第二张: ![图](data:image/jpeg;base64,{payload})。"
+    extracted, sources = extract_images_from_message(text)
+    assert payload[:32] not in extracted and "base64" not in extracted
+    assert extracted == "第一张:\n[图片]\n第二张: ![图]([图片])。"
+    assert len(sources) == 2 and sources[0] == f"data:image/png;base64,{payload}"
+
+
+def test_markdown_data_url_is_collected_once():
+    _, sources = extract_images_from_message(f"![图]({DATA_URL})")
+    assert sources == [DATA_URL]
+
+
+def test_structured_parts_and_images_field():
+    message = SimpleNamespace(
+        content=[{"type": "text", "text": "hi"},
+                 {"type": "image_url", "image_url": {"url": DATA_URL}},
+                 {"type": "image_url", "image_url": {"url": "https://example.com/a.png"}}],
+        images=[{"type": "image_url", "image_url": {"url": DATA_URL}}],
+    )
+    text, sources = extract_images_from_message(message)
+    assert text == "hi"
+    assert sources == [DATA_URL, DATA_URL]
+
+    _, sources = extract_images_from_message(message, allow_remote=True)
+    assert "https://example.com/a.png" in sources
+
+
+def test_links_collected_only_when_allowed():
+    _, sources = extract_images_from_message("![图](https://example.com/a.png)", allow_remote=True)
+    assert sources == ["https://example.com/a.png"]
+
+
+def test_remote_download_refused_unless_enabled(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("不应发起网络请求")
+
+    monkeypatch.setattr(response_images, "_download", fail)
+    with pytest.raises(ValueError):
+        _load_image_bytes("http://127.0.0.1/a.png")
+    assert _load_image_bytes(DATA_URL).startswith(b"\x89PNG")
+
+
+def test_remote_images_setting():
+    assert not response_images.remote_images_enabled({})
+    assert response_images.remote_images_enabled({"remoteImageDownload": True})
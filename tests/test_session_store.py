@@ -0,0 +1,51 @@
+import json
+import os
+import time
+
+from yunlan_nodes.session_store import ConversationSessionStore, strip_history_images
+
+IMAGE = {"type": "image_url", "image_url": {"url": "data:image/png;base64," + "A" * 4096}}
+
+
+def user(text, image=False):
+    return {"role": "user", "content": [{"type": "text", "text": text}] + ([IMAGE] if image else [])}
+
+
+def test_only_last_user_turn_keeps_images(tmp_path):
+    store = ConversationSessionStore(str(tmp_path))
+    history = store.append_turn("s", [], user("第一轮", image=True), {"role": "assistant", "content": "a"})
+    assert history[0]["content"][1] is IMAGE
+
+    history = store.append_turn("s", history, user("第二轮", image=True), {"role": "assistant", "content": "b"})
+    placeholder = history[0]["content"][1]
+    assert placeholder["type"] == "text" and placeholder["text"].startswith("[图片 ")
+    assert history[2]["content"][1] is IMAGE
+
+    path = store._session_path("s")
+    with open(path, encoding="utf-8") as f:
+        saved = json.load(f)["history"]
+    assert json.dumps(saved).count("base64") == 1
+
+
+def test_legacy_files_are_stripped_on_load(tmp_path):
+    store = ConversationSessionStore(str(tmp_path))
+    legacy = [user("1", True), {"role": "assistant", "content": "a"}, user("2", True),
+              {"role": "assistant", "content": "b"}]
+    store._save_to_disk("old", legacy)
+    loaded = ConversationSessionStore(str(tmp_path)).get_history("old")
+    assert loaded == strip_history_images(legacy)
+    assert loaded[2]["content"][1]["type"] == "image_url"
+
+
+def test_session_files_are_capped_by_count_and_age(tmp_path):
+    store = ConversationSessionStore(str(tmp_path), max_files=3, max_age_days=1)
+    now = time.time()
+    for n in range(5):
+        store._save_to_disk(f"s{n}", [])
+        os.utime(store._session_path(f"s{n}"), (now - 10 * (5 - n), now - 10 * (5 - n)))
+    stale = store._session_path("s4")
+    os.utime(stale, (now - 3 * 86400, now - 3 * 86400))
+
+    store._prune_files(force=True)
+    remaining = sorted(os.listdir(tmp_path))
+    assert remaining == sorted(os.path.basename(store._session_path(f"s{n}")) for n in (1, 2, 3))
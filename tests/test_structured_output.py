@@ -0,0 +1,79 @@
+import pytest
+
+from yunlan_nodes import structured_output
+from yunlan_nodes.structured_output import get_validator, validate_reply
+
+
+@pytest.fixture(autouse=True)
+def builtin_validator(monkeypatch):
+    monkeypatch.setattr(structured_output, "jsonschema", None)
+    monkeypatch.setattr(structured_output, "_validators", structured_output.OrderedDict())
+
+
+PERSON = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "minLength": 1},
+        "age": {"type": "integer", "minimum": 0},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 2},
+    },
+    "required": ["name", "age"],
+    "additionalProperties": False,
+}
+
+
+def test_valid_object_passes():
+    assert get_validator(PERSON)({"name": "云岚", "age": 3, "tags": ["a"]}) == []
+
+
+def test_type_errors_report_the_path():
+    errors = get_validator(PERSON)({"name": 1, "age": 2.5, "tags": ["a", 3]})
+    assert errors == ["$.name: 应为 string 类型", "$.age: 应为 integer 类型", "$.tags[1]: 应为 string 类型"]
+
+
+def test_required_and_additional_properties():
+    errors = get_validator(PERSON)({"name": "x", "extra": True})
+    assert "$: 缺少必填字段 'age'" in errors
+    assert "$.extra: 不允许出现该值" in errors
+
+
+def test_pattern():
+    validate = get_validator({"type": "string", "pattern": r"^\d{3}$"})
+    assert validate("123") == []
+    assert validate("12a") == ["$: 不匹配 ^\\d{3}$"]
+
+
+def test_one_of_requires_exactly_one_match():
+    validate = get_validator({"oneOf": [{"type": "integer"}, {"type": "number"}, {"type": "string"}]})
+    assert validate("a") == []
+    assert validate(1.5) == []
+    assert validate(1) == ["$: 应恰好符合 oneOf 中的一项（实际 2 项）"]
+    assert validate(None) == ["$: 应恰好符合 oneOf 中的一项（实际 0 项）"]
+
+
+def test_validate_reply_accepts_fenced_json():
+    data, errors = validate_reply('```json\n{"name": "a", "age": 1}\n```', PERSON)
+    assert data == {"name": "a", "age": 1} and errors == []
+
+
+@pytest.mark.parametrize("schema", [
+    {"required": 5},
+    {"required": ["a", 1]},
+    {"properties": []},
+    {"properties": {"a": 5}},
+    {"minLength": "a"},
+    {"maxItems": -1},
+    {"minimum": True},
+    {"pattern": 3},
+    {"pattern": "("},
+    {"type": "text"},
+    {"type": 5},
+    {"enum": "ab"},
+    {"oneOf": {}},
+    {"anyOf": []},
+    {"items": 3},
+    {"minItems": 1.5},
+])
+def test_malformed_schemas_are_rejected(schema):
+    with pytest.raises(ValueError, match="无效的JSON Schema"):
+        get_validator(schema)
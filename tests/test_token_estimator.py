@@ -0,0 +1,72 @@
+from yunlan_nodes.token_estimator import get_model_limits, lookup_model_entry, plan_max_tokens
+
+SETTINGS = {
+    "modelLimits": {
+        "gpt-4o": {"contextWindow": 128000, "maxOutputTokens": 16384},
+        "gpt-4": {"contextWindow": 8192, "maxOutputTokens": 4096},
+        "claude-3-5-sonnet": {"contextWindow": 200000, "maxOutputTokens": 8192},
+    }
+}
+
+DEFAULT_LIMITS = {"contextWindow": None, "maxOutputTokens": None}
+
+
+def test_exact_match():
+    assert get_model_limits(SETTINGS, "gpt-4") == {"contextWindow": 8192, "maxOutputTokens": 4096}
+
+
+def test_version_suffixes_match_base_entry():
+    assert get_model_limits(SETTINGS, "gpt-4o-2024-08-06")["contextWindow"] == 128000
+    assert get_model_limits(SETTINGS, "gpt-4-0613")["contextWindow"] == 8192
+    assert get_model_limits(SETTINGS, "claude-3-5-sonnet-20241022")["contextWindow"] == 200000
+
+
+def test_other_models_sharing_a_prefix_use_default_limits():
+    for model in ("gpt-4-turbo", "gpt-4.1", "gpt-4.1-mini", "gpt-4.5-preview", "gpt-4o-mini"):
+        assert get_model_limits(SETTINGS, model) == DEFAULT_LIMITS, model
+
+
+def test_long_prompt_not_refused_for_unconfigured_model():
+    limits = get_model_limits(SETTINGS, "gpt-4.1")
+    assert plan_max_tokens(10000, limits, 0, 2048) == 2048
+
+
+def test_lookup_prefers_longest_matching_entry():
+    table = {"gpt-4": 1, "gpt-4o": 2}
+    assert lookup_model_entry(table, "gpt-4o-2024-05-13") == 2
+    assert lookup_model_entry(table, "unknown") is None
+
+
+def test_encoding_loads_in_background_and_failure_is_cached(monkeypatch):
+    import threading
+    from yunlan_nodes import token_estimator
+
+    release = threading.Event()
+    calls = []
+
+    class SlowTiktoken:
+        @staticmethod
+        def encoding_for_model(model):
+            raise KeyError(model)
+
+        @staticmethod
+        def get_encoding(name):
+            calls.append(name)
+            release.wait(5)
+            raise OSError("offline")
+
+    monkeypatch.setattr(token_estimator, "tiktoken", SlowTiktoken)
+    monkeypatch.setattr(token_estimator, "_encodings", {})
+    monkeypatch.setattr(token_estimator, "_loading", set())
+
+    # 下载期间不阻塞，使用启发式估算
+    assert token_estimator.estimator_name("some-model") == "heuristic"
+    assert token_estimator.estimate_text_tokens("abcdefgh", "some-model") == 2
+    release.set()
+    for _ in range(100):
+        if "some-model" in token_estimator._encodings:
+            break
+        threading.Event().wait(0.01)
+    assert token_estimator._encodings["some-model"] is None
+    token_estimator.estimate_text_tokens("abcd", "some-model")
+    assert calls == ["o200k_base"]
@@ -0,0 +1,37 @@
+import os
+
+from yunlan_nodes.usage_store import UsageStore
+
+SETTINGS = {"modelPrices": {"gpt-4o": {"input": 1000000, "output": 0}}, "dailyBudget": 2, "budgetAction": "refuse"}
+USAGE = {"prompt_tokens": 1, "completion_tokens": 0}
+
+
+def test_budget_sees_records_written_by_other_processes(tmp_path):
+    comfy, cli = UsageStore(str(tmp_path)), UsageStore(str(tmp_path))
+    assert comfy.admit(SETTINGS) is None and cli.admit(SETTINGS) is None
+
+    comfy.record(SETTINGS, "gpt-4o", "wf", USAGE)
+    cli.record(SETTINGS, "gpt-4o", "cli", USAGE)
+    assert comfy.spent_today() == cli.spent_today() == 2
+    assert "每日预算" in comfy.admit(SETTINGS)
+    assert comfy.summary()["workflows"]["cli"]["calls"] == 1
+
+
+def test_partial_line_is_read_once_complete(tmp_path):
+    store = UsageStore(str(tmp_path))
+    store.record(SETTINGS, "gpt-4o", "wf", USAGE)
+    path = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"t":1,"m":"gpt-4o","w":"other","p":1,"c":0,"k":0,"$"')
+    assert store.spent_today() == 1
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(':5.0}\n')
+    assert store.spent_today() == 6
+
+
+def test_dedupe_ids_from_other_process(tmp_path):
+    first, second = UsageStore(str(tmp_path)), UsageStore(str(tmp_path))
+    second.spent_today()
+    first.record(SETTINGS, "gpt-4o", "wf", USAGE, dedupe_id="yl-1")
+    second.record(SETTINGS, "gpt-4o", "wf", USAGE, dedupe_id="yl-1")
+    assert first.spent_today() == second.spent_today() == 1